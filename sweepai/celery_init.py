@@ -1,7 +1,9 @@
 import os
 from celery import Celery
+from celery.concurrency import ALIASES
+from celery.signals import worker_init, worker_process_init
 from loguru import logger
-from sweepai.config.server import REDIS_URL
+from sweepai.config.server import REDIS_URL, VECTOR_EMBEDDING_SOURCE
 from ssl import CERT_NONE
 
 celery_app = Celery(
@@ -9,4 +11,36 @@ celery_app = Celery(
     broker=REDIS_URL,
     backend=REDIS_URL,
     include=['sweepai.api']
-)
\ No newline at end of file
+)
+
+
+def load_models():
+    # Loads the embedding model once per process, before it takes any task
+    if VECTOR_EMBEDDING_SOURCE not in ("sentence-transformers", "onnx"):
+        return
+    try:
+        from sweepai.core.embedding_models import model_registry
+
+        model_registry.warm_up(
+            backend="onnx" if VECTOR_EMBEDDING_SOURCE == "onnx" else "torch"
+        )
+    except Exception as e:
+        logger.warning(f"Could not warm up the embedding model: {e}")
+
+
+@worker_init.connect
+def load_models_in_worker(sender=None, **kwargs):
+    # Eventlet, gevent, thread and solo pools run every task in the worker process itself,
+    # prefork children load their own model after the fork
+    pool_cls = sender.pool_cls
+    if isinstance(pool_cls, str):
+        pool_module = (ALIASES.get(pool_cls) or pool_cls).split(":")[0]
+    else:
+        pool_module = pool_cls.__module__
+    if pool_module != "celery.concurrency.prefork":
+        load_models()
+
+
+@worker_process_init.connect
+def load_models_in_child(**kwargs):
+    load_models()
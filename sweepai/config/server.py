@@ -26,6 +26,10 @@ SENTENCE_TRANSFORMERS_MODEL = os.environ.get(
     "sentence-transformers/all-MiniLM-L6-v2",  # "all-mpnet-base-v2"
 )
 BATCH_SIZE = 32 # Tune this to 32 for sentence-transformers/all-MiniLM-L6-v2 on CPU
+# Number of processes used to chunk files while indexing, set to 1 to chunk serially
+NUM_INDEXING_WORKERS = int(
+    os.environ.get("NUM_INDEXING_WORKERS", min(os.cpu_count() or 1, 16))
+)
 
 ENV = os.environ.get("ENV", "dev")
 # ENV = os.environ.get("MODAL_ENVIRONMENT", "dev")
@@ -141,13 +145,61 @@ HIGHLIGHT_API_KEY = os.environ.get("HIGHLIGHT_API_KEY", None)
 
 VECTOR_EMBEDDING_SOURCE = os.environ.get(
     "VECTOR_EMBEDDING_SOURCE", "sentence-transformers"
-)  # Alternate option is openai or huggingface and set the corresponding env vars
+)  # Alternate option is onnx, openai, huggingface or embedding-server and set the corresponding env vars
+ONNX_NUM_THREADS = int(
+    os.environ.get("ONNX_NUM_THREADS", 0)
+)  # Intra-op threads for the onnx embedding source, 0 lets ONNX Runtime decide
+
+# Remote embedding providers (openai, huggingface)
+OPENAI_EMBEDDING_MAX_TOKENS = int(
+    os.environ.get("OPENAI_EMBEDDING_MAX_TOKENS", 8191)
+)  # Texts are truncated to this many cl100k tokens, the limit of text-embedding-ada-002
+EMBEDDING_API_CONCURRENCY = int(os.environ.get("EMBEDDING_API_CONCURRENCY", 8))
+EMBEDDING_API_REQUESTS_PER_SECOND = float(
+    os.environ.get("EMBEDDING_API_REQUESTS_PER_SECOND", 50)
+)  # 0 disables rate limiting
+EMBEDDING_API_MAX_RETRIES = int(os.environ.get("EMBEDDING_API_MAX_RETRIES", 5))
+
+# Local embedding server, see sweepai/core/embedding_server.py
+EMBEDDING_SERVER_URL = os.environ.get("EMBEDDING_SERVER_URL", "http://127.0.0.1:8081")
+EMBEDDING_SERVER_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_SERVER_MAX_WAIT_MS", 5))
+
+VECTOR_STORE_BACKEND = os.environ.get(
+    "VECTOR_STORE_BACKEND", "deeplake"
+)  # Alternate option is flat, a memory-mapped float16 index
+
+# Flat vector stores with at least this many rows get an approximate (IVF) index,
+# and each query scans the rows of its ANN_NPROBE closest clusters
+ANN_MIN_ROWS = int(os.environ.get("ANN_MIN_ROWS", 100_000))
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 16))
+# Rows added to or deleted from a store are assigned to the existing clusters, which are
+# only re-clustered once the updated rows exceed this fraction of the rows they were built from
+ANN_RECLUSTER_FRACTION = float(os.environ.get("ANN_RECLUSTER_FRACTION", 0.2))
+
+# Weights of the code (file history), vector and lexical scores when ranking snippets
+CODE_SCORE_WEIGHT = float(os.environ.get("CODE_SCORE_WEIGHT", 1.0))
+VECTOR_SCORE_WEIGHT = float(os.environ.get("VECTOR_SCORE_WEIGHT", 1.0))
+LEXICAL_SCORE_WEIGHT = float(os.environ.get("LEXICAL_SCORE_WEIGHT", 1.0))
+
+LEXICAL_SEARCH_BACKEND = os.environ.get(
+    "LEXICAL_SEARCH_BACKEND", "whoosh"
+)  # Alternate option is bm25, an in-memory index
+
+EMBEDDING_CACHE_DTYPE = os.environ.get(
+    "EMBEDDING_CACHE_DTYPE", "float16"
+)  # Alternate option is float32, cached embeddings are stored as raw bytes of this type
 
 HUGGINGFACE_URL = os.environ.get("HUGGINGFACE_URL", None)
 HUGGINGFACE_TOKEN = os.environ.get("HUGGINGFACE_TOKEN", None)
+# Model served at HUGGINGFACE_URL, texts are truncated with its tokenizer
+HUGGINGFACE_MODEL = os.environ.get("HUGGINGFACE_MODEL", SENTENCE_TRANSFORMERS_MODEL)
+HUGGINGFACE_MAX_TOKENS = int(os.environ.get("HUGGINGFACE_MAX_TOKENS", 512))
 
 # Azure settings, only checked if OPENAI_API_TYPE == "azure"
 OPENAI_API_TYPE = os.environ.get("OPENAI_API_TYPE", None)
 OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE", None)
 OPENAI_API_VERSION = os.environ.get("OPENAI_API_VERSION", None)
-OPENAI_API_ENGINE = os.environ.get("OPENAI_API_ENGINE", None)
\ No newline at end of file
+OPENAI_API_ENGINE = os.environ.get("OPENAI_API_ENGINE", None)
+OPENAI_EMBEDDINGS_DEPLOYMENT = os.environ.get(
+    "OPENAI_EMBEDDINGS_DEPLOYMENT", "text-embedding-ada-002"
+)  # Azure deployment of the embedding model, separate from the chat engine
@@ -0,0 +1,117 @@
+import pickle
+from collections import Counter
+from typing import Iterable
+
+import numpy as np
+from scipy import sparse
+
+# Same defaults as whoosh's BM25F
+K1 = 1.2
+B = 0.75
+
+BM25_INDEX_FILE = "bm25.pkl"
+
+
+class BM25Index:
+    """
+    In-memory BM25 over a term-document matrix.
+
+    Every term frequency is replaced by its final BM25 weight when the index is built, so a
+    query is scored with one sparse mat-vec over the rows of its terms.
+    """
+
+    def __init__(
+        self,
+        vocabulary: dict[str, int],
+        term_doc_matrix: sparse.csr_matrix,
+        titles: list[str],
+        starts: list[int],
+        ends: list[int],
+    ):
+        self.vocabulary = vocabulary
+        self.term_doc_matrix = term_doc_matrix
+        self.titles = titles
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def from_token_lists(
+        cls,
+        token_lists: Iterable[list[str]],
+        titles: list[str],
+        starts: list[int],
+        ends: list[int],
+    ):
+        vocabulary = {}
+        term_ids = []
+        doc_ids = []
+        term_frequencies = []
+        doc_lengths = []
+        for doc_id, tokens in enumerate(token_lists):
+            doc_lengths.append(len(tokens))
+            for token, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_frequencies.append(count)
+        num_docs = len(doc_lengths)
+        doc_lengths = np.array(doc_lengths, dtype=np.float32)
+        term_ids = np.array(term_ids, dtype=np.int32)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        term_frequencies = np.array(term_frequencies, dtype=np.float32)
+
+        document_frequencies = np.bincount(term_ids, minlength=len(vocabulary))
+        idf = np.log(num_docs / (document_frequencies + 1)) + 1
+        average_length = doc_lengths.mean() if num_docs else 0.0
+        length_norm = (1 - B) + B * doc_lengths[doc_ids] / (average_length or 1.0)
+        weights = (
+            idf[term_ids]
+            * term_frequencies
+            * (K1 + 1)
+            / (term_frequencies + K1 * length_norm)
+        )
+        term_doc_matrix = sparse.csr_matrix(
+            (weights.astype(np.float32), (term_ids, doc_ids)),
+            shape=(len(vocabulary), num_docs),
+        )
+        return cls(vocabulary, term_doc_matrix, titles, starts, ends)
+
+    def doc_count(self) -> int:
+        return len(self.titles)
+
+    def score(self, query_tokens: list[str]) -> np.ndarray:
+        query_counts = Counter(
+            self.vocabulary[token] for token in query_tokens if token in self.vocabulary
+        )
+        if not query_counts:
+            return np.zeros(self.doc_count(), dtype=np.float32)
+        term_ids = np.fromiter(query_counts.keys(), dtype=np.int32)
+        counts = np.fromiter(query_counts.values(), dtype=np.float32)
+        # Repeated query terms count once per occurrence, like an Or of Terms in whoosh
+        return self.term_doc_matrix[term_ids].T @ counts
+
+    def search(self, query_tokens: list[str], limit: int | None = None) -> dict[str, float]:
+        """Returns the min-max normalized scores of matching snippets, keyed by title:start:end."""
+        scores = self.score(query_tokens)
+        matches = np.flatnonzero(scores > 0)
+        if limit is not None and len(matches) > limit:
+            matches = matches[np.argpartition(-scores[matches], limit - 1)[:limit]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        res = {}
+        for doc_id in matches:
+            key = f"{self.titles[doc_id]}:{self.starts[doc_id]}:{self.ends[doc_id]}"
+            if key not in res:
+                res[key] = float(scores[doc_id])
+        if len(res) == 0:
+            return res
+        max_score = max(res.values())
+        min_score = min(res.values()) if min(res.values()) < max_score else 0
+        return {k: (v - min_score) / (max_score - min_score) for k, v in res.items()}
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str) -> "BM25Index":
+        with open(path, "rb") as f:
+            return pickle.load(f)
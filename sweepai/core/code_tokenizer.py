@@ -0,0 +1,94 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Iterator
+
+WORD_PATTERN = re.compile(r"\b\w+\b")
+CASE_CHANGE_PATTERN = re.compile(r"[A-Z][a-z]|[a-z][A-Z]")
+# first one "MyVariable" second one "myVariable" third one "MYVariable"
+CASE_PART_PATTERN = re.compile(r"([A-Z][a-z]+|[a-z]+|[A-Z]+(?=[A-Z]|$))")
+
+MAX_MEMOIZED_TOKENS = 5_000_000
+
+# (part, lowercased part, offset of the part in its word)
+WordPart = tuple[str, str, int]
+
+
+@lru_cache(maxsize=1_000_000)
+def split_word(word: str) -> tuple[WordPart, ...]:
+    """Splits a snake, pascal or camelcase word into the parts that are long enough to be tokens."""
+    parts = []
+    if "_" in word:  # snakecase
+        offset = 0
+        for part in word.split("_"):
+            if len(part) > 1:
+                parts.append((part, part.lower(), offset))
+            offset += len(part) + 1
+    elif CASE_CHANGE_PATTERN.search(word):  # pascal and camelcase
+        offset = 0
+        for part in CASE_PART_PATTERN.findall(word):
+            if len(part) > 1:
+                parts.append((part, part.lower(), offset))
+            offset += len(part)
+    elif len(word) > 1:  # everything else
+        parts.append((word, word.lower(), 0))
+    return tuple(parts)
+
+
+def iter_token_spans(code: str, top_words=None) -> Iterator[tuple[str, int, int]]:
+    """Yields every token with its start and end character, for when offsets are needed."""
+    for match in WORD_PATTERN.finditer(code):
+        word_start = match.start()
+        for part, token, offset in split_word(match.group()):
+            if top_words and part in top_words:
+                continue
+            yield token, word_start + offset, word_start + offset + len(part)
+
+
+class TokenMemo:
+    """
+    LRU of the word parts of recently tokenized chunks, keyed by content hash.
+
+    Chunks are tokenized for stopwords, then again when indexed, and mostly unchanged
+    between index builds, so each distinct chunk is only split into words once.
+    """
+
+    def __init__(self, max_tokens: int = MAX_MEMOIZED_TOKENS):
+        self.max_tokens = max_tokens
+        self.num_tokens = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_word_parts(self, code: str) -> tuple[WordPart, ...]:
+        key = hashlib.sha1(code.encode("utf-8", errors="surrogatepass")).digest()
+        with self.lock:
+            word_parts = self.entries.get(key)
+            if word_parts is not None:
+                self.entries.move_to_end(key)
+                return word_parts
+        word_parts = tuple(
+            word_part
+            for word in WORD_PATTERN.findall(code)
+            for word_part in split_word(word)
+        )
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = word_parts
+                self.num_tokens += len(word_parts)
+            while self.num_tokens > self.max_tokens and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.num_tokens -= len(evicted)
+        return word_parts
+
+
+token_memo = TokenMemo()
+
+
+def tokenize(code: str, top_words=None) -> list[str]:
+    """Lowercased tokens of code without their offsets, memoized per chunk."""
+    word_parts = token_memo.get_word_parts(code)
+    if not top_words:
+        return [token for _, token, _ in word_parts]
+    return [token for part, token, _ in word_parts if part not in top_words]
@@ -3,6 +3,7 @@ import re
 from deeplake.core.vectorstore.deeplake_vectorstore import VectorStore
 from loguru import logger
 from tqdm import tqdm
+from sweepai.core.embedding_models import model_registry
 from sweepai.core.lexical_search import prepare_index_from_docs, search_docs
 from sweepai.core.robots import is_url_allowed
 from sweepai.core.webscrape import webscrape
@@ -39,17 +40,14 @@ embedding_function = ModalEmbeddingFunction()
 
 class CPUEmbedding:
     def __init__(self):
-        from sentence_transformers import (  # pylint: disable=import-error
-            SentenceTransformer,
-        )
-
-        self.model = SentenceTransformer(
-            SENTENCE_TRANSFORMERS_MODEL, cache_folder=MODEL_DIR
-        )
+        # Loaded once per process by the registry
+        self.model = model_registry.get_model(SENTENCE_TRANSFORMERS_MODEL)
 
     def compute(self, texts: list[str]) -> list[list[float]]:
         logger.info(f"Computing embeddings for {len(texts)} texts")
-        vector = self.model.encode(texts, show_progress_bar=True, batch_size=BATCH_SIZE)
+        vector = model_registry.encode(
+            texts, show_progress_bar=True, batch_size=BATCH_SIZE
+        )
         if vector.shape[0] == 1:
             return [vector.tolist()]
         else:
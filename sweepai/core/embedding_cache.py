@@ -0,0 +1,105 @@
+import json
+import struct
+import zlib
+
+import numpy as np
+from loguru import logger
+
+# magic, dtype code, dimension, crc32 of the model name
+HEADER = struct.Struct("<2sBHI")
+MAGIC = b"E1"
+DTYPES = {1: np.dtype("<f2"), 2: np.dtype("<f4")}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+KEYS_PER_COMMAND = 512
+COMMANDS_PER_PIPELINE = 8
+
+
+def get_model_fingerprint(model: str) -> int:
+    return zlib.crc32(model.encode("utf-8"))
+
+
+def encode_embedding(embedding, model: str, dtype: str = "float16") -> bytes:
+    """Raw little-endian bytes of the embedding, behind a header with its dtype, dimension and model."""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    array = np.asarray(embedding).astype(dtype, copy=False).reshape(-1)
+    return (
+        HEADER.pack(MAGIC, DTYPE_CODES[dtype], len(array), get_model_fingerprint(model))
+        + array.tobytes()
+    )
+
+
+def decode_embedding_into(value: bytes, out: np.ndarray, model: str) -> bool:
+    """Decodes a cached embedding straight into out, returning False if it is unusable."""
+    if value[:1] == b"[":
+        # Written as JSON before the binary format
+        embedding = json.loads(value)
+        if len(embedding) != len(out):
+            return False
+        out[:] = embedding
+        return True
+    if len(value) < HEADER.size:
+        return False
+    magic, dtype_code, dim, fingerprint = HEADER.unpack_from(value)
+    if (
+        magic != MAGIC
+        or dtype_code not in DTYPES
+        or dim != len(out)
+        or len(value) != HEADER.size + dim * DTYPES[dtype_code].itemsize
+        or fingerprint != get_model_fingerprint(model)
+    ):
+        return False
+    out[:] = np.frombuffer(value, dtype=DTYPES[dtype_code], count=dim, offset=HEADER.size)
+    return True
+
+
+def iter_key_batches(keys, batch_size):
+    for start in range(0, len(keys), batch_size):
+        yield keys[start : start + batch_size]
+
+
+def get_cached_embeddings(redis_client, keys: list[str], model: str, dim: int):
+    """
+    Fetches cached embeddings with pipelined MGETs of fixed size.
+
+    Returns a float32 matrix with a row per key, or None if nothing was cached, and a
+    mask of the rows that were found. Values of another model or dimension are not found.
+    """
+    found = np.zeros(len(keys), dtype=bool)
+    values = []
+    try:
+        batches = list(iter_key_batches(keys, KEYS_PER_COMMAND))
+        for command_batches in iter_key_batches(batches, COMMANDS_PER_PIPELINE):
+            pipeline = redis_client.pipeline(transaction=False)
+            for batch in command_batches:
+                pipeline.mget(batch)
+            for batch_values in pipeline.execute():
+                values.extend(batch_values)
+    except Exception as e:
+        logger.warning(f"Could not read embedding cache: {e}")
+        return None, found
+    if all(value is None for value in values):
+        return None, found
+    embeddings = np.empty((len(keys), dim), dtype=np.float32)
+    for idx, value in enumerate(values):
+        if value is not None:
+            try:
+                found[idx] = decode_embedding_into(value, embeddings[idx], model)
+            except ValueError:
+                found[idx] = False
+    return embeddings, found
+
+
+def set_cached_embeddings(
+    redis_client, keys: list[str], embeddings, model: str, dtype: str = "float16"
+):
+    try:
+        for batch_start in range(0, len(keys), KEYS_PER_COMMAND):
+            pipeline = redis_client.pipeline(transaction=False)
+            for key, embedding in zip(
+                keys[batch_start : batch_start + KEYS_PER_COMMAND],
+                embeddings[batch_start : batch_start + KEYS_PER_COMMAND],
+            ):
+                pipeline.set(key, encode_embedding(embedding, model, dtype))
+            pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Could not write embedding cache: {e}")
@@ -0,0 +1,185 @@
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+from tqdm import tqdm
+
+from sweepai.config.server import BATCH_SIZE, SENTENCE_TRANSFORMERS_MODEL
+
+MODEL_DIR = "cache/model"
+MAX_LENGTH_BATCH_SIZE = 512  # Upper bound on texts per batch, however short they are
+
+
+def make_length_batches(
+    lengths: list[int], token_budget: int, max_batch_size: int = MAX_LENGTH_BATCH_SIZE
+) -> list[list[int]]:
+    """
+    Groups text indices into batches of similar token length.
+
+    Texts are taken longest first, and a batch grows while padding every text to the
+    longest one stays within token_budget, so short texts are encoded in larger batches.
+    """
+    order = sorted(range(len(lengths)), key=lambda idx: -lengths[idx])
+    batches = []
+    for idx in order:
+        if batches:
+            batch = batches[-1]
+            padded_length = max(lengths[batch[0]], 1)
+            if (
+                len(batch) < max_batch_size
+                and (len(batch) + 1) * padded_length <= token_budget
+            ):
+                batch.append(idx)
+                continue
+        batches.append([idx])
+    return batches
+
+
+def truncate_texts_with_tokenizer(
+    texts: list[str], tokenizer, max_length: int
+) -> list[str]:
+    """
+    Cuts every text after the last token that fits in max_length tokens of a Hugging
+    Face fast tokenizer, counting the special tokens the model adds.
+    """
+    max_tokens = max(max_length - tokenizer.num_special_tokens_to_add(), 1)
+    encodings = tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=max_tokens,
+        return_offsets_mapping=True,
+    )
+    truncated_texts = []
+    for text, offsets in zip(texts, encodings["offset_mapping"]):
+        if len(offsets) == max_tokens:
+            text = text[: offsets[-1][1]]
+        truncated_texts.append(text)
+    return truncated_texts
+
+
+class ModelRegistry:
+    """
+    Sentence-transformers models loaded once per process.
+
+    Workers call warm_up when they start, so queries only pay for encoding. The onnx
+    backend runs a quantized export of the same model with ONNX Runtime.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def load_model(self, model_name: str, backend: str):
+        from sentence_transformers import (  # pylint: disable=import-error
+            SentenceTransformer,
+        )
+
+        model = SentenceTransformer(model_name, cache_folder=MODEL_DIR)
+        match backend:
+            case "torch":
+                return model
+            case "onnx":
+                from sweepai.core.onnx_embeddings import (
+                    OnnxEmbeddingModel,
+                    get_onnx_model_dir,
+                )
+
+                return OnnxEmbeddingModel(model, get_onnx_model_dir(model_name))
+            case _:
+                raise ValueError(f"Unknown embedding backend {backend}")
+
+    def get_model(
+        self, model_name: str = SENTENCE_TRANSFORMERS_MODEL, backend: str = "torch"
+    ):
+        key = (model_name, backend)
+        if key not in self.models:
+            with self.lock:
+                if key not in self.models:
+                    start = time.time()
+                    self.models[key] = self.load_model(model_name, backend)
+                    logger.info(
+                        f"Loaded {model_name} ({backend}) in {(time.time() - start) * 1000:.0f}ms"
+                    )
+        return self.models[key]
+
+    def warm_up(
+        self, model_name: str = SENTENCE_TRANSFORMERS_MODEL, backend: str = "torch"
+    ):
+        # The first encode also initializes the tokenizer and kernels
+        self.encode(["warm up"], model_name=model_name, backend=backend)
+
+    def count_tokens(
+        self,
+        texts: list[str],
+        model_name: str = SENTENCE_TRANSFORMERS_MODEL,
+        backend: str = "torch",
+    ) -> list[int]:
+        # Lengths as the model sees them, long texts are cut at max_seq_length
+        model = self.get_model(model_name, backend=backend)
+        input_ids = model.tokenizer(
+            texts, truncation=True, max_length=model.max_seq_length
+        )["input_ids"]
+        return [len(ids) for ids in input_ids]
+
+    def truncate_texts(
+        self,
+        texts: list[str],
+        model_name: str = SENTENCE_TRANSFORMERS_MODEL,
+        backend: str = "torch",
+    ) -> list[str]:
+        model = self.get_model(model_name, backend=backend)
+        return truncate_texts_with_tokenizer(
+            texts, model.tokenizer, model.max_seq_length
+        )
+
+    def encode(
+        self,
+        texts: list[str],
+        model_name: str = SENTENCE_TRANSFORMERS_MODEL,
+        batch_size: int = BATCH_SIZE,
+        show_progress_bar: bool = False,
+        backend: str = "torch",
+    ) -> np.ndarray:
+        """
+        Encodes texts in batches of similar length and returns rows in the input order.
+
+        batch_size is the number of texts per batch at the model's max_seq_length, which
+        sets the token budget of every batch.
+        """
+        model = self.get_model(model_name, backend=backend)
+        start = time.time()
+        texts = list(texts)
+        if not texts:
+            return model.encode(texts)
+        batches = make_length_batches(
+            self.count_tokens(texts, model_name=model_name, backend=backend),
+            token_budget=batch_size * model.max_seq_length,
+        )
+        embeddings = None
+        for batch in tqdm(batches, disable=not show_progress_bar):
+            batch_embeddings = model.encode(
+                [texts[idx] for idx in batch], batch_size=len(batch)
+            )
+            if embeddings is None:
+                embeddings = np.empty(
+                    (len(texts), batch_embeddings.shape[1]),
+                    dtype=batch_embeddings.dtype,
+                )
+            embeddings[batch] = batch_embeddings
+        logger.info(
+            f"Encoded {len(texts)} texts with {model_name} ({backend}) in {(time.time() - start) * 1000:.0f}ms"
+        )
+        return embeddings
+
+    def encode_query(
+        self,
+        text: str,
+        model_name: str = SENTENCE_TRANSFORMERS_MODEL,
+        backend: str = "torch",
+    ) -> np.ndarray:
+        return self.encode([text], model_name=model_name, backend=backend)[0]
+
+
+model_registry = ModelRegistry()
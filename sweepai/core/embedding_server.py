@@ -0,0 +1,168 @@
+"""
+Local embedding service shared by every worker on a node.
+
+Concurrent requests are coalesced into batches of up to BATCH_SIZE texts, so one model
+serves all workers with full batches. Run with:
+
+    python -m sweepai.core.embedding_server --port 8081
+
+and set VECTOR_EMBEDDING_SOURCE=embedding-server (and EMBEDDING_SERVER_URL if needed).
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import numpy as np
+import requests
+from loguru import logger
+
+from sweepai.config.server import (
+    BATCH_SIZE,
+    EMBEDDING_SERVER_MAX_WAIT_MS,
+    EMBEDDING_SERVER_URL,
+)
+
+EMBEDDING_DIM_HEADER = "X-Embedding-Dim"
+
+
+class DynamicBatcher:
+    """
+    Collects texts from concurrent callers and encodes them together.
+
+    After the first request arrives, requests are gathered until there are max_batch_size
+    texts or max_wait_ms has passed. Texts are sorted by length so each model batch pads
+    to similar lengths, and every caller gets back the rows of its own texts.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[list[str]], np.ndarray],
+        max_batch_size: int = BATCH_SIZE,
+        max_wait_ms: float = EMBEDDING_SERVER_MAX_WAIT_MS,
+    ):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts: list[str]) -> Future:
+        future = Future()
+        if not texts:
+            future.set_result(np.zeros((0, 0), dtype=np.float32))
+        else:
+            self.requests.put((texts, future))
+        return future
+
+    def collect(self) -> list[tuple[list[str], Future]]:
+        pending = [self.requests.get()]
+        num_texts = len(pending[0][0])
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while num_texts < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                texts, future = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append((texts, future))
+            num_texts += len(texts)
+        return pending
+
+    def run(self):
+        while True:
+            pending = self.collect()
+            try:
+                texts = [text for request_texts, _ in pending for text in request_texts]
+                order = sorted(range(len(texts)), key=lambda idx: len(texts[idx]))
+                embeddings = None
+                for start in range(0, len(order), self.max_batch_size):
+                    batch_indices = order[start : start + self.max_batch_size]
+                    batch_embeddings = np.asarray(
+                        self.encode([texts[idx] for idx in batch_indices]),
+                        dtype=np.float32,
+                    )
+                    if embeddings is None:
+                        embeddings = np.empty(
+                            (len(texts), batch_embeddings.shape[1]), dtype=np.float32
+                        )
+                    embeddings[batch_indices] = batch_embeddings
+                offset = 0
+                for request_texts, future in pending:
+                    future.set_result(embeddings[offset : offset + len(request_texts)])
+                    offset += len(request_texts)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+def make_handler(batcher: DynamicBatcher):
+    class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/embed":
+                self.send_error(404)
+                return
+            try:
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                texts = json.loads(body)["texts"]
+                embeddings = batcher.submit(texts).result()
+            except Exception as e:
+                logger.exception(e)
+                self.send_error(500, str(e))
+                return
+            # Raw float32 rows, the dimension is sent as a header
+            payload = np.ascontiguousarray(embeddings, dtype="<f4").tobytes()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header(EMBEDDING_DIM_HEADER, str(embeddings.shape[1]))
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return EmbeddingRequestHandler
+
+
+def make_server(encode, host: str = "127.0.0.1", port: int = 8081, **kwargs):
+    batcher = DynamicBatcher(encode, **kwargs)
+    return ThreadingHTTPServer((host, port), make_handler(batcher))
+
+
+def embed_with_server(texts: list[str], url: str = EMBEDDING_SERVER_URL) -> np.ndarray:
+    response = requests.post(f"{url}/embed", json={"texts": list(texts)}, timeout=600)
+    response.raise_for_status()
+    dim = int(response.headers[EMBEDDING_DIM_HEADER])
+    return np.frombuffer(response.content, dtype="<f4").reshape(len(texts), dim)
+
+
+def main():
+    from sweepai.core.embedding_models import model_registry
+
+    parser = argparse.ArgumentParser(description="Serve embeddings to local workers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx"])
+    args = parser.parse_args()
+    model_registry.warm_up(backend=args.backend)
+    server = make_server(
+        partial(model_registry.encode, backend=args.backend),
+        host=args.host,
+        port=args.port,
+    )
+    logger.info(f"Serving embeddings on {args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
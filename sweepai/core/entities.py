@@ -10,6 +10,7 @@ from pydantic import BaseModel
 from urllib.parse import quote
 
 from sweepai.utils.event_logger import set_highlight_id
+from sweepai.utils.line_index import LineIndex, get_line_index
 
 Self = TypeVar("Self", bound="RegexMatchableBaseModel")
 
@@ -288,15 +289,19 @@ class Snippet(BaseModel):
     def __hash__(self):
         return hash((self.file_path, self.start, self.end))
 
+    @property
+    def line_index(self) -> LineIndex:
+        return get_line_index(self.content)
+
     def get_snippet(self, add_ellipsis: bool = True, add_lines: bool = True):
-        lines = self.content.splitlines()
+        lines = self.line_index.lines
         snippet = "\n".join(
             (f"{i+1}: {line}" if add_lines else line) for i, line in enumerate(lines[self.start : self.end])
         )
         if add_ellipsis:
             if self.start > 1:
                 snippet = "...\n" + snippet
-            if self.end < self.content.count("\n") + 1:
+            if self.end < self.line_index.num_lines:
                 snippet = snippet + "\n..."
         return snippet
 
@@ -335,29 +340,27 @@ class Snippet(BaseModel):
         return f"""<snippet source="{self.file_path}:{self.start}-{self.end}">\n{self.get_snippet()}\n</snippet>"""
 
     def get_url(self, repo_name: str, commit_id: str = "main"):
-        num_lines = self.content.count("\n") + 1
+        num_lines = self.line_index.num_lines
         encoded_file_path = quote(self.file_path, safe="/")
         return f"https://github.com/{repo_name}/blob/{commit_id}/{encoded_file_path}#L{max(self.start, 1)}-L{min(self.end, num_lines)}"
 
     def get_markdown_link(self, repo_name: str, commit_id: str = "main"):
-        num_lines = self.content.count("\n") + 1
+        num_lines = self.line_index.num_lines
         base = commit_id + "/" if commit_id != "main" else ""
         return f"[{base}{self.file_path}#L{max(self.start, 1)}-L{min(self.end, num_lines)}]({self.get_url(repo_name, commit_id)})"
 
     def get_slack_link(self, repo_name: str, commit_id: str = "main"):
-        num_lines = self.content.count("\n") + 1
+        num_lines = self.line_index.num_lines
         base = commit_id + "/" if commit_id != "main" else ""
         return f"<{self.get_url(repo_name, commit_id)}|{base}{self.file_path}#L{max(self.start, 1)}-L{min(self.end, num_lines)}>"
 
     def get_preview(self, max_lines: int = 5):
-        snippet = "\n".join(
-            self.content.splitlines()[
-                self.start : min(self.start + max_lines, self.end)
-            ]
+        snippet = self.line_index.extract_lines(
+            self.start, min(self.start + max_lines, self.end)
         )
         if self.start > 1:
             snippet = "\n" + snippet
-        if self.end < self.content.count("\n") + 1 and self.end > max_lines:
+        if self.end < self.line_index.num_lines and self.end > max_lines:
             snippet = snippet + "\n"
         return snippet
 
@@ -365,7 +368,7 @@ class Snippet(BaseModel):
         return Snippet(
             content=self.content,
             start=max(self.start - num_lines, 1),
-            end=min(self.end + num_lines, self.content.count("\n") + 1),
+            end=min(self.end + num_lines, self.line_index.num_lines),
             file_path=self.file_path,
         )
 
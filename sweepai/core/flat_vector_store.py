@@ -0,0 +1,341 @@
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+
+import numpy as np
+from loguru import logger
+
+from sweepai.config.server import ANN_MIN_ROWS, ANN_NPROBE, ANN_RECLUSTER_FRACTION
+from sweepai.core.ivf_index import IVF_INDEX_FILE, IVFIndex
+
+HEADER_FILE = "header.json"
+EMBEDDINGS_FILE = "embeddings.f16"
+METADATA_FILE = "metadata.jsonl"
+FLAT_VECTOR_STORE_VERSION = 1
+SEARCH_BLOCK_ROWS = (
+    2048  # Rows upcast to float32 at a time while searching, sized to stay in cache
+)
+
+
+def to_json(value):
+    # Metadata may hold numpy scalars
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+@dataclass
+class FlatVectorRows:
+    ids: list[str]
+    texts: list[str]
+    metadatas: list[dict]
+    embeddings: np.ndarray  # read-only (num_rows, dim) float16 memmap of unit vectors
+    code_score_arrays: dict[str, np.ndarray] = field(default_factory=dict)
+
+    @cached_property
+    def id_to_index(self) -> dict[str, int]:
+        return {row_id: idx for idx, row_id in enumerate(self.ids)}
+
+    def get_code_scores(
+        self, files_to_scores: dict[str, float], cache_key: str | None = None
+    ) -> np.ndarray:
+        """
+        The score of each row's file, or the score in rows written with one.
+
+        Scores are a function of the commit, so with its cache key they are only mapped
+        onto the rows once.
+        """
+        if cache_key is not None and cache_key in self.code_score_arrays:
+            return self.code_score_arrays[cache_key]
+        code_scores = np.array(
+            [
+                files_to_scores.get(metadata["file_path"], metadata.get("score", 0.0))
+                for metadata in self.metadatas
+            ],
+            dtype=np.float32,
+        )
+        if cache_key is not None:
+            self.code_score_arrays[cache_key] = code_scores
+        return code_scores
+
+
+@lru_cache(maxsize=16)
+def load_rows(
+    path: str, dim: int, metadata_mtime_ns: int, metadata_size: int
+) -> FlatVectorRows:
+    # Keyed on the metadata file's mtime and size, so rows are reloaded after a write
+    ids = []
+    texts = []
+    metadatas = []
+    with open(os.path.join(path, METADATA_FILE), "r") as f:
+        for line in f:
+            row = json.loads(line)
+            ids.append(row["id"])
+            texts.append(row["text"])
+            metadatas.append(row["metadata"])
+    embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+    # A write interrupted between the two files leaves extra rows in one of them
+    num_rows = min(len(ids), os.path.getsize(embeddings_path) // (dim * 2))
+    if num_rows:
+        embeddings = np.memmap(
+            embeddings_path, dtype=np.float16, mode="r", shape=(num_rows, dim)
+        )
+    else:
+        embeddings = np.zeros((0, dim), dtype=np.float16)
+    return FlatVectorRows(
+        ids[:num_rows], texts[:num_rows], metadatas[:num_rows], embeddings
+    )
+
+
+@lru_cache(maxsize=16)
+def load_ann_index(path: str, mtime_ns: int, size: int) -> IVFIndex:
+    return IVFIndex.load(path)
+
+
+class FlatVectorStore:
+    """
+    Exact cosine search over a float16 matrix of unit vectors stored on disk.
+
+    The matrix is opened with np.memmap, so every worker process on a node searches the
+    same pages of the page cache. Rows are appended as they are added, with their ids,
+    texts and metadata appended to a JSON lines table in the same order.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @property
+    def dim(self) -> int | None:
+        try:
+            with open(os.path.join(self.path, HEADER_FILE), "r") as f:
+                return json.load(f)["dim"]
+        except FileNotFoundError:
+            return None
+
+    @property
+    def rows(self) -> FlatVectorRows | None:
+        dim = self.dim
+        if dim is None:
+            return None
+        try:
+            metadata_stat = os.stat(os.path.join(self.path, METADATA_FILE))
+        except FileNotFoundError:
+            return None
+        return load_rows(
+            self.path, dim, metadata_stat.st_mtime_ns, metadata_stat.st_size
+        )
+
+    @property
+    def ann_index(self) -> IVFIndex | None:
+        ann_index_path = os.path.join(self.path, IVF_INDEX_FILE)
+        try:
+            ann_index_stat = os.stat(ann_index_path)
+            ann_index = load_ann_index(
+                ann_index_path, ann_index_stat.st_mtime_ns, ann_index_stat.st_size
+            )
+        except FileNotFoundError:
+            return None
+        rows = self.rows
+        if rows is None or ann_index.num_rows != len(rows.ids):
+            return None
+        return ann_index
+
+    def build_ann_index(
+        self,
+        min_rows: int = ANN_MIN_ROWS,
+        recluster_fraction: float = ANN_RECLUSTER_FRACTION,
+    ):
+        """
+        Builds the approximate index once every row is added, for stores with at least
+        min_rows rows.
+
+        An index kept up to date by add and delete is only rebuilt once more than
+        recluster_fraction of the rows it was clustered from were added or deleted.
+        """
+        rows = self.rows
+        if rows is None or len(rows.ids) < min_rows:
+            return
+        ann_index = self.ann_index
+        if (
+            ann_index is not None
+            and ann_index.num_updated_rows
+            <= recluster_fraction * ann_index.num_trained_rows
+        ):
+            logger.info(
+                f"Kept ANN index with {ann_index.num_updated_rows} updated rows "
+                "since it was built"
+            )
+            return
+        start = time.time()
+        ann_index = IVFIndex.build(rows.embeddings)
+        self.save_ann_index(ann_index)
+        logger.info(
+            f"Built ANN index with {len(ann_index.centroids)} lists over "
+            f"{len(rows.ids)} rows in {time.time() - start:.1f}s"
+        )
+
+    def save_ann_index(self, ann_index: IVFIndex):
+        ann_index.save(os.path.join(self.path, IVF_INDEX_FILE))
+
+    def remove_ann_index(self):
+        try:
+            os.remove(os.path.join(self.path, IVF_INDEX_FILE))
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        rows = self.rows
+        return len(rows.ids) if rows is not None else 0
+
+    def add(self, text: list[str], id: list[str], embedding, metadata: list[dict]):
+        embeddings = normalize(np.asarray(embedding, dtype=np.float32))
+        if embeddings.ndim != 2 or len(embeddings) != len(id):
+            raise ValueError(
+                f"Expected {len(id)} embeddings, "
+                f"got an array of shape {embeddings.shape}"
+            )
+        os.makedirs(self.path, exist_ok=True)
+        dim = self.dim
+        if dim is None:
+            dim = embeddings.shape[1]
+            with open(os.path.join(self.path, HEADER_FILE), "w") as f:
+                json.dump({"dim": dim, "version": FLAT_VECTOR_STORE_VERSION}, f)
+        elif embeddings.shape[1] != dim:
+            raise ValueError(
+                f"Expected embeddings of dimension {dim}, got {embeddings.shape[1]}"
+            )
+        embeddings = embeddings.astype(np.float16)
+        # New rows join the lists of their closest centroids, so the index stays usable
+        ann_index = self.ann_index
+        if ann_index is None:
+            self.remove_ann_index()
+        self._append(text, id, embeddings, metadata)
+        if ann_index is not None:
+            self.save_ann_index(ann_index.add(embeddings))
+
+    def _append(self, texts, ids, embeddings, metadatas, suffix=""):
+        # Embeddings are written first, so the metadata table never has rows without
+        # vectors
+        with open(os.path.join(self.path, EMBEDDINGS_FILE + suffix), "ab") as f:
+            f.write(np.ascontiguousarray(embeddings).tobytes())
+        with open(os.path.join(self.path, METADATA_FILE + suffix), "a") as f:
+            for row_id, text, metadata in zip(ids, texts, metadatas):
+                f.write(
+                    json.dumps(
+                        {"id": row_id, "text": text, "metadata": metadata},
+                        default=to_json,
+                    )
+                    + "\n"
+                )
+
+    def delete(self, ids: list[str]):
+        rows = self.rows
+        if rows is None:
+            return
+        ids = set(ids)
+        keep = [idx for idx, row_id in enumerate(rows.ids) if row_id not in ids]
+        if len(keep) == len(rows.ids):
+            return
+        logger.info(f"Deleting {len(rows.ids) - len(keep)} rows from {self.path}")
+        ann_index = self.ann_index
+        if ann_index is None:
+            self.remove_ann_index()
+        # Rewrite both files next to the originals, then swap them in
+        suffix = f".{os.getpid()}.tmp"
+        for file_name in (EMBEDDINGS_FILE, METADATA_FILE):
+            open(os.path.join(self.path, file_name + suffix), "w").close()
+        self._append(
+            [rows.texts[idx] for idx in keep],
+            [rows.ids[idx] for idx in keep],
+            rows.embeddings[keep],
+            [rows.metadatas[idx] for idx in keep],
+            suffix=suffix,
+        )
+        for file_name in (EMBEDDINGS_FILE, METADATA_FILE):
+            os.replace(
+                os.path.join(self.path, file_name + suffix),
+                os.path.join(self.path, file_name),
+            )
+        if ann_index is not None:
+            self.save_ann_index(ann_index.keep(np.array(keep, dtype=np.int64)))
+
+    def score(self, embedding, row_indices: np.ndarray | None = None) -> np.ndarray:
+        """Cosine similarity of the query embedding with every row or the given rows."""
+        rows = self.rows
+        if rows is None or not len(rows.ids):
+            return np.zeros(0, dtype=np.float32)
+        query = normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+        num_scores = len(rows.ids) if row_indices is None else len(row_indices)
+        scores = np.empty(num_scores, dtype=np.float32)
+        for start in range(0, num_scores, SEARCH_BLOCK_ROWS):
+            if row_indices is None:
+                block = rows.embeddings[start : start + SEARCH_BLOCK_ROWS]
+            else:
+                block = rows.embeddings[row_indices[start : start + SEARCH_BLOCK_ROWS]]
+            scores[start : start + len(block)] = block.astype(np.float32) @ query
+        return scores
+
+    def score_batch(self, embeddings) -> np.ndarray:
+        """
+        Cosine similarities of several query embeddings with every row, one row of
+        scores per query.
+        """
+        queries = np.asarray(embeddings, dtype=np.float32)
+        queries = normalize(queries.reshape(len(queries), -1))
+        rows = self.rows
+        if rows is None or not len(rows.ids):
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        scores = np.empty((len(queries), len(rows.ids)), dtype=np.float32)
+        for start in range(0, len(rows.ids), SEARCH_BLOCK_ROWS):
+            block = rows.embeddings[start : start + SEARCH_BLOCK_ROWS]
+            scores[:, start : start + len(block)] = queries @ block.astype(np.float32).T
+        return scores
+
+    def get_candidates(self, embedding, nprobe: int = ANN_NPROBE) -> np.ndarray | None:
+        """
+        Sorted indices of the rows in the nprobe clusters closest to the query, or None
+        without an ANN index.
+        """
+        ann_index = self.ann_index
+        if ann_index is None:
+            return None
+        query = normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+        return ann_index.candidates(query, nprobe)
+
+    def search(
+        self, embedding, k: int = 4, nprobe: int = ANN_NPROBE
+    ) -> dict[str, list]:
+        """
+        Returns the k most similar rows, in the format of DeepLakeVectorStore.search.
+
+        Stores with an ANN index only score the rows in the nprobe clusters closest to
+        the query, unless those hold fewer than k rows.
+        """
+        rows = self.rows
+        if rows is None or k <= 0:
+            return {"id": [], "text": [], "metadata": [], "score": []}
+        row_indices = self.get_candidates(embedding, nprobe)
+        if row_indices is not None and len(row_indices) < k:
+            row_indices = None
+        scores = self.score(embedding, row_indices)
+        k = min(k, len(scores))
+        if k <= 0:
+            return {"id": [], "text": [], "metadata": [], "score": []}
+        top_indices = np.argpartition(-scores, k - 1)[:k]
+        top_indices = top_indices[np.argsort(-scores[top_indices], kind="stable")]
+        top_scores = scores[top_indices].tolist()
+        if row_indices is not None:
+            top_indices = row_indices[top_indices]
+        return {
+            "id": [rows.ids[idx] for idx in top_indices],
+            "text": [rows.texts[idx] for idx in top_indices],
+            "metadata": [rows.metadatas[idx] for idx in top_indices],
+            "score": top_scores,
+        }
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
@@ -0,0 +1,159 @@
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+IVF_INDEX_FILE = "ivf.npz"
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+ASSIGN_BLOCK_ROWS = 8192
+
+
+def assign_to_lists(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid of every row, computed in blocks."""
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(
+            embeddings[start : start + ASSIGN_BLOCK_ROWS], dtype=np.float32
+        )
+        assignments[start : start + len(block)] = (block @ centroids.T).argmax(axis=1)
+    return assignments
+
+
+def spherical_kmeans(samples: np.ndarray, num_lists: int, rng) -> np.ndarray:
+    centroids = samples[rng.choice(len(samples), num_lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = assign_to_lists(samples, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, samples)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Re-seed lists that lost all their rows
+        sums[empty] = samples[rng.choice(len(samples), int(empty.sum()))]
+        norms[empty] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+@dataclass
+class IVFIndex:
+    """
+    Inverted file index over unit vectors.
+
+    Rows are clustered around num_lists centroids with spherical k-means. A query only
+    scores the rows in the lists of its nprobe most similar centroids, so raising nprobe
+    trades latency for recall. Rows added or removed later keep the centroids, and
+    num_updated_rows counts them so the owner can decide when to re-cluster.
+    """
+
+    centroids: np.ndarray  # (num_lists, dim) float32 unit vectors
+    offsets: np.ndarray  # (num_lists + 1,) where each list starts in row_indices
+    row_indices: np.ndarray  # row indices grouped by list
+    num_rows: int
+    num_trained_rows: int  # rows the centroids were clustered from
+    num_updated_rows: int = 0  # rows added or removed since
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, num_lists: int | None = None, seed: int = 0):
+        num_rows = len(embeddings)
+        num_lists = num_lists or max(1, int(4 * np.sqrt(num_rows)))
+        rng = np.random.default_rng(seed)
+        num_samples = min(num_rows, num_lists * KMEANS_SAMPLES_PER_LIST)
+        sample_indices = np.sort(rng.choice(num_rows, num_samples, replace=False))
+        samples = np.asarray(embeddings[sample_indices], dtype=np.float32)
+        centroids = spherical_kmeans(samples, num_lists, rng)
+        return cls.from_assignments(
+            centroids, assign_to_lists(embeddings, centroids), num_rows
+        )
+
+    @classmethod
+    def from_assignments(
+        cls,
+        centroids: np.ndarray,
+        assignments: np.ndarray,
+        num_trained_rows: int,
+        num_updated_rows: int = 0,
+    ):
+        row_indices = np.argsort(assignments, kind="stable").astype(np.int32)
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+        return cls(
+            centroids,
+            offsets,
+            row_indices,
+            len(assignments),
+            num_trained_rows,
+            num_updated_rows,
+        )
+
+    @property
+    def assignments(self) -> np.ndarray:
+        """The list of every row."""
+        assignments = np.empty(self.num_rows, dtype=np.int32)
+        assignments[self.row_indices] = np.repeat(
+            np.arange(len(self.centroids), dtype=np.int32), np.diff(self.offsets)
+        )
+        return assignments
+
+    def add(self, embeddings: np.ndarray) -> "IVFIndex":
+        """
+        The index with rows appended after the existing ones, each in the list of its
+        closest centroid.
+        """
+        return IVFIndex.from_assignments(
+            self.centroids,
+            np.concatenate(
+                [self.assignments, assign_to_lists(embeddings, self.centroids)]
+            ),
+            self.num_trained_rows,
+            self.num_updated_rows + len(embeddings),
+        )
+
+    def keep(self, row_indices: np.ndarray) -> "IVFIndex":
+        """The index of only the given sorted rows, renumbered in order."""
+        return IVFIndex.from_assignments(
+            self.centroids,
+            self.assignments[row_indices],
+            self.num_trained_rows,
+            self.num_updated_rows + self.num_rows - len(row_indices),
+        )
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Sorted indices of the rows in the nprobe lists closest to the query."""
+        nprobe = min(nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        lists = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.sort(
+            np.concatenate(
+                [self.row_indices[self.offsets[i] : self.offsets[i + 1]] for i in lists]
+            )
+        )
+
+    def save(self, path: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            offsets=self.offsets,
+            row_indices=self.row_indices,
+            num_rows=np.array(self.num_rows),
+            num_trained_rows=np.array(self.num_trained_rows),
+            num_updated_rows=np.array(self.num_updated_rows),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            num_rows = int(data["num_rows"])
+            # Indices saved before updates were tracked count as freshly clustered
+            return cls(
+                data["centroids"],
+                data["offsets"],
+                data["row_indices"],
+                num_rows,
+                int(data["num_trained_rows"])
+                if "num_trained_rows" in data
+                else num_rows,
+                int(data["num_updated_rows"]) if "num_updated_rows" in data else 0,
+            )
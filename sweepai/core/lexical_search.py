@@ -1,54 +1,35 @@
 import shutil
 import traceback
+from collections import Counter
 from dataclasses import dataclass
 import itertools
+import json
 import re
 from whoosh.analysis import Tokenizer, Token
 import os
 import random
+import tempfile
 import time
+from loguru import logger
 from whoosh.query import Or, Term
 
+from sweepai.config.server import LEXICAL_SEARCH_BACKEND
+from sweepai.core.bm25_search import BM25_INDEX_FILE, BM25Index
+from sweepai.core.code_tokenizer import iter_token_spans, tokenize
+
 random.seed(os.getpid())
 
+LEXICAL_INDEX_DIR = "cache/indices/"
+MAX_LEXICAL_INDICES = 64
+STALE_BUILD_SECONDS = 60 * 60
+DOCS_FILE = "docs.jsonl"
+
 
 def tokenize_call(code, top_words=None):
-    def check_valid_token(token):
-        in_top_words = False
-        if top_words:
-            in_top_words = token in top_words
-        return token and len(token) > 1 and not in_top_words
-    matches = re.finditer(r'\b\w+\b', code)
-    pos = 0
-    valid_tokens = []
-    for m in matches:
-        text = m.group()
-        span_start = m.start()
-        span_end = m.end()
-
-        if '_' in text: # snakecase
-            offset = 0
-            for part in text.split('_'):
-                if check_valid_token(part):
-                    valid_tokens.append(Token(text=part.lower(), pos=pos, startchar=span_start + offset,
-                        end_pos=pos+1, endchar=span_start + len(part) + offset))
-                    pos += 1
-                offset += len(part) + 1
-        elif re.search(r'[A-Z][a-z]|[a-z][A-Z]', text): # pascal and camelcase
-            parts = re.findall(r'([A-Z][a-z]+|[a-z]+|[A-Z]+(?=[A-Z]|$))', text) # first one "MyVariable" second one "myVariable" third one "MYVariable"
-            offset = 0
-            for part in parts:
-                if check_valid_token(part):
-                    valid_tokens.append(Token(text=part.lower(), pos=pos, startchar=span_start + offset,
-                        end_pos=pos+1, endchar=span_start + len(part) + offset))
-                    pos += 1
-                offset += len(part)
-        else: # everything else
-            if check_valid_token(text):
-                valid_tokens.append(Token(text=text.lower(), pos=pos, startchar=span_start,
-                        end_pos=pos+1, endchar=span_start + len(text)))
-                pos += 1
-    return valid_tokens
+    return [
+        Token(text=token, pos=pos, startchar=startchar, end_pos=pos + 1, endchar=endchar)
+        for pos, (token, startchar, endchar) in enumerate(iter_token_spans(code, top_words))
+    ]
 
 def construct_query(query, top_words=None):
     terms = tokenize_call(query, top_words)
@@ -71,8 +52,23 @@ class CodeTokenizer(Tokenizer):
         **kwargs,
     ):
 
-        tokens = tokenize_call(value, self.top_words)
-        for token in tokens:
+        # A single token is reused, as whoosh's own tokenizers do
+        token = Token(positions, chars, removestops=removestops, mode=mode, **kwargs)
+        if chars:
+            token_spans = iter_token_spans(value, self.top_words)
+        else:
+            token_spans = ((text, 0, 0) for text in tokenize(value, self.top_words))
+        for pos, (text, startchar, endchar) in enumerate(token_spans):
+            token.text = text
+            token.boost = 1.0
+            token.stopped = False
+            if keeporiginal:
+                token.original = text
+            if positions:
+                token.pos = start_pos + pos
+            if chars:
+                token.startchar = start_char + startchar
+                token.endchar = start_char + endchar
             yield token
 
 
@@ -84,47 +80,65 @@ class Document:
     end: int
 
 
-def snippets_to_docs(snippets, len_repo_cache_dir):
-    docs = []
-    for snippet in snippets:
-        docs.append(
-            Document(
-                title=snippet.file_path[len_repo_cache_dir:],
-                content=snippet.content,
-                start=snippet.start,
-                end=snippet.end,
-            )
-        )
-    return docs
-
-
 from whoosh.qparser import QueryParser, OrGroup
 import os
 from whoosh import index
 from whoosh.fields import Schema, TEXT, NUMERIC
 
 
-def get_stopwords(snippets):
-    from collections import Counter
+def get_lexical_index_path(cache_key):
+    return os.path.join(LEXICAL_INDEX_DIR, f"{cache_key}-{LEXICAL_SEARCH_BACKEND}")
 
-    # Assuming your CodeTokenizer is defined and works for your specific content
-    tokenizer = CodeTokenizer()
 
-    # Let's say your content is in a variable called "content"
-    chunks = [snippet.content for snippet in snippets]
-    tokens = [t.text for t in tokenizer("\n".join(chunks))]
-    # Count the frequency of each word
-    word_counts = Counter(tokens)
+def load_lexical_index(index_path):
+    if LEXICAL_SEARCH_BACKEND == "bm25":
+        return BM25Index.load(os.path.join(index_path, BM25_INDEX_FILE))
+    return index.open_dir(index_path, readonly=True)
 
-    # Identify the top 10 most frequent words
-    top_words = {word for word, _ in word_counts.most_common(10)}
-    return top_words
 
+def open_lexical_index(cache_key):
+    """Opens the index built for cache_key read-only, or returns None if there is none."""
+    index_path = get_lexical_index_path(cache_key)
+    if not os.path.isdir(index_path):
+        return None
+    try:
+        ix = load_lexical_index(index_path)
+    except Exception as e:
+        logger.warning(f"Could not open lexical index {index_path}: {e}")
+        return None
+    try:
+        # Marks the index as recently used for garbage collection
+        os.utime(index_path)
+    except OSError:
+        pass
+    return ix
 
-def prepare_index_from_snippets(snippets, len_repo_cache_dir=0):
-    all_docs = snippets_to_docs(snippets, len_repo_cache_dir)
+
+def gc_lexical_indices(max_indices=MAX_LEXICAL_INDICES):
+    """Deletes the least recently used indices beyond max_indices, and builds abandoned by crashed workers."""
+    try:
+        entries = [entry for entry in os.scandir(LEXICAL_INDEX_DIR) if entry.is_dir()]
+    except FileNotFoundError:
+        return
+    indices = []
+    for entry in entries:
+        try:
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        if entry.name.endswith(".tmp"):
+            if time.time() - mtime > STALE_BUILD_SECONDS:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            indices.append((mtime, entry.path))
+    indices.sort(reverse=True)
+    for _, index_path in indices[max_indices:]:
+        logger.info(f"Deleting least recently used lexical index {index_path}")
+        shutil.rmtree(index_path, ignore_errors=True)
+
+
+def build_whoosh_index(all_docs, stop_words, index_dir):
     # Tokenizer that splits by whitespace and common code punctuation
-    stop_words = get_stopwords(snippets)
     tokenizer = CodeTokenizer(stop_words)
 
     # An example analyzer for code
@@ -137,14 +151,8 @@ def prepare_index_from_snippets(snippets, len_repo_cache_dir=0):
         end=NUMERIC(stored=True),
     )
 
-    # Create a directory to store the index
-    pid = random.randint(0, 1000)
-    shutil.rmtree(f"cache/indices/indexdir_{pid}", ignore_errors=True)
-    os.makedirs(f"cache/indices", exist_ok=True)
-    os.mkdir(f"cache/indices/indexdir_{pid}")
-
     # Create the index based on the schema
-    ix = index.create_in(f"cache/indices/indexdir_{pid}", schema)
+    ix = index.create_in(index_dir, schema)
     # writer.cancel()
     writer = ix.writer()
     for doc in all_docs:
@@ -154,6 +162,113 @@ def prepare_index_from_snippets(snippets, len_repo_cache_dir=0):
     return ix
 
 
+def build_bm25_index(all_docs, stop_words, index_dir):
+    titles, starts, ends = [], [], []
+
+    def token_lists():
+        for doc in all_docs:
+            titles.append(doc.title)
+            starts.append(doc.start)
+            ends.append(doc.end)
+            yield tokenize(doc.content, stop_words)
+
+    ix = BM25Index.from_token_lists(token_lists(), titles, starts, ends)
+    ix.save(os.path.join(index_dir, BM25_INDEX_FILE))
+    return ix
+
+
+class LexicalIndexBuilder:
+    """
+    Builds a lexical index from batches of snippets without keeping them in memory.
+
+    The stopwords depend on every snippet, so added snippets are spooled to a file in the
+    build directory while their tokens are counted, and indexed from it in finish().
+    """
+
+    def __init__(self, len_repo_cache_dir=0, cache_key=None):
+        self.len_repo_cache_dir = len_repo_cache_dir
+        self.cache_key = cache_key
+        self.word_counts = Counter()
+        # Build in a directory private to this call, so concurrent workers never share one
+        os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+        self.build_dir = tempfile.mkdtemp(
+            prefix=f"{cache_key or 'index'}.", suffix=".tmp", dir=LEXICAL_INDEX_DIR
+        )
+        self.docs_path = os.path.join(self.build_dir, DOCS_FILE)
+        self.docs_file = open(self.docs_path, "w")
+
+    def add(self, snippets):
+        for snippet in snippets:
+            # Tokenizes chunk by chunk so the memoized tokens are reused when the chunks are indexed
+            self.word_counts.update(tokenize(snippet.content))
+            doc = [
+                snippet.file_path[self.len_repo_cache_dir :],
+                snippet.content,
+                snippet.start,
+                snippet.end,
+            ]
+            self.docs_file.write(json.dumps(doc) + "\n")
+
+    def iter_docs(self):
+        with open(self.docs_path) as f:
+            for line in f:
+                yield Document(*json.loads(line))
+
+    def abort(self):
+        self.docs_file.close()
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+
+    def finish(self):
+        self.docs_file.close()
+        # Identify the top 10 most frequent words
+        stop_words = {word for word, _ in self.word_counts.most_common(10)}
+        try:
+            if LEXICAL_SEARCH_BACKEND == "bm25":
+                ix = build_bm25_index(self.iter_docs(), stop_words, self.build_dir)
+            else:
+                ix = build_whoosh_index(self.iter_docs(), stop_words, self.build_dir)
+            os.remove(self.docs_path)
+        except BaseException:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            raise
+        if self.cache_key is None:
+            return ix
+
+        # Publish the finished index atomically
+        index_path = get_lexical_index_path(self.cache_key)
+        try:
+            os.rename(self.build_dir, index_path)
+        except OSError:
+            # Another worker published the same index first
+            existing_ix = open_lexical_index(self.cache_key)
+            if existing_ix is None:
+                return ix
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            return existing_ix
+        gc_lexical_indices()
+        return load_lexical_index(index_path)
+
+
+def prepare_index_from_snippets(snippets, len_repo_cache_dir=0, cache_key=None):
+    """
+    Builds a lexical index of the snippets with the configured LEXICAL_SEARCH_BACKEND.
+
+    With a cache_key the index is stored under it and later calls with the same key
+    open the stored index instead of rebuilding it.
+    """
+    if cache_key is not None:
+        ix = open_lexical_index(cache_key)
+        if ix is not None:
+            return ix
+    builder = LexicalIndexBuilder(len_repo_cache_dir, cache_key)
+    try:
+        builder.add(snippets)
+    except BaseException:
+        builder.abort()
+        raise
+    return builder.finish()
+
+
 @dataclass
 class Documentation:
     url: str
@@ -212,6 +327,8 @@ def search_docs(query, ix):
 def search_index(query, ix):
     """Title, score, content"""
     try:
+        if isinstance(ix, BM25Index):
+            return ix.search(tokenize(query))
         # Create a query parser for the "content" field of the index
         q = construct_query(query)
 
@@ -0,0 +1,138 @@
+"""
+Sentence-transformers models exported to ONNX and quantized to int8 for CPU inference.
+
+The export runs once per model and is cached under ONNX_MODEL_DIR, later processes only
+load the quantized graph. Requires the onnx extra (onnx and onnxruntime).
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from loguru import logger
+
+from sweepai.config.server import BATCH_SIZE, ONNX_NUM_THREADS
+
+ONNX_MODEL_DIR = "cache/onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+ONNX_OPSET = 14
+
+
+def get_onnx_model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "--"))
+
+
+def export_onnx_model(sentence_transformer, model_dir: str) -> str:
+    """
+    Exports the transformer of a sentence-transformers model and quantizes its weights
+    to int8.
+    """
+    quantized_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+    if os.path.exists(quantized_path):
+        return quantized_path
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(model_dir, exist_ok=True)
+    # Workers may export at the same time, each one writes to its own directory
+    build_dir = tempfile.mkdtemp(dir=model_dir, suffix=".tmp")
+    try:
+        transformer = sentence_transformer[0].auto_model.eval()
+        inputs = dict(sentence_transformer.tokenizer(["export"], return_tensors="pt"))
+        input_names = list(inputs)
+        float_path = os.path.join(build_dir, "model.onnx")
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                (inputs,),
+                float_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    name: {0: "batch", 1: "sequence"}
+                    for name in input_names + ["last_hidden_state"]
+                },
+                opset_version=ONNX_OPSET,
+            )
+        build_path = os.path.join(build_dir, QUANTIZED_MODEL_FILE)
+        quantize_dynamic(float_path, build_path, weight_type=QuantType.QInt8)
+        os.replace(build_path, quantized_path)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    logger.info(f"Exported quantized ONNX model to {quantized_path}")
+    return quantized_path
+
+
+def pool(
+    hidden_states: np.ndarray, attention_mask: np.ndarray, pooling_mode: str
+) -> np.ndarray:
+    if pooling_mode == "cls":
+        return hidden_states[:, 0]
+    mask = attention_mask[:, :, None].astype(hidden_states.dtype)
+    if pooling_mode == "max":
+        return np.where(mask > 0, hidden_states, -np.inf).max(axis=1)
+    return (hidden_states * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+
+class OnnxEmbeddingModel:
+    """
+    Runs a quantized export of a sentence-transformers model with ONNX Runtime.
+
+    Has the tokenizer, max_seq_length and encode of SentenceTransformer that
+    ModelRegistry uses, and applies the same pooling and normalization.
+    """
+
+    def __init__(
+        self, sentence_transformer, model_dir: str, num_threads: int = ONNX_NUM_THREADS
+    ):
+        import onnxruntime
+
+        self.tokenizer = sentence_transformer.tokenizer
+        self.max_seq_length = sentence_transformer.max_seq_length
+        modules = {type(module).__name__: module for module in sentence_transformer}
+        self.pooling_mode = (
+            modules["Pooling"].get_pooling_mode_str()
+            if "Pooling" in modules
+            else "mean"
+        )
+        self.normalize = "Normalize" in modules
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            export_onnx_model(sentence_transformer, model_dir),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [
+            model_input.name for model_input in self.session.get_inputs()
+        ]
+
+    def encode(
+        self, texts: list[str], batch_size: int = BATCH_SIZE, **kwargs
+    ) -> np.ndarray:
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start : start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            hidden_states = self.session.run(
+                ["last_hidden_state"],
+                {name: inputs[name].astype(np.int64) for name in self.input_names},
+            )[0]
+            batches.append(
+                pool(hidden_states, inputs["attention_mask"], self.pooling_mode)
+            )
+        embeddings = np.concatenate(batches).astype(np.float32)
+        if self.normalize:
+            embeddings /= np.maximum(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12
+            )
+        return embeddings
@@ -0,0 +1,182 @@
+"""
+Trigram index over the paths of a commit, answering which paths contain a mention.
+
+Paths are stored as UTF-8 bytes, and every byte trigram maps to the sorted ids of the
+paths containing it (CSR layout, like the BM25 index). A mention's candidates are the
+intersection of its trigrams' postings, which are then checked with a substring test,
+so results equal a scan of every path. Indices are saved per commit as one .npz file.
+"""
+import os
+import tempfile
+import time
+from functools import lru_cache
+
+import numpy as np
+from loguru import logger
+
+PATH_INDEX_DIR = "cache/path_indices/"
+MAX_PATH_INDICES = 256
+
+
+def get_trigram_codes(data: np.ndarray) -> np.ndarray:
+    data = data.astype(np.int32)
+    return (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+
+
+class PathIndex:
+    def __init__(
+        self,
+        paths: list[str],
+        codes: np.ndarray,
+        offsets: np.ndarray,
+        postings: np.ndarray,
+    ):
+        self.paths = paths
+        self.codes = codes
+        self.offsets = offsets
+        self.postings = postings
+
+    @classmethod
+    def from_paths(cls, paths: list[str]) -> "PathIndex":
+        encoded_paths = [path.encode() for path in paths]
+        lengths = np.fromiter(
+            (len(path) for path in encoded_paths), dtype=np.int64, count=len(paths)
+        )
+        if not len(paths) or lengths.max() < 3:
+            empty = np.zeros(0, dtype=np.int32)
+            return cls(list(paths), empty, np.zeros(1, dtype=np.int64), empty)
+        data = np.frombuffer(b"".join(encoded_paths), dtype=np.uint8)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        path_ids = np.repeat(np.arange(len(paths), dtype=np.int64), lengths)
+        # Trigrams that start within the last two bytes of a path would span two paths
+        positions = np.arange(len(data) - 2)
+        within_path = positions + 2 < (starts + lengths)[path_ids[: len(positions)]]
+        codes = get_trigram_codes(data)[within_path].astype(np.int64)
+        # Sorting (code, path id) keys groups each trigram's paths in order
+        keys = np.sort((codes << 32) | path_ids[: len(positions)][within_path])
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        key_codes = keys >> 32
+        code_starts = np.flatnonzero(
+            np.concatenate([[True], key_codes[1:] != key_codes[:-1]])
+        )
+        offsets = np.append(code_starts, len(keys))
+        postings = (keys & 0xFFFFFFFF).astype(np.int32)
+        return cls(
+            list(paths), key_codes[code_starts].astype(np.int32), offsets, postings
+        )
+
+    def candidates(self, mention: str) -> np.ndarray | None:
+        """
+        Sorted ids of the paths containing every trigram of the mention, None if it has
+        none.
+        """
+        encoded = np.frombuffer(mention.encode(), dtype=np.uint8)
+        if len(encoded) < 3:
+            return None
+        codes = np.unique(get_trigram_codes(encoded))
+        positions = np.searchsorted(self.codes, codes)
+        if np.any(positions >= len(self.codes)) or np.any(
+            self.codes[positions] != codes
+        ):
+            return np.zeros(0, dtype=np.int32)
+        postings = sorted(
+            (
+                self.postings[self.offsets[position] : self.offsets[position + 1]]
+                for position in positions
+            ),
+            key=len,
+        )
+        result = postings[0]
+        for posting in postings[1:]:
+            result = np.intersect1d(result, posting, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+    def match(self, mentions: list[str]) -> list[str]:
+        """
+        Paths containing any of the mentions, in path order, like
+
+            [path for path in paths for mention in mentions if mention in path]
+        """
+        matches = []
+        for mention_idx, mention in enumerate(mentions):
+            path_ids = self.candidates(mention)
+            if path_ids is None:
+                path_ids = range(len(self.paths))
+            matches.extend(
+                (path_id, mention_idx)
+                for path_id in path_ids
+                if mention in self.paths[path_id]
+            )
+        return [self.paths[path_id] for path_id, _ in sorted(matches)]
+
+    def save(self, path: str):
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Written to a temporary file first, so readers never see a partial index
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                paths=np.array(self.paths, dtype=object),
+                codes=self.codes,
+                offsets=self.offsets,
+                postings=self.postings,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PathIndex":
+        with np.load(path, allow_pickle=True) as data:
+            return cls(
+                data["paths"].tolist(),
+                data["codes"],
+                data["offsets"],
+                data["postings"],
+            )
+
+
+def get_path_index_path(commit_hash: str) -> str:
+    return os.path.join(PATH_INDEX_DIR, f"{commit_hash}.npz")
+
+
+def gc_path_indices(max_indices: int = MAX_PATH_INDICES):
+    try:
+        entries = [entry for entry in os.scandir(PATH_INDEX_DIR) if entry.is_file()]
+    except FileNotFoundError:
+        return
+    indices = sorted(
+        ((entry.stat().st_mtime, entry.path) for entry in entries), reverse=True
+    )
+    for _, index_path in indices[max_indices:]:
+        try:
+            os.remove(index_path)
+        except OSError:
+            pass
+
+
+@lru_cache(maxsize=16)
+def get_path_index(git_repo_dir: str, commit_hash: str) -> PathIndex:
+    """The files of a commit, loaded from disk or built with git ls-tree."""
+    index_path = get_path_index_path(commit_hash)
+    if os.path.exists(index_path):
+        try:
+            path_index = PathIndex.load(index_path)
+            os.utime(index_path)
+            return path_index
+        except Exception as e:
+            logger.warning(f"Could not load path index {index_path}: {e}")
+    import git
+
+    start = time.time()
+    output = git.Repo(git_repo_dir).git.ls_tree("-r", "-z", "--name-only", commit_hash)
+    paths = [path for path in output.split("\0") if path]
+    path_index = PathIndex.from_paths(paths)
+    path_index.save(index_path)
+    gc_path_indices()
+    logger.info(
+        f"Built path index of {len(paths)} files "
+        f"in {(time.time() - start) * 1000:.0f}ms"
+    )
+    return path_index
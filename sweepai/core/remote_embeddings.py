@@ -0,0 +1,237 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Callable
+
+import httpx
+from loguru import logger
+
+from sweepai.config.server import (
+    BATCH_SIZE,
+    EMBEDDING_API_CONCURRENCY,
+    EMBEDDING_API_MAX_RETRIES,
+    EMBEDDING_API_REQUESTS_PER_SECOND,
+    HUGGINGFACE_TOKEN,
+    HUGGINGFACE_URL,
+    OPENAI_API_BASE,
+    OPENAI_API_KEY,
+    OPENAI_API_TYPE,
+    OPENAI_API_VERSION,
+    OPENAI_EMBEDDINGS_DEPLOYMENT,
+)
+
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30
+REQUEST_TIMEOUT_SECONDS = 60
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to capacity."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RetryableError(Exception):
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_backoff(attempt: int, retry_after: float | None = None) -> float:
+    if retry_after is not None:
+        return retry_after
+    delay = min(BACKOFF_BASE_SECONDS * 2**attempt, BACKOFF_MAX_SECONDS)
+    return delay * (0.5 + random.random() / 2)
+
+
+class RemoteEmbeddingClient:
+    """
+    Embeds texts through an HTTP API, sending batches concurrently.
+
+    Requests share one pooled httpx client on a background event loop, so the client can
+    be called from any thread. In-flight requests are bounded by max_concurrency and
+    started at most requests_per_second, failed requests are retried with exponential
+    backoff, and results are returned in the order of the texts.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        headers: dict[str, str],
+        build_payload: Callable[[list[str]], dict],
+        parse_response: Callable[[dict], list[list[float]]],
+        batch_size: int = BATCH_SIZE,
+        max_concurrency: int = EMBEDDING_API_CONCURRENCY,
+        requests_per_second: float = EMBEDDING_API_REQUESTS_PER_SECOND,
+        max_retries: int = EMBEDDING_API_MAX_RETRIES,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.url = url
+        self.headers = headers
+        self.build_payload = build_payload
+        self.parse_response = parse_response
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.transport = transport
+        self.loop = None
+        self.client = None
+        self.semaphore = None
+        self.token_bucket = None
+        self.lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True).start()
+                self.loop = loop
+        return self.loop
+
+    async def ensure_client(self):
+        # Created on the background loop, which every request runs on
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=REQUEST_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=self.max_concurrency),
+                transport=self.transport,
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.token_bucket = TokenBucket(self.requests_per_second)
+
+    async def embed_batch(self, batch: list[str]) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    await self.token_bucket.acquire()
+                    response = await self.client.post(
+                        self.url, json=self.build_payload(batch)
+                    )
+                if response.status_code == 429 or response.status_code >= 500:
+                    retry_after = response.headers.get("Retry-After")
+                    raise RetryableError(
+                        f"{response.status_code}: {response.text[:200]}",
+                        float(retry_after)
+                        if retry_after and retry_after.isdigit()
+                        else None,
+                    )
+                response.raise_for_status()
+                embeddings = self.parse_response(response.json())
+                if len(embeddings) != len(batch):
+                    raise RetryableError(
+                        f"Expected {len(batch)} embeddings, got {len(embeddings)}"
+                    )
+                return embeddings
+            except (RetryableError, httpx.TransportError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = get_backoff(attempt, getattr(e, "retry_after", None))
+                logger.warning(
+                    f"Embedding request failed ({e}), retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    async def embed_async(self, texts: list[str]) -> list[list[float]]:
+        await self.ensure_client()
+        batches = [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        results = await asyncio.gather(*(self.embed_batch(batch) for batch in batches))
+        return [
+            embedding for batch_embeddings in results for embedding in batch_embeddings
+        ]
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        future = asyncio.run_coroutine_threadsafe(
+            self.embed_async(list(texts)), self.get_loop()
+        )
+        return future.result()
+
+
+def get_openai_endpoint() -> tuple[str, dict[str, str]]:
+    """
+    URL and auth headers of the embeddings endpoint, from the same settings as the openai
+    module, so Azure and proxied deployments embed through their own endpoint.
+    """
+    import openai
+
+    api_type = (OPENAI_API_TYPE or openai.api_type or "open_ai").lower()
+    api_base = (OPENAI_API_BASE or openai.api_base).rstrip("/")
+    api_key = OPENAI_API_KEY or openai.api_key
+    if api_type in ("azure", "azure_ad"):
+        api_version = OPENAI_API_VERSION or openai.api_version
+        url = (
+            f"{api_base}/openai/deployments/{OPENAI_EMBEDDINGS_DEPLOYMENT}"
+            f"/embeddings?api-version={api_version}"
+        )
+        if api_type == "azure":
+            return url, {"api-key": api_key}
+        return url, {"Authorization": f"Bearer {api_key}"}
+    return f"{api_base}/embeddings", {"Authorization": f"Bearer {api_key}"}
+
+
+def get_openai_client() -> RemoteEmbeddingClient:
+    url, headers = get_openai_endpoint()
+    return RemoteEmbeddingClient(
+        url,
+        headers=headers,
+        build_payload=lambda batch: {"input": batch, "model": OPENAI_EMBEDDING_MODEL},
+        parse_response=lambda response: [
+            row["embedding"]
+            for row in sorted(response["data"], key=lambda row: row["index"])
+        ],
+    )
+
+
+def get_huggingface_client() -> RemoteEmbeddingClient:
+    return RemoteEmbeddingClient(
+        HUGGINGFACE_URL,
+        headers={"Authorization": f"Bearer {HUGGINGFACE_TOKEN}"},
+        build_payload=lambda batch: {"inputs": batch},
+        parse_response=lambda response: response["embeddings"],
+    )
+
+
+remote_embedding_clients = {}
+remote_embedding_clients_lock = threading.Lock()
+
+
+def get_remote_embedding_client(source: str) -> RemoteEmbeddingClient:
+    # One client per provider and process, so the connection pool is reused across calls
+    with remote_embedding_clients_lock:
+        if source not in remote_embedding_clients:
+            match source:
+                case "openai":
+                    remote_embedding_clients[source] = get_openai_client()
+                case "huggingface":
+                    remote_embedding_clients[source] = get_huggingface_client()
+                case _:
+                    raise ValueError(f"Unknown embedding provider {source}")
+        return remote_embedding_clients[source]
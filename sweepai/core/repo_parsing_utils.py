@@ -1,67 +1,315 @@
-import glob
+import hashlib
+import json
 import os
-import itertools
+import stat
+import subprocess
+import traceback
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from loguru import logger
 
 from tqdm import tqdm
-from sweepai.utils.utils import chunk_code
+from sweepai.config.server import NUM_INDEXING_WORKERS
+from sweepai.redis_init import redis_client
+from sweepai.utils.parser_registry import ParserLimitExceeded
+from sweepai.utils.utils import (
+    CHUNKER_VERSION,
+    Span,
+    get_chunk_spans,
+    get_language,
+    naive_chunk_code,
+    spans_to_snippets,
+)
 
 
-def filter_file(file, sweep_config):
-    for ext in sweep_config.exclude_exts:
-        if file.endswith(ext):
-            return False
-    for dir_name in sweep_config.exclude_dirs:
-        if file[len("repo/") :].startswith(dir_name):
-            return False
-    if not os.path.isfile(file):
+FILE_THRESHOLD = 100
+MIN_FILES_FOR_PARALLEL_CHUNKING = 64
+CHUNK_BATCH_SIZE = 64
+CHUNK_CACHE_TTL = 60 * 60 * 24 * 30  # 30 days
+
+
+def is_excluded_dir(relative_dir, sweep_config):
+    if not relative_dir:
         return False
-    with open(file, "rb") as f:
-        is_binary = False
-        for block in iter(lambda: f.read(1024), b""):
-            if b"\0" in block:
-                is_binary = True
-                break
-        if is_binary:
-            return False
-
-    with open(file, "rb") as f:
-        if len(f.read()) > 60000:
-            return False
-    return True
-
-
-def read_file(file_name):
+    # glob("**") never descended into hidden directories, so neither do we
+    parts = relative_dir.split("/")
+    if any(part.startswith(".") or part in sweep_config.exclude_dirs for part in parts):
+        return True
+    return any(
+        relative_dir.startswith(dir_name.rstrip("/") + "/")
+        for dir_name in sweep_config.exclude_dirs
+        if "/" in dir_name.rstrip("/")
+    )
+
+
+def is_excluded_path(relative_path, sweep_config):
+    file_name = os.path.basename(relative_path)
+    if file_name.startswith("."):
+        return True
+    for ext in sweep_config.exclude_exts:
+        if file_name.endswith(ext):
+            return True
+    return is_excluded_dir(os.path.dirname(relative_path), sweep_config)
+
+
+def walk_repo_files(directory, sweep_config):
+    relative_paths = []
+
+    def walk(relative_dir):
+        with os.scandir(os.path.join(directory, relative_dir)) as entries:
+            for entry in entries:
+                relative_path = (
+                    f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                )
+                if entry.is_dir(follow_symlinks=False):
+                    # Prune before descending
+                    if not is_excluded_dir(relative_path, sweep_config):
+                        walk(relative_path)
+                elif entry.is_file():
+                    relative_paths.append(relative_path)
+
+    walk("")
+    return sorted(relative_paths)
+
+
+def list_repo_files(directory, sweep_config):
+    """Lists the repo-relative paths of every file, using the git index when possible."""
     try:
-        with open(file_name, "r") as f:
-            return f.read()
-    except:
+        output = subprocess.run(
+            ["git", "ls-files", "-z"],
+            cwd=directory,
+            capture_output=True,
+            check=True,
+        ).stdout
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.warning(f"git ls-files failed in {directory}, walking the tree: {e}")
+        return walk_repo_files(directory, sweep_config)
+    return [
+        relative_path
+        for relative_path in output.decode("utf-8", errors="replace").split("\0")
+        if relative_path
+    ]
+
+
+def get_dir_sizes(relative_paths):
+    # Number of entries directly in each directory, "" being the repo root
+    dir_children = defaultdict(set)
+    for relative_path in relative_paths:
+        parts = relative_path.split("/")
+        for i, part in enumerate(parts):
+            dir_children["/".join(parts[:i])].add(part)
+    return {dir_name: len(children) for dir_name, children in dir_children.items()}
+
+
+def get_candidate_files(directory, relative_paths, sweep_config, dir_sizes):
+    """Returns the paths of files that pass every check that doesn't need their contents.
+
+    Each file is stat'ed once and never opened.
+    """
+    file_list = []
+    for relative_path in relative_paths:
+        if is_excluded_path(relative_path, sweep_config):
+            continue
+        if dir_sizes.get(os.path.dirname(relative_path), 0) > FILE_THRESHOLD:
+            continue
+        file_path = os.path.join(directory, relative_path)
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            continue
+        if (
+            stat.S_ISREG(file_stat.st_mode)
+            and file_stat.st_size <= sweep_config.max_file_limit
+        ):
+            file_list.append(file_path)
+    return file_list
+
+
+def read_files(file_list, sweep_config):
+    """Yields (file_path, contents) for every candidate file that is not binary, reading each file once."""
+    for file_path in file_list:
+        try:
+            with open(file_path, "rb") as f:
+                contents = f.read(sweep_config.max_file_limit + 1)
+        except OSError:
+            continue
+        if len(contents) > sweep_config.max_file_limit or b"\0" in contents:
+            continue
+        yield file_path, contents
+
+
+def scan_files(directory, relative_paths, sweep_config, dir_sizes):
+    file_list = get_candidate_files(directory, relative_paths, sweep_config, dir_sizes)
+    return read_files(file_list, sweep_config)
+
+
+def list_candidate_files(directory, sweep_config):
+    """Returns the paths of every file in the repo that passes the checks of get_candidate_files."""
+    relative_paths = list_repo_files(directory, sweep_config)
+    dir_sizes = get_dir_sizes(relative_paths)
+    return get_candidate_files(directory, relative_paths, sweep_config, dir_sizes)
+
+
+def files_to_chunk_batches(file_list, sweep_config):
+    return iter_chunk_batches(read_files(file_list, sweep_config), len(file_list))
+
+
+def decode_file_contents(contents: bytes) -> str:
+    # Same as reading the file in text mode, which uses universal newlines
+    try:
+        text = contents.decode("utf-8")
+    except UnicodeDecodeError:
         return ""
+    return text.replace("\r\n", "\n").replace("\r", "\n")
 
-FILE_THRESHOLD = 100
 
-def repo_to_chunks(directory, sweep_config):
-    dir_file_count = {}
-    
-    def is_dir_too_big(file_name):
-        dir_name = os.path.dirname(file_name) 
-        if file_name == "node_modules" or file_name == "venv":
-            return True
-        if dir_name not in dir_file_count:
-            dir_file_count[dir_name] = len(os.listdir(dir_name))
-        return dir_file_count[dir_name] > FILE_THRESHOLD
-    logger.info(f"Reading files from {directory}")
-
-    file_list = glob.iglob(f"{directory}/**", recursive=True)
-    file_list = [
-        file_name for file_name in file_list 
-        if filter_file(file_name, sweep_config) and not is_dir_too_big(file_name)
+def get_blob_sha(contents: bytes) -> str:
+    # Same hash as `git hash-object`, so identical files share cache entries across repos and forks
+    return hashlib.sha1(b"blob %d\0" % len(contents) + contents).hexdigest()
+
+
+def get_chunk_cache_key(
+    blob_sha: str, language: str, MAX_CHARS: int, coalesce: int
+) -> str:
+    # Spans depend on the grammar, so the same blob is cached once per language
+    return f"chunks-{blob_sha}-{language}-{CHUNKER_VERSION}-{MAX_CHARS}-{coalesce}"
+
+
+def get_cached_spans(cache_keys: list[str]) -> list[list[Span] | None]:
+    if not cache_keys:
+        return []
+    try:
+        cache_values = redis_client.mget(cache_keys)
+    except Exception as e:
+        logger.warning(f"Could not read chunk cache: {e}")
+        return [None] * len(cache_keys)
+    return [
+        [Span(start, end) for start, end in json.loads(value)]
+        if value is not None
+        else None
+        for value in cache_values
     ]
-    logger.info(f"Found {len(file_list)} files")
+
+
+def set_cached_spans(cache_entries: dict[str, list[Span]]):
+    if not cache_entries:
+        return
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for cache_key, spans in cache_entries.items():
+            pipeline.set(
+                cache_key,
+                json.dumps([[span.start, span.end] for span in spans]),
+                ex=CHUNK_CACHE_TTL,
+            )
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Could not write chunk cache: {e}")
+
+
+def chunk_file_batch(files, MAX_CHARS=1500, coalesce=100):
+    """Chunks a batch of (file_path, contents), only parsing blobs that are not in the chunk cache.
+
+    Returns the chunks of each file in order, along with the number of cache hits and lookups.
+    """
+    file_paths = [file_path for file_path, _ in files]
+    codes = []
+    cache_keys = {}
+    for idx, (file_path, contents) in enumerate(files):
+        codes.append(decode_file_contents(contents))
+        language = get_language(file_path)
+        if language is not None:
+            cache_keys[idx] = get_chunk_cache_key(
+                get_blob_sha(contents), language, MAX_CHARS, coalesce
+            )
+    cached_spans = dict(
+        zip(cache_keys, get_cached_spans(list(cache_keys.values())))
+    )
     all_chunks = []
-    for file_path in tqdm(file_list):
-        file_contents = read_file(file_path)
-        logger.info(f"Reading {file_path}")
-        chunks = chunk_code(file_contents, path=file_path)
-        all_chunks.extend(chunks)
-    return all_chunks, file_list
+    new_cache_entries = {}
+    num_hits = 0
+    for idx, (file_path, code) in enumerate(zip(file_paths, codes)):
+        if idx not in cache_keys:
+            all_chunks.append(naive_chunk_code(code, file_path))
+            continue
+        spans = cached_spans[idx]
+        if spans is not None:
+            num_hits += 1
+        else:
+            try:
+                spans = get_chunk_spans(
+                    code, get_language(file_path), MAX_CHARS=MAX_CHARS, coalesce=coalesce
+                )
+            except ParserLimitExceeded as e:
+                logger.warning(f"Falling back to naive chunking for {file_path}: {e}")
+                all_chunks.append(naive_chunk_code(code, file_path))
+                continue
+            except Exception:
+                logger.error(traceback.format_exc())
+                all_chunks.append([])
+                continue
+            new_cache_entries[cache_keys[idx]] = spans
+        all_chunks.append(spans_to_snippets(code, spans, file_path))
+    set_cached_spans(new_cache_entries)
+    return all_chunks, num_hits, len(cache_keys)
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def map_in_processes(function, batches, num_workers):
+    """Like executor.map, but only keeps a few batches in flight so reading files stays ahead of parsing by a bounded amount."""
+    pending = deque()
+    # A batch taken from batches whose submit has not succeeded yet
+    unsubmitted_batch = None
+    try:
+        # Workers load each grammar the first time one of their files needs it
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            for batch in batches:
+                unsubmitted_batch = batch
+                pending.append((batch, executor.submit(function, batch)))
+                unsubmitted_batch = None
+                if len(pending) > num_workers * 2:
+                    yield pending[0][1].result()
+                    pending.popleft()
+            while pending:
+                yield pending[0][1].result()
+                pending.popleft()
+    except Exception as e:
+        logger.warning(f"Parallel chunking failed, falling back to serial: {e}")
+        for batch, _ in pending:
+            yield function(batch)
+        if unsubmitted_batch is not None:
+            yield function(unsubmitted_batch)
+        for batch in batches:
+            yield function(batch)
+
+
+def iter_chunk_batches(files, num_files, num_workers=NUM_INDEXING_WORKERS):
+    """Yields the chunks of each batch of (file_path, contents), in file order."""
+    batches = iter_batches(files, CHUNK_BATCH_SIZE)
+    if num_workers > 1 and num_files >= MIN_FILES_FOR_PARALLEL_CHUNKING:
+        logger.info(f"Chunking {num_files} files with {num_workers} workers")
+        results = map_in_processes(chunk_file_batch, batches, num_workers)
+    else:
+        results = map(chunk_file_batch, batches)
+    num_hits = 0
+    num_lookups = 0
+    with tqdm(total=num_files) as progress_bar:
+        for batch_chunks, batch_hits, batch_lookups in results:
+            yield [chunk for chunks in batch_chunks for chunk in chunks]
+            num_hits += batch_hits
+            num_lookups += batch_lookups
+            progress_bar.update(len(batch_chunks))
+    if num_lookups:
+        logger.info(
+            f"Chunk cache hit rate: {num_hits}/{num_lookups} ({num_hits / num_lookups:.1%})"
+        )
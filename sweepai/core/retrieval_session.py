@@ -0,0 +1,92 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import numpy as np
+from loguru import logger
+
+from sweepai.config.client import SweepConfig
+from sweepai.core.entities import Snippet
+from sweepai.core.path_index import PathIndex, get_path_index
+from sweepai.core.vector_db import (
+    embedding_function,
+    get_deeplake_vs_from_repo,
+    get_relevant_snippets_batch,
+)
+from sweepai.utils.github_utils import ClonedRepo
+
+
+@dataclass
+class RetrievalSession:
+    """
+    Search state shared by the repeated search_snippets calls of one ticket.
+
+    The index and path index are opened once, and query embeddings, ranked results and
+    file contents are kept, so later searches only do the work that is new to them:
+    embedding and ranking new queries and fetching new files.
+    """
+
+    cloned_repo: ClonedRepo
+    sweep_config: SweepConfig = field(default_factory=SweepConfig)
+    query_embeddings: dict[str, np.ndarray] = field(default_factory=dict)
+    ranked_snippets: dict[tuple[str, int], list[Snippet]] = field(default_factory=dict)
+    file_contents: dict[tuple[str, str | None], str] = field(default_factory=dict)
+
+    @cached_property
+    def index(self):
+        return get_deeplake_vs_from_repo(self.cloned_repo, sweep_config=self.sweep_config)
+
+    @cached_property
+    def path_index(self) -> PathIndex:
+        return get_path_index(
+            self.cloned_repo.cache_dir, self.cloned_repo.git_repo.head.object.hexsha
+        )
+
+    def get_query_embeddings(self, queries: list[str]) -> np.ndarray:
+        new_queries = [query for query in queries if query not in self.query_embeddings]
+        if new_queries:
+            for query, embedding in zip(new_queries, embedding_function(new_queries)):
+                self.query_embeddings[query] = np.asarray(embedding, dtype=np.float32)
+        return np.stack([self.query_embeddings[query] for query in queries])
+
+    def get_relevant_snippets(
+        self, queries: list[str], n_results: int
+    ) -> list[list[Snippet]]:
+        new_queries = list(
+            dict.fromkeys(
+                query
+                for query in queries
+                if (query, n_results) not in self.ranked_snippets
+            )
+        )
+        if new_queries:
+            results = get_relevant_snippets_batch(
+                self.cloned_repo,
+                new_queries,
+                n_results,
+                sweep_config=self.sweep_config,
+                index=self.index,
+                query_embeddings=self.get_query_embeddings(new_queries),
+            )
+            for query, snippets in zip(new_queries, results):
+                self.ranked_snippets[(query, n_results)] = snippets
+        else:
+            logger.info(f"Reusing ranked snippets for {len(queries)} queries")
+        # Callers fill in the contents, so each gets its own copies
+        return [
+            [snippet.copy() for snippet in self.ranked_snippets[(query, n_results)]]
+            for query in queries
+        ]
+
+    def get_file_contents(self, file_path: str, ref: str | None = None) -> str:
+        key = (file_path, ref)
+        if key not in self.file_contents:
+            self.file_contents[key] = self.cloned_repo.get_file_contents(file_path, ref=ref)
+        return self.file_contents[key]
+
+    def get_tree(
+        self, snippet_paths: list[str], excluded_directories: list[str] = None
+    ) -> str:
+        # Rendered from the commit's in-memory tree, which memoizes each render
+        return self.cloned_repo.get_tree_and_file_list(
+            snippet_paths=snippet_paths, excluded_directories=excluded_directories
+        )
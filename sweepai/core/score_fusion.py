@@ -0,0 +1,52 @@
+import numpy as np
+
+from sweepai.config.server import (
+    CODE_SCORE_WEIGHT,
+    LEXICAL_SCORE_WEIGHT,
+    VECTOR_SCORE_WEIGHT,
+)
+
+# Lexical score of snippets that matched none of the query's terms
+MISSING_LEXICAL_SCORE = 0.3
+
+
+def lexical_scores_to_array(
+    content_to_lexical_score: dict[str, float], key_to_index: dict[str, int], num_rows: int
+) -> np.ndarray:
+    """Lexical scores aligned with the rows, keyed by file_path:start:end like the row ids."""
+    lexical_scores = np.full(num_rows, MISSING_LEXICAL_SCORE, dtype=np.float32)
+    for key, score in content_to_lexical_score.items():
+        idx = key_to_index.get(key)
+        if idx is not None:
+            lexical_scores[idx] = score
+    return lexical_scores
+
+
+def fuse_scores(
+    code_scores: np.ndarray,
+    vector_scores: np.ndarray,
+    lexical_scores: np.ndarray,
+    k: int,
+    weights: tuple[float, float, float] | None = None,
+) -> np.ndarray:
+    """
+    Indices of the k rows with the highest weighted sum of scores, best first.
+
+    Only the top k are sorted, so nothing proportional to the number of rows is built
+    outside of NumPy. Ties keep row order.
+    """
+    code_weight, vector_weight, lexical_weight = weights or (
+        CODE_SCORE_WEIGHT,
+        VECTOR_SCORE_WEIGHT,
+        LEXICAL_SCORE_WEIGHT,
+    )
+    fused_scores = (
+        code_weight * np.asarray(code_scores, dtype=np.float32)
+        + vector_weight * np.asarray(vector_scores, dtype=np.float32)
+        + lexical_weight * np.asarray(lexical_scores, dtype=np.float32)
+    )
+    k = min(k, len(fused_scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top_indices = np.sort(np.argpartition(-fused_scores, k - 1)[:k])
+    return top_indices[np.argsort(-fused_scores[top_indices], kind="stable")]
@@ -49,7 +49,8 @@ from sweepai.utils.diff import (
     is_markdown,
     get_matches,
 )
-from sweepai.utils.utils import chunk_code
+from sweepai.utils.parser_registry import parser_registry
+from sweepai.utils.utils import chunk_code, get_language
 
 USING_DIFF = True
 
@@ -234,6 +235,7 @@ class GithubBot(BaseModel):
         arbitrary_types_allowed = True  # for repo: Repository
 
     repo: Repository
+    cloned_repo: Any = None  # ClonedRepo, serves file contents from the local clone
 
     def get_contents(self, path: str, branch: str = ""):
         if not branch:
@@ -304,6 +306,11 @@ class GithubBot(BaseModel):
     def populate_snippets(self, snippets: list[Snippet]):
         for snippet in snippets:
             try:
+                if self.cloned_repo is not None:
+                    snippet.content = self.cloned_repo.get_file_contents(
+                        snippet.file_path, SweepConfig.get_branch(self.repo)
+                    )
+                    continue
                 snippet.content = self.repo.get_contents(
                     snippet.file_path, SweepConfig.get_branch(self.repo)
                 ).decoded_content.decode("utf-8")
@@ -672,6 +679,21 @@ class SweepBot(CodeGenBot, GithubBot):
             self.delete_messages_from_chat(key)
         raise Exception("Failed to parse response after 5 attempts.")
 
+    def update_file_tree(
+        self, tree_key: tuple[str, str, str], old_contents: str, new_contents: str
+    ):
+        # Re-parses the edited region only, so re-chunking the new contents on this
+        # branch reuses the tree instead of parsing the file again
+        language = get_language(tree_key[2])
+        if language is None or old_contents == new_contents:
+            return
+        try:
+            parser_registry.update_file(
+                tree_key, language, old_contents.encode("utf-8"), new_contents.encode("utf-8")
+            )
+        except Exception as e:
+            logger.warning(f"Could not update the syntax tree of {tree_key[2]}: {e}")
+
     def rewrite_file(
         self, 
         file_change_request: FileChangeRequest,
@@ -681,7 +703,8 @@ class SweepBot(CodeGenBot, GithubBot):
         original_file = self.repo.get_contents(file_change_request.filename, branch=branch)
         original_contents = original_file.decoded_content.decode("utf-8")
         contents = original_contents
-        for snippet in chunk_code(contents, file_change_request.filename, MAX_CHARS=2300, coalesce=200):
+        tree_key = (self.repo.full_name, branch, file_change_request.filename)
+        for snippet in chunk_code(contents, file_change_request.filename, MAX_CHARS=2300, coalesce=200, tree_key=tree_key):
             chunks.append(snippet.get_snippet(add_ellipsis=False, add_lines=False))
         for i, chunk in enumerate(chunks):
             section_rewrite = self.rewrite_section(file_change_request, contents, chunk)
@@ -696,6 +719,7 @@ class SweepBot(CodeGenBot, GithubBot):
             sha=original_file.sha,
             branch=branch,
         )
+        self.update_file_tree(tree_key, original_contents, contents)
         return contents != original_contents
 
     def change_files_in_github(
@@ -971,6 +995,11 @@ class SweepBot(CodeGenBot, GithubBot):
                     branch=branch,
                 )
                 file_change_request.new_content = new_file_contents
+                self.update_file_tree(
+                    (self.repo.full_name, branch, file_name),
+                    file_contents,
+                    new_file_contents,
+                )
                 return True, sandbox_error
             except Exception as e:
                 logger.info(f"Error in updating file, repulling and trying again {e}")
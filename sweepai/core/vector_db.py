@@ -3,14 +3,14 @@ import json
 import os
 import pickle
 import re
+import shutil
+import tempfile
 import time
+from dataclasses import dataclass
 from functools import lru_cache
-from typing import Generator, List
+from typing import List
 
 import numpy as np
-from deeplake.core.vectorstore.deeplake_vectorstore import (  # pylint: disable=import-error
-    DeepLakeVectorStore,
-)
 from github import Github
 from loguru import logger
 from redis import Redis
@@ -18,24 +18,51 @@ from redis.backoff import ConstantBackoff
 from redis.exceptions import BusyLoadingError, ConnectionError, TimeoutError
 from redis.retry import Retry
 import requests
-from sentence_transformers import SentenceTransformer  # pylint: disable=import-error
 from tqdm import tqdm
 from sweepai.config.client import SweepConfig
 from sweepai.config.server import (
     BATCH_SIZE,
+    EMBEDDING_CACHE_DTYPE,
+    HUGGINGFACE_MAX_TOKENS,
+    HUGGINGFACE_MODEL,
     HUGGINGFACE_TOKEN,
     HUGGINGFACE_URL,
+    OPENAI_EMBEDDING_MAX_TOKENS,
     REDIS_URL,
     SENTENCE_TRANSFORMERS_MODEL,
     VECTOR_EMBEDDING_SOURCE,
+    VECTOR_STORE_BACKEND,
+)
+from sweepai.core.embedding_cache import get_cached_embeddings, set_cached_embeddings
+from sweepai.core.embedding_models import (
+    model_registry,
+    truncate_texts_with_tokenizer,
 )
+from sweepai.core.embedding_server import embed_with_server
 from sweepai.core.entities import Snippet
-from sweepai.core.lexical_search import prepare_index_from_snippets, search_index
-from sweepai.core.repo_parsing_utils import repo_to_chunks
+from sweepai.core.flat_vector_store import FlatVectorStore
+from sweepai.core.path_index import get_path_index
+from sweepai.core.remote_embeddings import (
+    OPENAI_EMBEDDING_MODEL,
+    get_remote_embedding_client,
+)
+from sweepai.core.lexical_search import (
+    LexicalIndexBuilder,
+    open_lexical_index,
+    search_index,
+)
+from sweepai.core.repo_parsing_utils import (
+    files_to_chunk_batches,
+    iter_batches,
+    iter_chunk_batches,
+    list_candidate_files,
+)
+from sweepai.core.score_fusion import fuse_scores, lexical_scores_to_array
 from sweepai.utils.event_logger import posthog
 from sweepai.utils.hash import hash_sha256
+from sweepai.utils.pipeline import buffered
 from redis import Redis
-from sweepai.utils.scorer import compute_score, get_scores
+from sweepai.utils.scorer import get_git_history_stats, get_scores
 from ..utils.github_utils import ClonedRepo, get_token
 import openai
 
@@ -43,9 +70,16 @@ MODEL_DIR = "cache/model"
 DEEPLAKE_DIR = "cache/"
 DISKCACHE_DIR = "cache/diskcache/"
 DEEPLAKE_FOLDER = "cache/deeplake/"
+FLAT_VECTOR_FOLDER = "cache/flat_vectors/"
+INDEX_MANIFEST_DIR = "cache/index_manifests/"
+CODE_SCORES_FOLDER = "cache/code_scores/"
 timeout = 60 * 60  # 30 minutes
 CACHE_VERSION = "v1.0.13"
+INDEX_MANIFEST_VERSION = 3  # Bumped when rows change shape, so older stores are never updated in place
 MAX_FILES = 500
+PIPELINE_BATCH_SIZE = 1024  # Snippets embedded and written per batch while indexing
+PIPELINE_QUEUE_SIZE = 4  # Batches buffered between indexing stages
+MAX_RELEVANT_SNIPPETS = 25
 
 redis_client = Redis.from_url(REDIS_URL)
 
@@ -58,7 +92,27 @@ def download_models():
     model = SentenceTransformer(SENTENCE_TRANSFORMERS_MODEL, cache_folder=MODEL_DIR)
 
 
+def get_vector_store(path: str):
+    if VECTOR_STORE_BACKEND == "flat":
+        return FlatVectorStore(path)
+    # Imported lazily, deeplake is slow to import
+    from deeplake.core.vectorstore.deeplake_vectorstore import (  # pylint: disable=import-error
+        DeepLakeVectorStore,
+    )
+
+    return DeepLakeVectorStore(path)
+
+
+def get_vector_store_path(cache_key: str):
+    folder = FLAT_VECTOR_FOLDER if VECTOR_STORE_BACKEND == "flat" else DEEPLAKE_FOLDER
+    return os.path.join(folder, cache_key)
+
+
 def init_deeplake_vs(repo_name):
+    from deeplake.core.vectorstore.deeplake_vectorstore import (  # pylint: disable=import-error
+        DeepLakeVectorStore,
+    )
+
     deeplake_repo_path = f"mem://{DEEPLAKE_FOLDER}{repo_name}"
     deeplake_vector_store = DeepLakeVectorStore(path=deeplake_repo_path)
     return deeplake_vector_store
@@ -73,49 +127,37 @@ def parse_collection_name(name: str) -> str:
 
 def embed_huggingface(texts):
     """Embeds a list of texts using Hugging Face's API."""
-    for i in range(3):
-        try:
-            headers = {
-                "Authorization": f"Bearer {HUGGINGFACE_TOKEN}",
-                "Content-Type": "application/json"
-            }
-            response = requests.post(HUGGINGFACE_URL, headers=headers, json={"inputs": texts})
-            return response.json()["embeddings"]
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error occurred when sending request to Hugging Face endpoint: {e}")
+    return get_remote_embedding_client("huggingface").embed(
+        truncate_texts(texts, source="huggingface")
+    )
 
 @lru_cache(maxsize=64)
 def embed_texts(texts: tuple[str]):
     logger.info(f"Computing embeddings for {len(texts)} texts using {VECTOR_EMBEDDING_SOURCE}...")
     match VECTOR_EMBEDDING_SOURCE:
         case "sentence-transformers":
-            sentence_transformer_model = SentenceTransformer(
-                SENTENCE_TRANSFORMERS_MODEL, cache_folder=MODEL_DIR
-            )
-            vector = sentence_transformer_model.encode(
-                texts, show_progress_bar=True, batch_size=BATCH_SIZE
+            vector = model_registry.encode(
+                truncate_texts(texts, source="sentence-transformers"),
+                show_progress_bar=True,
+                batch_size=BATCH_SIZE,
             )
             return vector
+        case "onnx":
+            return model_registry.encode(
+                truncate_texts(texts, source="onnx"),
+                show_progress_bar=True,
+                batch_size=BATCH_SIZE,
+                backend="onnx",
+            )
         case "openai":
-            import openai
-
-            embeddings = []
-            for batch in tqdm(chunk(texts, batch_size=BATCH_SIZE), disable=False):
-                try:
-                    response = openai.Embedding.create(
-                        input=batch, model="text-embedding-ada-002"
-                    )
-                    embeddings.extend([r["embedding"] for r in response["data"]])
-                except Exception as e:
-                    logger.error(e)
-                    logger.error(f"Failed to get embeddings for {batch}")
-            return embeddings
+            return get_remote_embedding_client("openai").embed(
+                truncate_texts(texts, source="openai")
+            )
+        case "embedding-server":
+            return embed_with_server(texts)
         case "huggingface": 
             if HUGGINGFACE_URL and HUGGINGFACE_TOKEN:
-                embeddings = []
-                for batch in tqdm(chunk(texts, batch_size=BATCH_SIZE), disable=False):
-                    embeddings.extend(embed_huggingface(texts))
-                return embeddings
+                return embed_huggingface(texts)
             else:
                 raise Exception("Hugging Face URL and token not set")
         case _:
@@ -132,133 +174,452 @@ def get_cache_key(cloned_repo: ClonedRepo, sweep_config: SweepConfig):
     return hashlib.sha256(params.encode()).hexdigest()
 
 
+@dataclass
+class IndexedFile:
+    blob_sha: str | None
+    spans: list[tuple[int, int]]  # (start, end) lines of the file's snippets
+
+
+@dataclass
+class IndexManifest:
+    # Everything needed to update an index in place for a later commit: every candidate
+    # file of the commit, by path relative to the repo root, even those without snippets.
+    # Snippet contents are not kept, unchanged files are re-read from their blobs.
+    commit_hash: str
+    deeplake_path: str
+    files: dict[str, IndexedFile]
+
+
+def get_manifest_path(cloned_repo: ClonedRepo, sweep_config: SweepConfig):
+    params = f"{cloned_repo.repo_full_name}--{sweep_config}--{CACHE_VERSION}--{INDEX_MANIFEST_VERSION}--{VECTOR_STORE_BACKEND}"
+    manifest_key = hashlib.sha256(params.encode()).hexdigest()
+    return os.path.join(INDEX_MANIFEST_DIR, f"{manifest_key}.pkl")
+
+
+def load_index_manifest(manifest_path: str) -> IndexManifest | None:
+    try:
+        with open(manifest_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not load index manifest {manifest_path}: {e}")
+        return None
+
+
+def save_index_manifest(manifest_path: str, manifest: IndexManifest):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def get_code_scores_path(cache_key: str):
+    return os.path.join(CODE_SCORES_FOLDER, f"{cache_key}.json")
+
+
+def save_code_scores(cache_key: str, files_to_scores: dict[str, float]):
+    code_scores_path = get_code_scores_path(cache_key)
+    os.makedirs(os.path.dirname(code_scores_path), exist_ok=True)
+    tmp_path = f"{code_scores_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(files_to_scores, f, default=float)
+    os.replace(tmp_path, code_scores_path)
+
+
+@lru_cache(maxsize=64)
+def read_code_scores(code_scores_path: str, mtime_ns: int) -> dict[str, float]:
+    with open(code_scores_path, "r") as f:
+        return json.load(f)
+
+
+def load_code_scores(cache_key: str) -> dict[str, float]:
+    """
+    The code score of every file of a commit, keyed by repo-relative path.
+
+    Scores are percentiles over the whole commit, so they are kept per commit rather
+    than in row metadata, which an incremental update only writes for changed files.
+    """
+    code_scores_path = get_code_scores_path(cache_key)
+    try:
+        return read_code_scores(code_scores_path, os.stat(code_scores_path).st_mtime_ns)
+    except FileNotFoundError:
+        return {}
+
+
+def get_changes_since_manifest(
+    cloned_repo: ClonedRepo, manifest: IndexManifest | None, commit_hash: str
+) -> tuple[list[str], list[str]] | None:
+    """Returns the (changed, deleted) files since the indexed commit, or None if a full re-index is needed."""
+    if manifest is None or not os.path.exists(manifest.deeplake_path):
+        return None
+    if manifest.commit_hash == commit_hash:
+        return [], []
+    try:
+        return cloned_repo.get_changed_files(manifest.commit_hash, commit_hash)
+    except Exception as e:
+        logger.warning(
+            f"Could not diff against indexed commit {manifest.commit_hash}, re-indexing from scratch: {e}"
+        )
+        return None
+
+
 def get_deeplake_vs_from_repo(
     cloned_repo: ClonedRepo,
     sweep_config: SweepConfig = SweepConfig(),
 ):
     cache_key = get_cache_key(cloned_repo, sweep_config)
-    deeplake_file_path = os.path.join("cache/deeplake/", cache_key)
+    deeplake_file_path = get_vector_store_path(cache_key)
     deeplake_vs = None
     if os.path.exists(deeplake_file_path):
-        deeplake_vs = DeepLakeVectorStore(deeplake_file_path)
+        deeplake_vs = get_vector_store(deeplake_file_path)
+        # Both indices already exist for this commit, so nothing needs to be read or chunked
+        lexical_index = open_lexical_index(cache_key)
+        if lexical_index is not None:
+            return deeplake_vs, lexical_index, lexical_index.doc_count()
 
     repo_full_name = cloned_repo.repo_full_name
-    repo = cloned_repo.repo
-    commits = repo.get_commits()
-    commit_hash = commits[0].sha
+    commit_hash = cloned_repo.git_repo.head.object.hexsha
+    len_repo_cache_dir = len(cloned_repo.cache_dir) + 1
+    manifest_path = get_manifest_path(cloned_repo, sweep_config)
+    manifest = load_index_manifest(manifest_path)
+    changes = get_changes_since_manifest(cloned_repo, manifest, commit_hash)
 
     logger.info(f"Downloading repository and indexing for {repo_full_name}...")
     start = time.time()
     logger.info("Recursively getting list of files...")
-
-    snippets, file_list = repo_to_chunks(cloned_repo.cache_dir, sweep_config)
-    logger.info(f"Found {len(snippets)} snippets in repository {repo_full_name}")
-    # prepare lexical search
-    index = prepare_index_from_snippets(
-        snippets, len_repo_cache_dir=len(cloned_repo.cache_dir) + 1
-    )
-    # scoring for vector search
-    files_to_scores = {}
-    score_factors = []
-    for file_path in file_list:
-        score_factor = compute_score(
-            file_path[len(cloned_repo.cache_dir) + 1 :], cloned_repo.git_repo
+    file_list = list_candidate_files(cloned_repo.cache_dir, sweep_config)
+    relative_file_list = [file_path[len_repo_cache_dir:] for file_path in file_list]
+    blob_shas = get_blob_shas(cloned_repo.git_repo, commit_hash)
+    if changes is None:
+        files_to_chunk = file_list
+        unchanged_files = {}
+        stale_row_ids = []
+    else:
+        changed_files, deleted_files = changes
+        logger.info(
+            f"Updating index from {manifest.commit_hash} to {commit_hash}: "
+            f"{len(changed_files)} changed and {len(deleted_files)} deleted files"
+        )
+        # Directory sizes can change without a file changing, so files that became
+        # candidates are chunked and files that stopped being candidates are dropped
+        stale_files = (
+            (set(manifest.files) - set(relative_file_list))
+            | set(changed_files)
+            | set(deleted_files)
         )
-        score_factors.append(score_factor)
+        unchanged_files = {
+            relative_file_path: indexed_file
+            for relative_file_path, indexed_file in manifest.files.items()
+            if relative_file_path not in stale_files
+            and indexed_file.blob_sha is not None
+            and indexed_file.blob_sha == blob_shas.get(relative_file_path)
+        }
+        files_to_chunk = [
+            file_path
+            for file_path, relative_file_path in zip(file_list, relative_file_list)
+            if relative_file_path not in unchanged_files
+        ]
+        stale_row_ids = [
+            get_row_id(relative_file_path, start_line, end_line)
+            for relative_file_path, indexed_file in manifest.files.items()
+            if relative_file_path not in unchanged_files
+            for start_line, end_line in indexed_file.spans
+        ]
+    logger.info(f"Chunking {len(files_to_chunk)} of {len(file_list)} files")
+    chunk_batches = files_to_chunk_batches(files_to_chunk, sweep_config)
+    # scoring for vector search. Scores are percentiles over every file, so all of them
+    # are recomputed, which only needs paths and the commit's git history stats.
+    git_history_stats = get_git_history_stats(cloned_repo.git_repo, repo_full_name)
+    score_factors = [
+        git_history_stats.get_factors(relative_file_path)
+        for relative_file_path in relative_file_list
+    ]
     # compute all scores
     all_scores = get_scores(score_factors)
     files_to_scores = {
-        file_path: score for file_path, score in zip(file_list, all_scores)
+        file_path: score for file_path, score in zip(relative_file_list, all_scores)
     }
-    logger.info(f"Found {len(file_list)} files in repository {repo_full_name}")
+    save_code_scores(cache_key, files_to_scores)
+    logger.info(f"Found {len(relative_file_list)} files in repository {repo_full_name}")
 
-    documents = []
-    metadatas = []
-    ids = []
-    for snippet in snippets:
-        documents.append(snippet.content)
-        metadata = {
-            "file_path": snippet.file_path[len(cloned_repo.cache_dir) + 1 :],
-            "start": snippet.start,
-            "end": snippet.end,
-            "score": files_to_scores[snippet.file_path],
-        }
-        metadatas.append(metadata)
-        gh_file_path = snippet.file_path[len("repo/") :]
-        ids.append(f"{gh_file_path}:{snippet.start}:{snippet.end}")
-    logger.info(f"Getting list of all files took {time.time() - start}")
-    logger.info(f"Received {len(documents)} documents from repository {repo_full_name}")
-    collection_name = parse_collection_name(repo_full_name)
-
-    deeplake_vs = deeplake_vs or compute_deeplake_vs(
-        collection_name, documents, ids, metadatas, commit_hash, deeplake_file_path
+    file_spans = {
+        relative_file_path: list(indexed_file.spans)
+        for relative_file_path, indexed_file in unchanged_files.items()
+    }
+    # Snippets are streamed into the lexical index as they are chunked, so only the
+    # batches in flight are ever in memory
+    index = open_lexical_index(cache_key)
+    builder = (
+        LexicalIndexBuilder(len_repo_cache_dir, cache_key) if index is None else None
     )
+    try:
+        if builder is not None:
+            # Unchanged files are chunked again from their blobs, which only parses
+            # files whose spans are not in the chunk cache
+            for chunks in iter_chunk_batches(
+                iter_blob_contents(cloned_repo, unchanged_files), len(unchanged_files)
+            ):
+                builder.add(chunks)
+        on_snippets = builder.add if builder is not None else None
+        if deeplake_vs is None:
+            deeplake_vs, num_new_snippets = build_vector_store(
+                deeplake_file_path,
+                manifest.deeplake_path if changes is not None else None,
+                stale_row_ids,
+                chunk_batches,
+                file_spans,
+                len_repo_cache_dir,
+                on_snippets,
+            )
+        else:
+            # Vectors for this commit already exist, the chunks are only needed for lexical search
+            num_new_snippets = 0
+            for chunks in chunk_batches:
+                num_new_snippets += len(chunks)
+                record_spans(chunks, file_spans, len_repo_cache_dir)
+                if on_snippets is not None:
+                    on_snippets(chunks)
+    except BaseException:
+        if builder is not None:
+            builder.abort()
+        raise
+    logger.info(f"Indexing {num_new_snippets} new snippets took {time.time() - start}")
+    if builder is not None:
+        index = builder.finish()
+    num_snippets = index.doc_count()
+    logger.info(f"Found {num_snippets} snippets in repository {repo_full_name}")
+
+    save_index_manifest(
+        manifest_path,
+        IndexManifest(
+            commit_hash=commit_hash,
+            deeplake_path=deeplake_file_path,
+            files={
+                relative_file_path: IndexedFile(
+                    blob_sha=blob_shas.get(relative_file_path),
+                    spans=file_spans.get(relative_file_path, []),
+                )
+                for relative_file_path in relative_file_list
+            },
+        ),
+    )
+    # Built with the chunk index, so searches of this commit only load it
+    get_path_index(cloned_repo.cache_dir, commit_hash)
+    return deeplake_vs, index, num_snippets
+
+
+def build_vector_store(
+    deeplake_file_path,
+    base_path,
+    stale_row_ids,
+    chunk_batches,
+    file_spans,
+    len_repo_cache_dir,
+    on_snippets=None,
+):
+    """
+    Builds the vector store of a commit, starting from a copy of the store at base_path if given.
+
+    The store is built in a directory private to this call and only renamed to
+    deeplake_file_path once every row is written, so an existing path is always a
+    complete store.
+    """
+    folder = os.path.dirname(deeplake_file_path)
+    os.makedirs(folder, exist_ok=True)
+    build_dir = tempfile.mkdtemp(
+        prefix=f"{os.path.basename(deeplake_file_path)}.", suffix=".tmp", dir=folder
+    )
+    try:
+        if base_path is not None:
+            shutil.copytree(base_path, build_dir, dirs_exist_ok=True)
+        deeplake_vs = get_vector_store(build_dir)
+        if stale_row_ids:
+            logger.info(f"Deleting {len(stale_row_ids)} stale rows")
+            deeplake_vs.delete(ids=stale_row_ids)
+        num_snippets = index_chunk_batches(
+            chunk_batches, deeplake_vs, file_spans, len_repo_cache_dir, on_snippets
+        )
+        if isinstance(deeplake_vs, FlatVectorStore):
+            deeplake_vs.build_ann_index()
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    # Publish the finished store atomically
+    try:
+        os.rename(build_dir, deeplake_file_path)
+    except OSError:
+        # Another worker published the same store first
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return get_vector_store(deeplake_file_path), num_snippets
+
+
+def get_row_id(relative_file_path: str, start: int, end: int) -> str:
+    return f"{relative_file_path}:{start}:{end}"
+
+
+def get_blob_shas(git_repo, commit_hash: str) -> dict[str, str]:
+    """The blob SHA of every file of a commit, by path relative to the repo root."""
+    output = git_repo.git.ls_tree("-r", "-z", "--full-tree", commit_hash)
+    blob_shas = {}
+    for entry in output.split("\0"):
+        if not entry:
+            continue
+        info, file_path = entry.split("\t", 1)
+        _, object_type, blob_sha = info.split(" ")
+        if object_type == "blob":
+            blob_shas[file_path] = blob_sha
+    return blob_shas
+
+
+def iter_blob_contents(cloned_repo: ClonedRepo, indexed_files: dict[str, IndexedFile]):
+    """Yields (file_path, contents) of indexed files with snippets, read with git cat-file."""
+    for relative_file_path, indexed_file in indexed_files.items():
+        if not indexed_file.spans:
+            continue
+        _, _, _, contents = cloned_repo.git_repo.git.get_object_data(
+            indexed_file.blob_sha
+        )
+        yield os.path.join(cloned_repo.cache_dir, relative_file_path), contents
 
-    return deeplake_vs, index, len(documents)
 
+def record_spans(snippets, file_spans, len_repo_cache_dir):
+    for snippet in snippets:
+        file_spans.setdefault(snippet.file_path[len_repo_cache_dir:], []).append(
+            (snippet.start, snippet.end)
+        )
 
-def compute_deeplake_vs(
-    collection_name, documents, ids, metadatas, sha, vector_db_path
-):
-    deeplake_vs = DeepLakeVectorStore(vector_db_path)
-    if len(documents) > 0:
-        logger.info(f"Computing embeddings with {VECTOR_EMBEDDING_SOURCE}...")
-        # Check cache here for all documents
-        embeddings = [None] * len(documents)
-        if redis_client:
-            cache_keys = [
-                hash_sha256(doc) + SENTENCE_TRANSFORMERS_MODEL + VECTOR_EMBEDDING_SOURCE + CACHE_VERSION
-                for doc in documents
-            ]
-            cache_values = redis_client.mget(cache_keys)
-            for idx, value in enumerate(cache_values):
-                if value is not None:
-                    arr = json.loads(value)
-                    if isinstance(arr, list):
-                        embeddings[idx] = np.array(arr, dtype=np.float32)
 
-        logger.info(
-            f"Found {len([x for x in embeddings if x is not None])} embeddings in cache"
+def index_chunk_batches(
+    chunk_batches, deeplake_vs, file_spans, len_repo_cache_dir, on_snippets=None
+) -> int:
+    """
+    Streams chunks into the vector store as they are produced and returns how many there were.
+
+    Chunking, embedding and writing run concurrently, connected by bounded queues, so
+    embedding starts with the first batch of files and only a few batches of snippets
+    and embeddings are in memory at once. Each batch of snippets is also passed to
+    on_snippets if given.
+    """
+    num_snippets = 0
+
+    def document_batches():
+        snippet_batches = iter_batches(
+            (
+                snippet
+                for chunks in buffered(chunk_batches, PIPELINE_QUEUE_SIZE)
+                for snippet in chunks
+            ),
+            PIPELINE_BATCH_SIZE,
         )
-        indices_to_compute = [idx for idx, x in enumerate(embeddings) if x is None]
-        documents_to_compute = [documents[idx] for idx in indices_to_compute]
-
-        logger.info(f"Computing {len(documents_to_compute)} embeddings...")
-        computed_embeddings = embedding_function(documents_to_compute)
-        logger.info(f"Computed {len(computed_embeddings)} embeddings")
-
-        for idx, embedding in zip(indices_to_compute, computed_embeddings):
-            embeddings[idx] = embedding
-
-        try:
-            embeddings = np.array(embeddings, dtype=np.float32)
-        except:
-            print([len(embedding) for embedding in embeddings])
-            logger.error(
-                "Failed to convert embeddings to numpy array, recomputing all of them"
-            )
-            embeddings = embedding_function(documents)
-            embeddings = np.array(embeddings, dtype=np.float32)
-
-        logger.info("Adding embeddings to deeplake vector store...")
-        deeplake_vs.add(text=ids, embedding=embeddings, metadata=metadatas)
-        logger.info("Added embeddings to deeplake vector store")
-        if redis_client and len(documents_to_compute) > 0:
-            logger.info(f"Updating cache with {len(computed_embeddings)} embeddings")
-            cache_keys = [
-                hash_sha256(doc) + SENTENCE_TRANSFORMERS_MODEL + VECTOR_EMBEDDING_SOURCE + CACHE_VERSION
-                for doc in documents_to_compute
-            ]
-            redis_client.mset(
-                {
-                    key: json.dumps(embedding.tolist() if isinstance(embedding, np.ndarray) else embedding)
-                    for key, embedding in zip(cache_keys, computed_embeddings)
-                }
-            )
-        return deeplake_vs
-    else:
+        nonlocal num_snippets
+        for snippet_batch in snippet_batches:
+            num_snippets += len(snippet_batch)
+            record_spans(snippet_batch, file_spans, len_repo_cache_dir)
+            if on_snippets is not None:
+                on_snippets(snippet_batch)
+            documents = []
+            metadatas = []
+            ids = []
+            for snippet in snippet_batch:
+                relative_file_path = snippet.file_path[len_repo_cache_dir:]
+                documents.append(snippet.content)
+                metadatas.append(
+                    {
+                        "file_path": relative_file_path,
+                        "start": snippet.start,
+                        "end": snippet.end,
+                    }
+                )
+                ids.append(get_row_id(relative_file_path, snippet.start, snippet.end))
+            yield documents, ids, metadatas
+
+    def embedded_batches():
+        for documents, ids, metadatas in document_batches():
+            yield ids, compute_embeddings(documents), metadatas
+
+    logger.info(f"Computing embeddings with {VECTOR_EMBEDDING_SOURCE}...")
+    for ids, embeddings, metadatas in buffered(embedded_batches(), PIPELINE_QUEUE_SIZE):
+        deeplake_vs.add(text=ids, id=ids, embedding=embeddings, metadata=metadatas)
+        logger.info(f"Added {len(ids)} embeddings to deeplake vector store")
+    if not num_snippets:
         logger.error("No documents found in repository")
-        return deeplake_vs
+    return num_snippets
+
+
+def get_embedding_model_name(source: str = VECTOR_EMBEDDING_SOURCE) -> str:
+    match source:
+        case "openai":
+            return OPENAI_EMBEDDING_MODEL
+        case "huggingface":
+            return HUGGINGFACE_MODEL
+        case _:
+            return SENTENCE_TRANSFORMERS_MODEL
+
+
+@lru_cache()
+def get_embedding_dim() -> int:
+    # Embedding one text is the only way to learn the dimension of remote models
+    return len(embedding_function(["dimension"])[0])
+
+
+def get_embedding_cache_model() -> str:
+    # Identifies the vectors a key holds, so changing the model or its dimension never
+    # reads embeddings of another one
+    model_name = get_embedding_model_name()
+    return f"{VECTOR_EMBEDDING_SOURCE}/{model_name}/{get_embedding_dim()}"
+
+
+def get_embedding_cache_key(document: str, cache_model: str):
+    return hash_sha256(document) + cache_model + CACHE_VERSION
+
+
+def compute_embeddings(documents):
+    # Check cache here for all documents
+    embeddings, found = None, np.zeros(len(documents), dtype=bool)
+    if redis_client:
+        cache_model = get_embedding_cache_model()
+        cache_keys = [get_embedding_cache_key(doc, cache_model) for doc in documents]
+        embeddings, found = get_cached_embeddings(
+            redis_client, cache_keys, cache_model, get_embedding_dim()
+        )
+
+    logger.info(f"Found {int(found.sum())} embeddings in cache")
+    indices_to_compute = np.flatnonzero(~found)
+    documents_to_compute = [documents[idx] for idx in indices_to_compute]
+    if not documents_to_compute:
+        return embeddings
+
+    logger.info(f"Computing {len(documents_to_compute)} embeddings...")
+    computed_embeddings = embedding_function(documents_to_compute)
+    logger.info(f"Computed {len(computed_embeddings)} embeddings")
+
+    try:
+        computed_embeddings = np.asarray(computed_embeddings, dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.empty(
+                (len(documents), computed_embeddings.shape[1]), dtype=np.float32
+            )
+        embeddings[indices_to_compute] = computed_embeddings
+    except Exception:
+        logger.error(
+            "Failed to convert embeddings to numpy array, recomputing all of them"
+        )
+        embeddings = embedding_function(documents)
+        embeddings = np.array(embeddings, dtype=np.float32)
+        computed_embeddings = embeddings[indices_to_compute]
+
+    if redis_client:
+        logger.info(f"Updating cache with {len(computed_embeddings)} embeddings")
+        set_cached_embeddings(
+            redis_client,
+            [cache_keys[idx] for idx in indices_to_compute],
+            computed_embeddings,
+            cache_model,
+            dtype=EMBEDDING_CACHE_DTYPE,
+        )
+    return embeddings
 
 
 def get_relevant_snippets(
@@ -269,99 +630,268 @@ def get_relevant_snippets(
     sweep_config: SweepConfig = SweepConfig(),
     lexical=True,
 ):
+    return get_relevant_snippets_batch(
+        cloned_repo,
+        [query],
+        n_results,
+        username=username,
+        sweep_config=sweep_config,
+        lexical=lexical,
+    )[0]
+
+
+def get_relevant_snippets_batch(
+    cloned_repo: ClonedRepo,
+    queries: list[str],
+    n_results: int,
+    username: str | None = None,
+    sweep_config: SweepConfig = SweepConfig(),
+    lexical=True,
+    index: tuple | None = None,
+    query_embeddings=None,
+) -> list[list[Snippet]]:
+    """
+    Ranked snippets for each query, searching the repo's index once for all of them.
+
+    The queries are embedded together and, on flat stores without an ANN index, scored
+    against every row with one matrix product. Callers that already hold the result of
+    get_deeplake_vs_from_repo or the query embeddings can pass them in.
+    """
     repo_name = cloned_repo.repo_full_name
     installation_id = cloned_repo.installation_id
-    logger.info("Getting query embedding...")
-    query_embedding = embedding_function([query])  # pylint: disable=no-member
-    logger.info("Starting search by getting vector store...")
-    deeplake_vs, lexical_index, num_docs = get_deeplake_vs_from_repo(
-        cloned_repo, sweep_config=sweep_config
+    if query_embeddings is None:
+        logger.info(f"Getting embeddings for {len(queries)} queries...")
+        query_embeddings = embedding_function(queries)  # pylint: disable=no-member
+    if index is None:
+        logger.info("Starting search by getting vector store...")
+        index = get_deeplake_vs_from_repo(cloned_repo, sweep_config=sweep_config)
+    deeplake_vs, lexical_index, num_docs = index
+    cache_key = get_cache_key(cloned_repo, sweep_config)
+    files_to_scores = load_code_scores(cache_key)
+    lexical_results = [search_index(query, lexical_index) for query in queries]
+    logger.info(
+        f"Found {[len(result) for result in lexical_results]} lexical results"
     )
-    content_to_lexical_score = search_index(query, lexical_index)
-    logger.info(f"Found {len(content_to_lexical_score)} lexical results")
     logger.info(f"Searching for relevant snippets... with {num_docs} docs")
-    results = {"metadata": [], "text": []}
+    k = min(num_docs, MAX_RELEVANT_SNIPPETS)
+    sorted_metadatas_per_query = [[] for _ in queries]
     try:
-        results = deeplake_vs.search(embedding=query_embedding, k=num_docs)
+        if isinstance(deeplake_vs, FlatVectorStore):
+            sorted_metadatas_per_query = search_flat_vector_store_batch(
+                deeplake_vs,
+                query_embeddings,
+                lexical_results,
+                files_to_scores,
+                k,
+                scores_key=cache_key,
+            )
+        else:
+            sorted_metadatas_per_query = [
+                search_deeplake_vs(
+                    deeplake_vs,
+                    query_embedding,
+                    content_to_lexical_score,
+                    files_to_scores,
+                    num_docs,
+                    k,
+                )
+                for query_embedding, content_to_lexical_score in zip(
+                    query_embeddings, lexical_results
+                )
+            ]
     except Exception as e:
         logger.error(e)
     logger.info("Fetched relevant snippets...")
-    if len(results["text"]) == 0:
-        logger.info(f"Results query {query} was empty")
-        logger.info(f"Results: {results}")
-        if username is None:
-            username = "anonymous"
-        posthog.capture(
-            username,
-            "failed",
-            {
-                "reason": "Results query was empty",
-                "repo_name": repo_name,
-                "installation_id": installation_id,
-                "query": query,
-                "n_results": n_results,
-            },
+    snippets_per_query = []
+    for query, sorted_metadatas in zip(queries, sorted_metadatas_per_query):
+        if len(sorted_metadatas) == 0:
+            logger.info(f"Results query {query} was empty")
+            posthog.capture(
+                username or "anonymous",
+                "failed",
+                {
+                    "reason": "Results query was empty",
+                    "repo_name": repo_name,
+                    "installation_id": installation_id,
+                    "query": query,
+                    "n_results": n_results,
+                },
+            )
+            snippets_per_query.append([])
+            continue
+        relevant_paths = [metadata["file_path"] for metadata in sorted_metadatas]
+        logger.info("Relevant paths: {}".format(relevant_paths[:5]))
+        snippets_per_query.append(
+            [
+                Snippet(
+                    content="",
+                    start=metadata["start"],
+                    end=metadata["end"],
+                    file_path=file_path,
+                )
+                for metadata, file_path in zip(sorted_metadatas, relevant_paths)
+            ]
         )
+    return snippets_per_query
+
+
+def search_flat_vector_store(
+    deeplake_vs: FlatVectorStore,
+    query_embedding,
+    content_to_lexical_score,
+    files_to_scores,
+    k,
+    scores_key: str | None = None,
+) -> list[dict]:
+    """
+    Metadata of the k rows with the highest fused scores.
+
+    With an ANN index only the rows in the probed clusters and the lexical matches are
+    scored, unless those are fewer than k, otherwise every row is. scores_key is the
+    cache key files_to_scores were loaded for, the row scores are cached under it.
+    """
+    rows = deeplake_vs.rows
+    if rows is None or not rows.ids:
         return []
-    metadatas = results["metadata"]
-    code_scores = [metadata["score"] for metadata in metadatas]
-    lexical_scores = []
-    for metadata in metadatas:
-        key = f"{metadata['file_path']}:{str(metadata['start'])}:{str(metadata['end'])}"
-        if key in content_to_lexical_score:
-            lexical_scores.append(content_to_lexical_score[key])
-        else:
-            lexical_scores.append(0.3)
-    vector_scores = results["score"]
-    combined_scores = [
-        code_score + vector_score + lexical_score
-        for code_score, vector_score, lexical_score in zip(
-            code_scores, vector_scores, lexical_scores
+    code_scores = rows.get_code_scores(files_to_scores, scores_key)
+    lexical_scores = lexical_scores_to_array(
+        content_to_lexical_score, rows.id_to_index, len(rows.ids)
+    )
+    row_indices = deeplake_vs.get_candidates(query_embedding)
+    if row_indices is not None:
+        lexical_matches = np.fromiter(
+            (
+                rows.id_to_index[key]
+                for key in content_to_lexical_score
+                if key in rows.id_to_index
+            ),
+            dtype=row_indices.dtype,
         )
-    ]
-    combined_list = list(zip(combined_scores, metadatas))
-    sorted_list = sorted(combined_list, key=lambda x: x[0], reverse=True)
-    sorted_metadatas = [metadata for _, metadata in sorted_list]
-    relevant_paths = [metadata["file_path"] for metadata in sorted_metadatas]
-    logger.info("Relevant paths: {}".format(relevant_paths[:5]))
-    return [
-        Snippet(
-            content="",
-            start=metadata["start"],
-            end=metadata["end"],
-            file_path=file_path,
+        row_indices = np.union1d(row_indices, lexical_matches)
+    # Like FlatVectorStore.search, too few candidates fall back to scoring every row
+    if row_indices is not None and len(row_indices) < k:
+        row_indices = None
+    if row_indices is not None:
+        code_scores = code_scores[row_indices]
+        lexical_scores = lexical_scores[row_indices]
+    vector_scores = deeplake_vs.score(query_embedding, row_indices)
+    top_indices = fuse_scores(code_scores, vector_scores, lexical_scores, k)
+    if row_indices is not None:
+        top_indices = row_indices[top_indices]
+    return [rows.metadatas[idx] for idx in top_indices]
+
+
+def search_flat_vector_store_batch(
+    deeplake_vs: FlatVectorStore,
+    query_embeddings,
+    lexical_results,
+    files_to_scores,
+    k,
+    scores_key: str | None = None,
+) -> list[list[dict]]:
+    rows = deeplake_vs.rows
+    if rows is None or not rows.ids:
+        return [[] for _ in lexical_results]
+    if deeplake_vs.ann_index is not None:
+        # Each query only scores the clusters it probes
+        return [
+            search_flat_vector_store(
+                deeplake_vs,
+                query_embedding,
+                content_to_lexical_score,
+                files_to_scores,
+                k,
+                scores_key,
+            )
+            for query_embedding, content_to_lexical_score in zip(
+                query_embeddings, lexical_results
+            )
+        ]
+    code_scores = rows.get_code_scores(files_to_scores, scores_key)
+    vector_scores = deeplake_vs.score_batch(query_embeddings)
+    sorted_metadatas_per_query = []
+    for query_vector_scores, content_to_lexical_score in zip(vector_scores, lexical_results):
+        lexical_scores = lexical_scores_to_array(
+            content_to_lexical_score, rows.id_to_index, len(rows.ids)
         )
-        for metadata, file_path in zip(sorted_metadatas, relevant_paths)
-    ][: min(num_docs, 25)]
+        top_indices = fuse_scores(code_scores, query_vector_scores, lexical_scores, k)
+        sorted_metadatas_per_query.append([rows.metadatas[idx] for idx in top_indices])
+    return sorted_metadatas_per_query
 
 
-def chunk(texts: List[str], batch_size: int) -> Generator[List[str], None, None]:
-    """
-    Split a list of texts into batches of a given size for embed_texts.
-
-    Args:
-    ----
-        texts (List[str]): A list of texts to be chunked into batches.
-        batch_size (int): The maximum number of texts in each batch.
-
-    Yields:
-    ------
-        Generator[List[str], None, None]: A generator that yields batches of texts as lists.
-
-    Example:
-    -------
-        texts = ["text1", "text2", "text3", "text4", "text5"]
-        batch_size = 2
-        for batch in chunk(texts, batch_size):
-            print(batch)
-        # Output:
-        # ['text1', 'text2']
-        # ['text3', 'text4']
-        # ['text5']
-    """
-    texts = [text[:4096] if text else ' ' for text in texts]
+def search_deeplake_vs(
+    deeplake_vs, query_embedding, content_to_lexical_score, files_to_scores, num_docs, k
+) -> list[dict]:
+    results = deeplake_vs.search(embedding=query_embedding, k=num_docs)
+    metadatas = results["metadata"]
+    # Rows written before scores were kept per commit also have their score in the metadata
+    code_scores = np.fromiter(
+        (
+            files_to_scores.get(metadata["file_path"], metadata.get("score", 0.0))
+            for metadata in metadatas
+        ),
+        dtype=np.float32,
+        count=len(metadatas),
+    )
+    # Stores built before rows were keyed by file_path:start:end only have the key in their metadata
+    key_to_index = {
+        f"{metadata['file_path']}:{metadata['start']}:{metadata['end']}": idx
+        for idx, metadata in enumerate(metadatas)
+    }
+    lexical_scores = lexical_scores_to_array(
+        content_to_lexical_score, key_to_index, len(metadatas)
+    )
+    top_indices = fuse_scores(code_scores, results["score"], lexical_scores, k)
+    return [metadatas[idx] for idx in top_indices]
+
+
+@lru_cache()
+def get_embedding_encoding():
+    import tiktoken
+
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache()
+def get_huggingface_tokenizer():
+    from transformers import AutoTokenizer  # pylint: disable=import-error
+
+    return AutoTokenizer.from_pretrained(HUGGINGFACE_MODEL, cache_dir=MODEL_DIR)
+
+
+def truncate_texts_with_encoding(
+    texts: List[str], max_tokens: int = OPENAI_EMBEDDING_MAX_TOKENS, encoding=None
+) -> List[str]:
+    truncated_texts = []
+    for text in texts:
+        # A byte-level BPE token covers at least one byte, so short texts fit as is
+        if len(text.encode()) > max_tokens:
+            encoding = encoding or get_embedding_encoding()
+            tokens = encoding.encode(text, disallowed_special=())
+            if len(tokens) > max_tokens:
+                text = encoding.decode(tokens[:max_tokens])
+        truncated_texts.append(text)
+    return truncated_texts
+
+
+def truncate_texts(
+    texts: List[str], source: str = VECTOR_EMBEDDING_SOURCE
+) -> List[str]:
+    """Truncates texts to the input limit of the source's model, with its own tokenizer."""
     for text in texts:
         assert isinstance(text, str), f"Expected str, got {type(text)}"
-        assert len(text) <= 4096, f"Expected text length <= 4096, got {len(text)}"
-    for i in range(0, len(texts), batch_size):
-        yield texts[i : i + batch_size] if i + batch_size < len(texts) else texts[i:]
+    texts = [text or " " for text in texts]
+    match source:
+        case "openai":
+            return truncate_texts_with_encoding(texts)
+        case "huggingface":
+            return truncate_texts_with_tokenizer(
+                texts, get_huggingface_tokenizer(), HUGGINGFACE_MAX_TOKENS
+            )
+        case "sentence-transformers":
+            return model_registry.truncate_texts(texts)
+        case "onnx":
+            return model_registry.truncate_texts(texts, backend="onnx")
+        case _:
+            # The embedding server truncates with the model it runs
+            return texts
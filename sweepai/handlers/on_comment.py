@@ -258,6 +258,7 @@ def on_comment(
             # human_message=human_message, model="claude-v1.3-100k", repo=repo
             human_message=human_message,
             repo=repo,
+            cloned_repo=cloned_repo,
             chat_logger=chat_logger,
             model="gpt-3.5-turbo-16k-0613" if use_faster_model else "gpt-4-32k-0613",
             sweep_context=sweep_context,
@@ -14,6 +14,7 @@ from loguru import logger
 from tabulate import tabulate
 from tqdm import tqdm
 from sweepai.core.context_pruning import ContextPruning
+from sweepai.core.retrieval_session import RetrievalSession
 from sweepai.core.documentation_searcher import extract_relevant_docs
 
 from sweepai.core.entities import (
@@ -579,12 +580,15 @@ def on_ticket(
         pass
 
     logger.info("Fetching relevant files...")
+    # Shared by the searches below, so the later ones reuse the index and fetched files
+    retrieval_session = RetrievalSession(cloned_repo)
     try:
         snippets, tree = search_snippets(
             # repo,
             cloned_repo,
             f"{title}\n{summary}\n{replies_text}",
             num_files=num_of_snippets_to_query,
+            session=retrieval_session,
         )
         assert len(snippets) > 0
     except Exception as e:
@@ -645,6 +649,7 @@ def on_ticket(
         f"{title}\n{summary}\n{replies_text}",
         num_files=num_of_snippets_to_query,
         multi_query=queries,
+        session=retrieval_session,
     )
     snippets = post_process_snippets(snippets, max_num_of_snippets=5)
 
@@ -673,6 +678,7 @@ def on_ticket(
                 # branch=None,
                 # installation_id=installation_id,
                 excluded_directories=directories_to_ignore,  # handles the tree
+                session=retrieval_session,
             )
             snippets = post_process_snippets(
                 snippets, max_num_of_snippets=5, exclude_snippets=snippets_to_ignore
@@ -697,6 +703,7 @@ def on_ticket(
     sweep_bot = SweepBot.from_system_message_content(
         human_message=human_message,
         repo=repo,
+        cloned_repo=cloned_repo,
         is_reply=bool(comments),
         chat_logger=chat_logger,
         sweep_context=sweep_context,
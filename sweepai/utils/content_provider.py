@@ -0,0 +1,114 @@
+import re
+import threading
+from collections import OrderedDict
+
+import git
+from github.GithubException import GithubException, UnknownObjectException
+from github.Repository import Repository
+from loguru import logger
+
+MAX_CACHED_CONTENT_BYTES = 128 * 1024 * 1024
+SHA_PATTERN = re.compile(r"[0-9a-fA-F]{40}")
+
+
+class ContentCache:
+    """LRU of file contents keyed by (commit, path), bounded by the total size of the contents."""
+
+    def __init__(self, max_bytes: int = MAX_CACHED_CONTENT_BYTES):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple[str, str]) -> str | None:
+        with self.lock:
+            contents = self.entries.get(key)
+            if contents is not None:
+                self.entries.move_to_end(key)
+            return contents
+
+    def set(self, key: tuple[str, str], contents: str):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = contents
+            self.num_bytes += len(contents)
+            while self.num_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.num_bytes -= len(evicted)
+
+
+content_cache = ContentCache()
+
+
+class LocalContentProvider:
+    """
+    Reads files at a ref from a local clone through git's object database.
+
+    Objects are read with one persistent `git cat-file --batch` process, so reads don't
+    depend on what is checked out. The clone is never fetched again, so only commit SHAs
+    are trusted locally and branches are resolved to their current head through the
+    GitHub repo. Returns None when the commit is not in the clone, so the caller can fall
+    back to the GitHub API.
+    """
+
+    def __init__(
+        self,
+        git_repo: git.Repo,
+        repo: Repository | None = None,
+        cache: ContentCache = content_cache,
+    ):
+        self.git_repo = git_repo
+        self.repo = repo
+        self.cache = cache
+        self.commits = {}
+        self.lock = threading.Lock()
+
+    def has_commit(self, commit: str) -> bool:
+        # Commits are immutable, so whether the clone has one is cached
+        with self.lock:
+            if commit not in self.commits:
+                try:
+                    self.git_repo.git.rev_parse(
+                        "--verify", "--quiet", f"{commit}^{{commit}}"
+                    )
+                    self.commits[commit] = True
+                except git.GitCommandError:
+                    self.commits[commit] = False
+            return self.commits[commit]
+
+    def resolve_commit(self, ref: str) -> str | None:
+        if SHA_PATTERN.fullmatch(ref):
+            commit = ref.lower()
+        elif self.repo is not None:
+            try:
+                commit = self.repo.get_branch(ref).commit.sha
+            except GithubException:
+                # Tags and other refs are read through the API
+                return None
+        else:
+            return None
+        return commit if self.has_commit(commit) else None
+
+    def get_file_contents(self, file_path: str, ref: str) -> str | None:
+        commit = self.resolve_commit(ref)
+        if commit is None:
+            logger.info(f"{ref} is not in the local clone")
+            return None
+        key = (commit, file_path)
+        contents = self.cache.get(key)
+        if contents is not None:
+            return contents
+        with self.lock:
+            try:
+                _, object_type, _, data = self.git_repo.git.get_object_data(
+                    f"{commit}:{file_path}"
+                )
+            except ValueError:
+                object_type, data = None, None
+        if object_type != b"blob":
+            # Same error as the contents API for a missing file
+            raise UnknownObjectException(404, {"message": "Not Found"}, None)
+        contents = data.decode("utf-8", errors="replace")
+        self.cache.set(key, contents)
+        return contents
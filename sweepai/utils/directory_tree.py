@@ -0,0 +1,87 @@
+from functools import lru_cache
+
+from sweepai.core.path_index import get_path_index
+
+MAX_FILE_COUNT = 50  # Entries listed per directory
+MAX_RENDERED_TREES = 64
+
+
+class DirectoryTree:
+    """
+    The directories and files of a commit, rendered as the pruned tree shown to the model.
+
+    Directories in included_directories are expanded, other directories are collapsed to
+    "name/..." and entries whose name is excluded are skipped. Renders are memoized per
+    set of included and excluded directories.
+    """
+
+    def __init__(self, root: dict):
+        self.root = root
+        self.rendered = {}
+
+    @classmethod
+    def from_paths(cls, paths: list[str]) -> "DirectoryTree":
+        # Directories are dicts of their entries, files are None
+        root = {}
+        for path in paths:
+            node = root
+            *directories, file_name = path.split("/")
+            for directory in directories:
+                child = node.get(directory)
+                if child is None:
+                    child = node[directory] = {}
+                node = child
+            node.setdefault(file_name, None)
+        return cls(root)
+
+    def render(
+        self,
+        included_directories: list[str] = None,
+        excluded_directories: list[str] = None,
+    ) -> str:
+        key = (
+            frozenset(included_directories or []),
+            frozenset(excluded_directories or []) | {".git"},
+        )
+        if key not in self.rendered:
+            if len(self.rendered) >= MAX_RENDERED_TREES:
+                self.rendered.pop(next(iter(self.rendered)))
+            lines = []
+            self.render_directory(self.root, "", "", *key, lines)
+            self.rendered[key] = "".join(lines)
+        return self.rendered[key]
+
+    def render_directory(
+        self,
+        node: dict,
+        prefix: str,
+        indentation: str,
+        included_directories: frozenset[str],
+        excluded_directories: frozenset[str],
+        lines: list[str],
+    ):
+        for name in sorted(node)[:MAX_FILE_COUNT]:
+            if name in excluded_directories:
+                continue
+            child = node[name]
+            if child is None:
+                lines.append(f"{indentation}{name}\n")
+                continue
+            relative_path = prefix + name
+            if relative_path in included_directories:
+                lines.append(f"{indentation}{relative_path}/\n")
+                self.render_directory(
+                    child,
+                    relative_path + "/",
+                    indentation + "  ",
+                    included_directories,
+                    excluded_directories,
+                    lines,
+                )
+            else:
+                lines.append(f"{indentation}{name}/...\n")
+
+
+@lru_cache(maxsize=16)
+def get_directory_tree(git_repo_dir: str, commit_hash: str) -> DirectoryTree:
+    return DirectoryTree.from_paths(get_path_index(git_repo_dir, commit_hash).paths)
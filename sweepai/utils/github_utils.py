@@ -24,12 +24,12 @@ from sweepai.config.server import (
     GITHUB_APP_PEM,
     REDIS_URL,
 )
+from sweepai.utils.content_provider import LocalContentProvider
 from sweepai.utils.ctags import CTags
+from sweepai.utils.directory_tree import DirectoryTree, get_directory_tree
 from sweepai.utils.ctags_chunker import get_ctags_for_file, get_ctags_for_search
 from rapidfuzz import fuzz
 
-MAX_FILE_COUNT = 50
-
 
 def make_valid_string(string: str):
     pattern = r"[^\w./-]+"
@@ -90,6 +90,18 @@ def get_installation_id(username: str):
         raise Exception("Could not get installation id, probably not installed")
 
 
+def get_directory_prefixes(snippet_paths: list[str]) -> list[str]:
+    """The snippet paths and every directory above them, which the tree expands."""
+    prefixes = []
+    for snippet_path in snippet_paths:
+        file_list = ""
+        for directory in snippet_path.split("/")[:-1]:
+            file_list += directory + "/"
+            prefixes.append(file_list.rstrip("/"))
+        prefixes.append(snippet_path)
+    return prefixes
+
+
 @dataclass
 class ClonedRepo:
     repo_full_name: str
@@ -130,71 +142,48 @@ class ClonedRepo:
     def delete(self):
         shutil.rmtree(self.cache_dir)
 
+    def get_changed_files(
+        self, old_commit: str, new_commit: str | None = None
+    ) -> tuple[list[str], list[str]]:
+        """Returns (added or modified paths, deleted paths) between two commits.
+
+        Renames are reported as a deletion plus an addition.
+        """
+        new_commit = new_commit or self.git_repo.head.object.hexsha
+        output = self.git_repo.git.diff(
+            "--name-status", "--no-renames", "-z", f"{old_commit}..{new_commit}"
+        )
+        changed_files = []
+        deleted_files = []
+        fields = [field for field in output.split("\0") if field]
+        for status, file_path in zip(fields[::2], fields[1::2]):
+            if status.startswith("D"):
+                deleted_files.append(file_path)
+            else:
+                changed_files.append(file_path)
+        return changed_files, deleted_files
+
+    @property
+    def directory_tree(self) -> DirectoryTree:
+        return get_directory_tree(self.cache_dir, self.git_repo.head.object.hexsha)
+
     def list_directory_tree(
         self,
         included_directories=None,
         excluded_directories: list[str] = None,
-        included_files=None,
-        ctags: CTags = None,
     ):
         """Display the directory tree.
 
         Arguments:
-        root_directory -- String path of the root directory to display.
         included_directories -- List of directory paths (relative to the root) to include in the tree. Default to None.
         excluded_directories -- List of directory names to exclude from the tree. Default to None.
-        """
-
-        root_directory = self.cache_dir
 
-        # Default values if parameters are not provided
-        if included_directories is None:
-            included_directories = []
-        if excluded_directories is None:
-            excluded_directories = [".git"]
-        else:
-            excluded_directories.append(".git")
-
-        def list_directory_contents(
-            current_directory,
-            indentation="",
-            ctags: CTags = None,
-        ):
-            """Recursively list the contents of directories."""
-
-            file_and_folder_names = os.listdir(current_directory)
-            file_and_folder_names.sort()
-
-            directory_tree_string = ""
-
-            for name in file_and_folder_names[:MAX_FILE_COUNT]:
-                relative_path = os.path.join(current_directory, name)[
-                    len(root_directory) + 1 :
-                ]
-                if name in excluded_directories:
-                    continue
-                complete_path = os.path.join(current_directory, name)
-
-                if os.path.isdir(complete_path):
-                    if relative_path in included_directories:
-                        directory_tree_string += f"{indentation}{relative_path}/\n"
-                        directory_tree_string += list_directory_contents(
-                            complete_path, indentation + "  ", ctags=ctags
-                        )
-                    else:
-                        directory_tree_string += f"{indentation}{name}/...\n"
-                else:
-                    directory_tree_string += f"{indentation}{name}\n"
-                    # if os.path.isfile(complete_path) and relative_path in included_files:
-                    #     # Todo, use these to fetch neighbors
-                    #     ctags_str, names = get_ctags_for_file(ctags, complete_path)
-                    #     ctags_str = "\n".join([indentation + line for line in ctags_str.splitlines()])
-                    #     if ctags_str.strip():
-                    #         directory_tree_string += f"{ctags_str}\n"
-            return directory_tree_string
-
-        directory_tree = list_directory_contents(root_directory, ctags=ctags)
-        return directory_tree
+        Rendered from the in-memory tree of the checked out commit, .git is always excluded.
+        """
+        return self.directory_tree.render(
+            included_directories=included_directories,
+            excluded_directories=excluded_directories,
+        )
 
     def get_file_list(self) -> str:
         root_directory = self.cache_dir
@@ -220,42 +209,21 @@ class ClonedRepo:
         snippet_paths: list[str],
         excluded_directories: list[str] = None,
     ) -> str:
-        prefixes = []
-        for snippet_path in snippet_paths:
-            file_list = ""
-            for directory in snippet_path.split("/")[:-1]:
-                file_list += directory + "/"
-                prefixes.append(file_list.rstrip("/"))
-            file_list += snippet_path.split("/")[-1]
-            prefixes.append(snippet_path)
-
-        sha = self.repo.get_branch(self.repo.default_branch).commit.sha
-        retry = Retry(ExponentialBackoff(), 3)
-        cache_inst = (
-            Redis.from_url(
-                REDIS_URL,
-                retry=retry,
-                retry_on_error=[BusyLoadingError, ConnectionError, TimeoutError],
-            )
-            if REDIS_URL
-            else None
-        )
-        ctags = CTags(sha=sha, redis_instance=cache_inst)
-        all_names = []
-        for file in snippet_paths:
-            _, names = get_ctags_for_file(ctags, os.path.join("repo", file))
-            all_names.extend(names)
-        tree = self.list_directory_tree(
-            included_directories=prefixes,
-            included_files=snippet_paths,
+        return self.list_directory_tree(
+            included_directories=get_directory_prefixes(snippet_paths),
             excluded_directories=excluded_directories,
-            ctags=ctags,
         )
-        return tree
+
+    @cached_property
+    def content_provider(self) -> LocalContentProvider:
+        return LocalContentProvider(self.git_repo, self.repo)
 
     def get_file_contents(self, file_path, ref=None):
         if ref is None:
             ref = self.repo.default_branch
+        contents = self.content_provider.get_file_contents(file_path, ref)
+        if contents is not None:
+            return contents
         file = self.repo.get_contents(file_path, ref=ref)
         contents = file.decoded_content.decode("utf-8", errors="replace")
         return contents
@@ -0,0 +1,55 @@
+from bisect import bisect_right
+from functools import cached_property, lru_cache
+from itertools import accumulate
+
+
+class LineIndex:
+    """
+    Line lookups for a source file that is split only once.
+
+    Byte offsets (as produced by tree-sitter) map to line numbers with a bisect over
+    the cumulative line lengths, and line ranges map to text by slicing the split lines.
+    """
+
+    def __init__(self, source_code: str | bytes):
+        if isinstance(source_code, bytes):
+            self.source_bytes = source_code
+        else:
+            self.source_code = source_code
+
+    @cached_property
+    def source_code(self) -> str:
+        return self.source_bytes.decode("utf-8")
+
+    @cached_property
+    def source_bytes(self) -> bytes:
+        return self.source_code.encode("utf-8")
+
+    @cached_property
+    def lines(self) -> list[str]:
+        return self.source_code.splitlines()
+
+    @cached_property
+    def line_ends(self) -> list[int]:
+        # Byte offset just past the end of each line
+        return list(
+            accumulate(len(line) for line in self.source_bytes.splitlines(keepends=True))
+        )
+
+    @cached_property
+    def num_lines(self) -> int:
+        # Matches content.count("\n") + 1
+        return self.source_code.count("\n") + 1
+
+    def get_line_number(self, index: int) -> int:
+        # 0-indexed line containing the byte at index, or the line count if past the end
+        return bisect_right(self.line_ends, index)
+
+    def extract_lines(self, start: int, end: int) -> str:
+        return "\n".join(self.lines[start:end])
+
+
+@lru_cache(maxsize=128)
+def get_line_index(source_code: str) -> LineIndex:
+    # Snippets of the same file share one content string, so they share one index
+    return LineIndex(source_code)
@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+
+from loguru import logger
+
+PARSE_TIMEOUT_MICROS = 5_000_000  # 5 seconds
+MAX_PARSE_BYTES = 2_000_000
+MAX_CACHED_TREES = 32
+
+
+class ParserLimitExceeded(Exception):
+    """Raised when a file is too large or too slow to parse, callers fall back to naive chunking."""
+
+
+def get_point(source: bytes, index: int) -> tuple[int, int]:
+    # tree-sitter points are (row, column in bytes)
+    row = source.count(b"\n", 0, index)
+    column = index - (source.rfind(b"\n", 0, index) + 1)
+    return row, column
+
+
+def common_prefix_length(a: bytes, b: bytes) -> int:
+    # Binary search over slice comparisons, which run in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def get_edit(old_source: bytes, new_source: bytes) -> dict:
+    """Describes the change from old_source to new_source as a single tree-sitter edit."""
+    start_byte = common_prefix_length(old_source, new_source)
+    suffix = common_prefix_length(
+        old_source[start_byte:][::-1], new_source[start_byte:][::-1]
+    )
+    old_end_byte = len(old_source) - suffix
+    new_end_byte = len(new_source) - suffix
+    return {
+        "start_byte": start_byte,
+        "old_end_byte": old_end_byte,
+        "new_end_byte": new_end_byte,
+        "start_point": get_point(old_source, start_byte),
+        "old_end_point": get_point(old_source, old_end_byte),
+        "new_end_point": get_point(new_source, new_end_byte),
+    }
+
+
+class ParserRegistry:
+    """
+    Per-process tree-sitter parsers.
+
+    Grammars are loaded the first time a language is used and parsers are reused across
+    files. Trees of files that may be edited later are kept by (repo, branch, path), so
+    re-parsing the file after an edit only re-parses the edited region. Keys include the
+    repo and branch because one process serves many tickets at once.
+    """
+
+    def __init__(self, max_cached_trees: int = MAX_CACHED_TREES):
+        self.languages = {}
+        self.local = threading.local()
+        self.lock = threading.RLock()
+        self.max_cached_trees = max_cached_trees
+        # (repo, branch, path) -> (language, source, tree)
+        self.trees = OrderedDict()
+
+    def get_language(self, language: str):
+        if language not in self.languages:
+            from tree_sitter_languages import get_language
+
+            with self.lock:
+                if language not in self.languages:
+                    self.languages[language] = get_language(language)
+        return self.languages[language]
+
+    def get_parser(self, language: str):
+        # Parsers are not thread-safe, so each thread gets its own
+        parsers = self.local.__dict__.setdefault("parsers", {})
+        if language not in parsers:
+            from tree_sitter import Parser
+
+            parser = Parser()
+            parser.set_language(self.get_language(language))
+            parser.set_timeout_micros(PARSE_TIMEOUT_MICROS)
+            parsers[language] = parser
+        return parsers[language]
+
+    def parse(self, language: str, source: bytes, old_tree=None):
+        if len(source) > MAX_PARSE_BYTES:
+            raise ParserLimitExceeded(f"{len(source)} bytes is too large to parse")
+        parser = self.get_parser(language)
+        try:
+            return parser.parse(source, old_tree) if old_tree else parser.parse(source)
+        except ValueError as e:
+            # Parsing only fails on timeout, and the parser must be reset before it is reused
+            parser.reset()
+            raise ParserLimitExceeded(f"Parsing timed out: {e}")
+
+
+    def parse_file(self, tree_key: tuple[str, str, str], language: str, source: bytes):
+        """Parses source, reusing and updating the cached tree for tree_key if there is one."""
+        with self.lock:
+            cached = self.trees.pop(tree_key, None)
+            if cached is not None and cached[0] == language:
+                _, old_source, old_tree = cached
+                if old_source == source:
+                    tree = old_tree
+                else:
+                    # The old tree is edited in place, so it stays out of the cache until
+                    # the new source is parsed
+                    old_tree.edit(**get_edit(old_source, source))
+                    tree = self.parse(language, source, old_tree=old_tree)
+            else:
+                tree = self.parse(language, source)
+            self.trees[tree_key] = (language, source, tree)
+            while len(self.trees) > self.max_cached_trees:
+                self.trees.popitem(last=False)
+            return tree
+
+    def update_file(
+        self,
+        tree_key: tuple[str, str, str],
+        language: str,
+        old_source: bytes,
+        new_source: bytes,
+    ):
+        """
+        Brings the cached tree of an edited file to new_source with one incremental re-parse.
+
+        The tree of old_source is parsed first if it isn't cached yet, so later chunking of
+        the new contents with the same tree_key reuses the tree without parsing.
+        """
+        with self.lock:
+            try:
+                self.parse_file(tree_key, language, old_source)
+                return self.parse_file(tree_key, language, new_source)
+            except ParserLimitExceeded as e:
+                logger.warning(f"Could not re-parse {tree_key[2]}: {e}")
+                self.trees.pop(tree_key, None)
+                return None
+
+parser_registry = ParserRegistry()
@@ -0,0 +1,58 @@
+import queue
+import threading
+from typing import Generator, Iterable, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def buffered(items: Iterable[T], maxsize: int) -> Generator[T, None, None]:
+    """
+    Runs an iterable in a background thread, handing items over through a bounded queue.
+
+    The producer runs ahead of the consumer by at most maxsize items, so chaining stages
+    with this runs them concurrently with backpressure. Exceptions raised by the producer
+    are re-raised in the consumer.
+    """
+    item_queue = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                item_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_StageError(e))
+            return
+        put(_DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = item_queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _StageError):
+                raise item.exception
+            yield item
+    finally:
+        # Unblocks the producer if the consumer stopped early
+        stopped.set()
+        thread.join()
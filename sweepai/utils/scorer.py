@@ -1,8 +1,17 @@
-from datetime import datetime
+import os
+import pickle
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from itertools import cycle
 
+from loguru import logger
+
 from sweepai.core.entities import Snippet
 
+GIT_STATS_DIR = "cache/git_stats/"
+MAX_GIT_STATS_PER_REPO = 5
+
 
 def compute_score(relative_file_path, git_repo):
     commits = list(git_repo.iter_commits(paths=relative_file_path))
@@ -11,8 +20,14 @@ def compute_score(relative_file_path, git_repo):
 
 
 def get_factors(commits):
-    commit_count = len(commits) + 1
-    earliest_commit = commits[0].committed_datetime if commits else datetime.now()
+    return get_factors_from_history(
+        len(commits), commits[0].committed_datetime if commits else None
+    )
+
+
+def get_factors_from_history(num_commits: int, last_commit_time: datetime | None):
+    commit_count = num_commits + 1
+    earliest_commit = last_commit_time or datetime.now()
     current_time = datetime.now()
     tz_info = earliest_commit.astimezone().tzinfo
     if tz_info:
@@ -28,6 +43,119 @@ def get_factors(commits):
     return (1, commit_count, days_since_last_modified)
 
 
+@dataclass
+class GitHistoryStats:
+    """Number of commits and last commit time (unix seconds) of every path, as of commit_hash."""
+
+    commit_hash: str
+    commit_counts: Counter = field(default_factory=Counter)
+    last_modified: dict[str, int] = field(default_factory=dict)
+
+    def update(self, git_repo, since_commit: str | None = None):
+        # Walks history once, newest first, listing the files each commit touched
+        revision = f"{since_commit}..{self.commit_hash}" if since_commit else self.commit_hash
+        output = git_repo.git.log(
+            revision, "--name-only", "--no-renames", "-z", "--format=%x1e%ct"
+        )
+        for record in output.split("\x1e"):
+            header, _, names = record.partition("\0")
+            if not header:
+                continue
+            committed_time = int(header)
+            for name in names.split("\0"):
+                name = name.strip("\n")
+                if not name:
+                    continue
+                self.commit_counts[name] += 1
+                if committed_time > self.last_modified.get(name, -1):
+                    self.last_modified[name] = committed_time
+
+    def get_factors(self, relative_file_path):
+        last_modified = self.last_modified.get(relative_file_path)
+        return get_factors_from_history(
+            self.commit_counts.get(relative_file_path, 0),
+            datetime.fromtimestamp(last_modified, tz=timezone.utc)
+            if last_modified is not None
+            else None,
+        )
+
+
+def get_git_history_stats(git_repo, repo_name: str) -> GitHistoryStats:
+    """
+    Returns the history stats of HEAD, built in a single pass over git log.
+
+    Stats are persisted per commit, and when stats of an ancestor of HEAD exist only the
+    commits since that ancestor are walked.
+    """
+    commit_hash = git_repo.head.object.hexsha
+    stats_dir = os.path.join(GIT_STATS_DIR, repo_name)
+    stats_path = os.path.join(stats_dir, f"{commit_hash}.pkl")
+    stats = load_git_history_stats(stats_path)
+    if stats is not None:
+        return stats
+
+    stats = GitHistoryStats(commit_hash=commit_hash)
+    since_commit = None
+    base_stats = None
+    for previous_stats_path in get_git_history_stats_paths(stats_dir):
+        previous_commit_hash = os.path.basename(previous_stats_path)[: -len(".pkl")]
+        try:
+            if git_repo.is_ancestor(previous_commit_hash, commit_hash):
+                base_stats = load_git_history_stats(previous_stats_path)
+        except Exception:
+            continue
+        if base_stats is not None:
+            since_commit = previous_commit_hash
+            break
+    if base_stats is not None:
+        logger.info(f"Updating git history stats from {since_commit} to {commit_hash}")
+        stats.commit_counts = base_stats.commit_counts
+        stats.last_modified = base_stats.last_modified
+    try:
+        stats.update(git_repo, since_commit=since_commit)
+    except Exception as e:
+        logger.warning(f"Could not read git history: {e}")
+        return GitHistoryStats(commit_hash=commit_hash)
+    save_git_history_stats(stats_dir, stats_path, stats)
+    return stats
+
+
+def get_git_history_stats_paths(stats_dir: str) -> list[str]:
+    # Most recently written first
+    try:
+        file_names = [
+            file_name for file_name in os.listdir(stats_dir) if file_name.endswith(".pkl")
+        ]
+    except FileNotFoundError:
+        return []
+    stats_paths = [os.path.join(stats_dir, file_name) for file_name in file_names]
+    return sorted(stats_paths, key=os.path.getmtime, reverse=True)
+
+
+def load_git_history_stats(stats_path: str) -> GitHistoryStats | None:
+    try:
+        with open(stats_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not load git history stats {stats_path}: {e}")
+        return None
+
+
+def save_git_history_stats(stats_dir: str, stats_path: str, stats: GitHistoryStats):
+    os.makedirs(stats_dir, exist_ok=True)
+    tmp_path = f"{stats_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(stats, f)
+    os.replace(tmp_path, stats_path)
+    for old_stats_path in get_git_history_stats_paths(stats_dir)[MAX_GIT_STATS_PER_REPO:]:
+        try:
+            os.remove(old_stats_path)
+        except OSError:
+            pass
+
+
 def convert_to_percentiles(values, max_percentile=0.1):
     sorted_values = sorted(values)  # Sort the values in ascending order
     n = len(sorted_values)
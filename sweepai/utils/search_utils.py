@@ -4,10 +4,10 @@ import github
 from loguru import logger
 
 from github.Repository import Repository
-from tqdm import tqdm
 
 from sweepai.config.client import SweepConfig
-from sweepai.core.vector_db import get_deeplake_vs_from_repo, get_relevant_snippets
+from sweepai.core.retrieval_session import RetrievalSession
+from sweepai.core.vector_db import get_deeplake_vs_from_repo
 from sweepai.core.entities import Snippet
 from sweepai.utils.github_utils import (
     ClonedRepo,
@@ -26,33 +26,30 @@ def search_snippets(
     sweep_config: SweepConfig = SweepConfig(),
     multi_query: list[str] = None,
     excluded_directories: list[str] = None,
+    session: RetrievalSession | None = None,
 ) -> tuple[list[Snippet], str]:
+    # Callers that search the same repo several times pass a session to reuse its work
+    session = session or RetrievalSession(cloned_repo)
     # Initialize the relevant directories string
     if multi_query:
         lists_of_snippets = list[list[Snippet]]()
         multi_query = [query] + multi_query
-        for query in multi_query:
-            snippets: list[Snippet] = get_relevant_snippets(
-                cloned_repo,
-                query,
-                num_files,
-            )
+        for query, snippets in zip(
+            multi_query,
+            session.get_relevant_snippets(multi_query, num_files),
+        ):
             logger.info(f"Snippets for query {query}: {snippets}")
             if snippets:
                 lists_of_snippets.append(snippets)
         snippets = merge_and_dedup_snippets(lists_of_snippets)
         logger.info(f"Snippets for multi query {multi_query}: {snippets}")
     else:
-        snippets: list[Snippet] = get_relevant_snippets(
-            cloned_repo,
-            query,
-            num_files,
-        )
+        snippets: list[Snippet] = session.get_relevant_snippets([query], num_files)[0]
         logger.info(f"Snippets for query {query}: {snippets}")
     new_snippets = []
     for snippet in snippets:
         try:
-            file_contents = cloned_repo.get_file_contents(snippet.file_path)
+            file_contents = session.get_file_contents(snippet.file_path)
         except:
             continue
         try:
@@ -70,13 +67,9 @@ def search_snippets(
     snippets = new_snippets
     from git import Repo
 
-    file_list = cloned_repo.get_file_list()
     query_file_names = get_file_names_from_query(query)
-    query_match_files = []  # files in both query and repo
-    for file_path in tqdm(file_list):
-        for query_file_name in query_file_names:
-            if query_file_name in file_path:
-                query_match_files.append(file_path)
+    # files in both query and repo
+    query_match_files = session.path_index.match(query_file_names)
     if multi_query:
         snippet_paths = [snippet.file_path for snippet in snippets] + query_match_files[
             :20
@@ -86,14 +79,12 @@ def search_snippets(
             :10
         ]
     snippet_paths = list(set(snippet_paths))
-    tree = cloned_repo.get_tree_and_file_list(
+    tree = session.get_tree(
         snippet_paths=snippet_paths, excluded_directories=excluded_directories
     )
     for file_path in query_match_files:
         try:
-            file_contents = cloned_repo.get_file_contents(
-                file_path, ref=cloned_repo.branch
-            )
+            file_contents = session.get_file_contents(file_path, ref=cloned_repo.branch)
             if (
                 len(file_contents) > sweep_config.max_file_limit
             ):  # more than 10000 tokens
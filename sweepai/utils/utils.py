@@ -10,6 +10,8 @@ import tiktoken
 
 from sweepai.core.entities import Snippet
 from sweepai.config.server import ENV, UTILS_MODAL_INST_NAME
+from sweepai.utils.line_index import LineIndex
+from sweepai.utils.parser_registry import ParserLimitExceeded, parser_registry
 
 
 def non_whitespace_len(s: str) -> int:  # new len function
@@ -17,12 +19,8 @@ def non_whitespace_len(s: str) -> int:  # new len function
 
 
 def get_line_number(index: int, source_code: str) -> int:
-    total_chars = 0
-    for line_number, line in enumerate(source_code.splitlines(keepends=True), start=1):
-        total_chars += len(line)
-        if total_chars > index:
-            return line_number - 1
-    return line_number
+    # Prefer building a LineIndex once when looking up many indices in the same source
+    return LineIndex(source_code).get_line_number(index)
 
 
 @dataclass
@@ -40,8 +38,10 @@ class Span:
         # Grab the corresponding substring of string s by bytes
         return s[self.start : self.end]
 
-    def extract_lines(self, s: str) -> str:
+    def extract_lines(self, s: str | LineIndex) -> str:
         # Grab the corresponding substring of string s by lines
+        if isinstance(s, LineIndex):
+            return s.extract_lines(self.start, self.end)
         return "\n".join(s.splitlines()[self.start : self.end])
 
     def __add__(self, other: Span | int) -> Span:
@@ -60,6 +60,10 @@ class Span:
         return self.end - self.start
 
 
+# Bump this whenever chunk_tree's output changes, it invalidates cached chunk spans
+CHUNKER_VERSION = "1"
+
+
 def chunk_tree(
     tree,
     source_code: bytes,
@@ -98,13 +102,14 @@ def chunk_tree(
     curr.start = tree.root_node.end_byte
 
     # 3. Combining small chunks with bigger ones
+    line_index = LineIndex(source_code)
+    decoded_source_code = line_index.source_code
     new_chunks = []
     current_chunk = Span(0, 0)
     for chunk in chunks:
         current_chunk += chunk
-        if non_whitespace_len(
-            current_chunk.extract(source_code.decode("utf-8"))
-        ) > coalesce and "\n" in current_chunk.extract(source_code.decode("utf-8")):
+        current_chunk_source = current_chunk.extract(decoded_source_code)
+        if non_whitespace_len(current_chunk_source) > coalesce and "\n" in current_chunk_source:
             new_chunks.append(current_chunk)
             current_chunk = Span(chunk.end, chunk.end)
     if len(current_chunk) > 0:
@@ -113,8 +118,8 @@ def chunk_tree(
     # 4. Changing line numbers
     line_chunks = [
         Span(
-            get_line_number(chunk.start, source_code),
-            get_line_number(chunk.end, source_code),
+            line_index.get_line_number(chunk.start),
+            line_index.get_line_number(chunk.end),
         )
         for chunk in new_chunks
     ]
@@ -178,41 +183,79 @@ def naive_chunker(code: str, line_count: int = 30, overlap: int = 15):
     
     return chunks
 
-def chunk_code(code: str, path: str, MAX_CHARS: int = 1500, coalesce: int = 100) -> list[Snippet]:
-    from tree_sitter_languages import get_parser
+def get_parser(language: str):
+    return parser_registry.get_parser(language)
 
+
+def get_language(path: str) -> str | None:
     ext = path.split(".")[-1]
-    if ext in extension_to_language:
-        language = extension_to_language[ext]
+    return extension_to_language.get(ext)
+
+
+def get_chunk_spans(
+    code: str,
+    language: str,
+    MAX_CHARS: int = 1500,
+    coalesce: int = 100,
+    tree_key: tuple[str, str, str] | None = None,
+) -> list[Span]:
+    # With a (repo, branch, path) tree_key the tree is kept, so re-chunking the file
+    # after an edit only re-parses the edited region
+    source_bytes = code.encode("utf-8")
+    if tree_key is None:
+        tree = parser_registry.parse(language, source_bytes)
     else:
+        tree = parser_registry.parse_file(tree_key, language, source_bytes)
+    return chunk_tree(tree, source_bytes, MAX_CHARS=MAX_CHARS, coalesce=coalesce)
+
+
+def spans_to_snippets(code: str, spans: list[Span], path: str) -> list[Snippet]:
+    line_index = LineIndex(code)
+    snippets = []
+    for chunk in spans:
+        new_snippet = Snippet(
+            content=chunk.extract_lines(line_index),
+            start=chunk.start,
+            end=chunk.end,
+            file_path=path,
+        )
+        snippets.append(new_snippet)
+    return snippets
+
+
+def naive_chunk_code(code: str, path: str) -> list[Snippet]:
+    chunks = naive_chunker(code)
+    snippets = []
+    for idx, chunk in enumerate(chunks):
+        new_snippet = Snippet(
+            content=chunk,
+            start=idx * 30,
+            end=(idx + 1) * 30,
+            file_path=path,
+        )
+        snippets.append(new_snippet)
+    return snippets
+
+
+def chunk_code(
+    code: str,
+    path: str,
+    MAX_CHARS: int = 1500,
+    coalesce: int = 100,
+    tree_key: tuple[str, str, str] | None = None,
+) -> list[Snippet]:
+    language = get_language(path)
+    if language is None:
         # Fallback to naive chunking if tree_sitter fails
-        chunks = naive_chunker(code)
-        snippets = []
-        for idx, chunk in enumerate(chunks):
-            new_snippet = Snippet(
-                content=chunk,
-                start=idx * 30,
-                end=(idx + 1) * 30,
-                file_path=path,
-            )
-            snippets.append(new_snippet)
-        return snippets
+        return naive_chunk_code(code, path)
     try:
-        parser = get_parser(language)
-        tree = parser.parse(code.encode("utf-8"))
-        chunks = chunk_tree(
-            tree, code.encode("utf-8"), MAX_CHARS=MAX_CHARS, coalesce=coalesce
+        spans = get_chunk_spans(
+            code, language, MAX_CHARS=MAX_CHARS, coalesce=coalesce, tree_key=tree_key
         )
-        snippets = []
-        for chunk in chunks:
-            new_snippet = Snippet(
-                content=chunk.extract_lines(code),
-                start=chunk.start,
-                end=chunk.end,
-                file_path=path,
-            )
-            snippets.append(new_snippet)
-        return snippets
+        return spans_to_snippets(code, spans, path)
+    except ParserLimitExceeded as e:
+        logger.warning(f"Falling back to naive chunking for {path}: {e}")
+        return naive_chunk_code(code, path)
     except Exception as e:
         logger.error(traceback.format_exc())
         return []
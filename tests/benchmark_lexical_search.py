@@ -0,0 +1,72 @@
+"""
+Compares the whoosh and bm25 lexical backends on synthetic repos of 1k, 10k and 100k chunks.
+
+Run with: python tests/benchmark_lexical_search.py [num_chunks ...]
+"""
+import random
+import sys
+import tempfile
+import time
+
+from sweepai.core import lexical_search
+from sweepai.core.entities import Snippet
+
+WORDS = [
+    f"{prefix}{suffix}"
+    for prefix in ["get", "set", "load", "parse", "index", "chunk", "file", "repo", "query", "token"]
+    for suffix in ["Name", "_path", "Config", "_cache", "Value", "_id", "Snippet", "_score", "Tree", "Error"]
+]
+QUERIES = [
+    "Fix the error when parsing the repo config",
+    "load_cache returns the wrong snippet score",
+    "getTokenName should index every file path",
+]
+
+
+def make_snippets(num_chunks, seed=0):
+    rng = random.Random(seed)
+    # Zipf-like vocabulary use, like identifiers in real code
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    return [
+        Snippet(
+            content=" ".join(rng.choices(WORDS, weights=weights, k=rng.randint(20, 200))),
+            start=0,
+            end=40,
+            file_path=f"src/module_{i // 10}/file_{i}.py",
+        )
+        for i in range(num_chunks)
+    ]
+
+
+def benchmark(backend, snippets):
+    lexical_search.LEXICAL_SEARCH_BACKEND = backend
+    start = time.time()
+    ix = lexical_search.prepare_index_from_snippets(snippets)
+    build_time = time.time() - start
+    start = time.time()
+    results = [lexical_search.search_index(query, ix) for query in QUERIES]
+    query_time = (time.time() - start) / len(QUERIES)
+    return build_time, query_time, results
+
+
+def top_keys(result, k=10):
+    return set(sorted(result, key=result.get, reverse=True)[:k])
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    lexical_search.LEXICAL_INDEX_DIR = tempfile.mkdtemp()
+    for num_chunks in sizes:
+        snippets = make_snippets(num_chunks)
+        whoosh_build, whoosh_query, whoosh_results = benchmark("whoosh", snippets)
+        bm25_build, bm25_query, bm25_results = benchmark("bm25", snippets)
+        overlap = sum(
+            len(top_keys(a) & top_keys(b)) / max(len(top_keys(a)), 1)
+            for a, b in zip(whoosh_results, bm25_results)
+        ) / len(QUERIES)
+        print(
+            f"{num_chunks} chunks: "
+            f"whoosh build {whoosh_build:.2f}s query {whoosh_query * 1000:.1f}ms, "
+            f"bm25 build {bm25_build:.2f}s query {bm25_query * 1000:.1f}ms, "
+            f"top-10 overlap {overlap:.0%}"
+        )
@@ -0,0 +1,84 @@
+"""
+Throughput and retrieval agreement of the quantized ONNX embedding backend against PyTorch.
+
+The corpus is the chunked source of the sweepai package, so runs are comparable across
+machines. Set ONNX_NUM_THREADS to pin the ONNX Runtime intra-op threads.
+
+Run with: python tests/benchmark_onnx_embeddings.py [max_chunks]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from sweepai.core.embedding_models import model_registry
+from sweepai.utils.utils import naive_chunk_code
+
+K = 10
+QUERIES = [
+    "Fix the error when the repo config cannot be parsed",
+    "Where are embeddings cached in redis",
+    "Create a pull request from the generated changes",
+    "Search the lexical index for a query",
+    "Handle comments left on a pull request review",
+    "Count the tokens of a prompt",
+    "Clone the repository and list its files",
+    "Retry a request when the API is rate limited",
+]
+
+
+def load_corpus(max_chunks):
+    root = os.path.join(os.path.dirname(__file__), "..", "sweepai")
+    texts = []
+    for directory, _, file_names in sorted(os.walk(root)):
+        for file_name in sorted(file_names):
+            if not file_name.endswith(".py"):
+                continue
+            path = os.path.join(directory, file_name)
+            with open(path) as f:
+                texts.extend(snippet.content for snippet in naive_chunk_code(f.read(), path))
+    return texts[:max_chunks]
+
+
+def timed_encode(texts, backend):
+    model_registry.warm_up(backend=backend)
+    start = time.time()
+    embeddings = model_registry.encode(texts, backend=backend)
+    return np.asarray(embeddings, dtype=np.float32), time.time() - start
+
+
+def top_k(embeddings, queries):
+    scores = queries @ embeddings.T
+    return [set(np.argsort(-row)[:K]) for row in scores]
+
+
+if __name__ == "__main__":
+    max_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    texts = load_corpus(max_chunks)
+    print(f"{len(texts)} chunks")
+    results = {}
+    for backend in ["torch", "onnx"]:
+        embeddings, elapsed = timed_encode(texts, backend)
+        queries = np.asarray(
+            model_registry.encode(QUERIES, backend=backend), dtype=np.float32
+        )
+        results[backend] = embeddings, queries
+        print(f"  {backend}: {elapsed:.1f}s, {len(texts) / elapsed:.0f} chunks/s")
+    (torch_embeddings, torch_queries), (onnx_embeddings, onnx_queries) = (
+        results["torch"],
+        results["onnx"],
+    )
+    cosine = np.sum(torch_embeddings * onnx_embeddings, axis=1) / (
+        np.linalg.norm(torch_embeddings, axis=1) * np.linalg.norm(onnx_embeddings, axis=1)
+    )
+    overlap = np.mean(
+        [
+            len(a & b) / K
+            for a, b in zip(
+                top_k(torch_embeddings, torch_queries), top_k(onnx_embeddings, onnx_queries)
+            )
+        ]
+    )
+    print(f"  cosine(torch, onnx): mean {cosine.mean():.4f}, min {cosine.min():.4f}")
+    print(f"  top-{K} agreement over {len(QUERIES)} queries: {overlap:.3f}")
@@ -0,0 +1,61 @@
+"""
+Recall and latency of the flat vector store's ANN (IVF) search against exact search.
+
+Embeddings are sampled around random topic centers, like embeddings of code chunks,
+and queries are perturbed rows.
+
+Run with: python tests/benchmark_vector_search.py [num_rows ...]
+"""
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from sweepai.core.flat_vector_store import FlatVectorStore
+
+DIM = 384
+K = 25
+NUM_QUERIES = 50
+NPROBES = [4, 8, 16, 32, 64]
+
+
+def make_embeddings(num_rows, rng):
+    centers = rng.standard_normal((max(num_rows // 100, 1), DIM)).astype(np.float32)
+    topics = rng.integers(len(centers), size=num_rows)
+    return centers[topics] + 1.5 * rng.standard_normal((num_rows, DIM)).astype(np.float32)
+
+
+def timed_search(vs, queries, **kwargs):
+    start = time.time()
+    results = [set(vs.search(embedding=query, k=K, **kwargs)["id"]) for query in queries]
+    return results, (time.time() - start) / len(queries)
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [50_000, 200_000]
+    rng = np.random.default_rng(0)
+    for num_rows in sizes:
+        vs = FlatVectorStore(tempfile.mkdtemp())
+        embeddings = make_embeddings(num_rows, rng)
+        ids = [str(i) for i in range(num_rows)]
+        for start in range(0, num_rows, 8192):
+            batch_ids = ids[start : start + 8192]
+            vs.add(
+                text=batch_ids,
+                id=batch_ids,
+                embedding=embeddings[start : start + 8192],
+                metadata=[{} for _ in batch_ids],
+            )
+        queries = embeddings[rng.choice(num_rows, NUM_QUERIES)]
+        queries += 0.5 * rng.standard_normal(queries.shape).astype(np.float32)
+        exact_results, exact_latency = timed_search(vs, queries)
+        start = time.time()
+        vs.build_ann_index(min_rows=0)
+        print(f"{num_rows} rows: exact {exact_latency * 1000:.1f}ms, ANN build {time.time() - start:.1f}s")
+        for nprobe in NPROBES:
+            ann_results, ann_latency = timed_search(vs, queries, nprobe=nprobe)
+            recall = np.mean(
+                [len(a & e) / len(e) for a, e in zip(ann_results, exact_results)]
+            )
+            print(f"  nprobe={nprobe}: recall@{K} {recall:.3f}, {ann_latency * 1000:.1f}ms")
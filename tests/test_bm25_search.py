@@ -0,0 +1,15 @@
+from sweepai.core.bm25_search import BM25Index
+
+
+def test_search():
+    ix = BM25Index.from_token_lists(
+        [["parse", "config"], ["parse", "file", "file"], ["load", "cache"]],
+        titles=["a.py", "b.py", "c.py"],
+        starts=[0, 0, 0],
+        ends=[10, 10, 10],
+    )
+    results = ix.search(["file", "parse"])
+    assert list(results) == ["b.py:0:10", "a.py:0:10"]
+    assert results["b.py:0:10"] == 1.0
+    assert ix.search(["file", "parse"], limit=1) == {"b.py:0:10": 1.0}
+    assert ix.search(["missing"]) == {}
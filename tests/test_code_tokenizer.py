@@ -0,0 +1,12 @@
+from sweepai.core.code_tokenizer import iter_token_spans, tokenize
+
+
+def test_tokenize():
+    code = "def getUserName(self, user_id):\n    return HTTPServer.x"
+    assert tokenize(code) == [
+        "def", "get", "user", "name", "self", "user", "id", "return", "http", "server",
+    ]
+    assert tokenize(code, top_words={"self", "def"}) == tokenize(code)[1:4] + tokenize(code)[5:]
+    spans = list(iter_token_spans(code))
+    assert [token for token, _, _ in spans] == tokenize(code)
+    assert [code[start:end].lower() for token, start, end in spans] == tokenize(code)
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import git
+import pytest
+from github.GithubException import UnknownObjectException
+
+from sweepai.utils.content_provider import ContentCache, LocalContentProvider
+
+
+class FakeRepo:
+    def __init__(self, branches):
+        self.branches = branches
+
+    def get_branch(self, branch):
+        if branch not in self.branches:
+            raise UnknownObjectException(404, {"message": "Branch not found"}, None)
+        return SimpleNamespace(commit=SimpleNamespace(sha=self.branches[branch]))
+
+
+def test_local_content_provider(tmp_path):
+    git_repo = git.Repo.init(tmp_path)
+    (tmp_path / "a.py").write_text("first\n")
+    git_repo.index.add(["a.py"])
+    first_commit = git_repo.index.commit("first").hexsha
+    git_repo.create_tag("v1")
+    (tmp_path / "a.py").write_text("second\n")
+    git_repo.index.add(["a.py"])
+    second_commit = git_repo.index.commit("second").hexsha
+    branches = {"main": second_commit}
+
+    provider = LocalContentProvider(git_repo, FakeRepo(branches), cache=ContentCache())
+    assert provider.get_file_contents("a.py", first_commit) == "first\n"
+    assert provider.get_file_contents("a.py", "main") == "second\n"
+    # Tags, missing branches and commits that were pushed after the clone use the API
+    assert provider.get_file_contents("a.py", "v1") is None
+    assert provider.get_file_contents("a.py", "missing-branch") is None
+    branches["main"] = "f" * 40
+    assert provider.get_file_contents("a.py", "main") is None
+    with pytest.raises(UnknownObjectException):
+        provider.get_file_contents("b.py", first_commit)
+
+
+def test_content_cache_evicts_least_recently_used():
+    cache = ContentCache(max_bytes=10)
+    cache.set(("c", "a"), "aaaa")
+    cache.set(("c", "b"), "bbbb")
+    assert cache.get(("c", "a")) == "aaaa"
+    cache.set(("c", "d"), "dddd")
+    assert cache.get(("c", "b")) is None
+    assert cache.get(("c", "a")) == "aaaa" and cache.get(("c", "d")) == "dddd"
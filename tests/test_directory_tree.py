@@ -0,0 +1,18 @@
+from sweepai.utils.directory_tree import DirectoryTree
+
+
+def test_render():
+    tree = DirectoryTree.from_paths(
+        ["README.md", "src/app.py", "src/utils/io.py", "src/utils/text.py", "docs/index.md"]
+    )
+    assert tree.render() == "README.md\ndocs/...\nsrc/...\n"
+    assert tree.render(included_directories=["src", "src/utils"]) == (
+        "README.md\ndocs/...\nsrc/\n  app.py\n  src/utils/\n    io.py\n    text.py\n"
+    )
+    assert tree.render(
+        included_directories=["src"], excluded_directories=["docs", "app.py"]
+    ) == "README.md\nsrc/\n  utils/...\n"
+    # Renders are memoized per set of included and excluded directories
+    assert tree.render(included_directories=["src", "src"]) is tree.render(
+        included_directories=["src"]
+    )
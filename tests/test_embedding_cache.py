@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+
+from sweepai.core.embedding_cache import (
+    decode_embedding_into,
+    encode_embedding,
+    get_cached_embeddings,
+)
+
+
+class FakePipeline:
+    def __init__(self, values):
+        self.values = values
+        self.commands = []
+
+    def mget(self, keys):
+        self.commands.append(keys)
+
+    def execute(self):
+        return [[self.values.get(key) for key in keys] for keys in self.commands]
+
+
+class FakeRedis:
+    def __init__(self, values):
+        self.values = values
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.values)
+
+
+def test_encode_decode():
+    embedding = np.array([0.5, -1.25, 3.0], dtype=np.float32)
+    out = np.empty(3, dtype=np.float32)
+    for dtype in ("float16", "float32"):
+        value = encode_embedding(embedding, "model", dtype=dtype)
+        assert decode_embedding_into(value, out, "model")
+        assert np.array_equal(out, embedding)
+    assert not decode_embedding_into(value, out, "other-model")
+    assert not decode_embedding_into(value, np.empty(4, dtype=np.float32), "model")
+    # Truncated values are rejected instead of read past their end
+    assert not decode_embedding_into(value[:-1], out, "model")
+    assert not decode_embedding_into(b"[1.0, 2.0]", out, "model")
+    # Values cached as JSON are still readable
+    assert decode_embedding_into(json.dumps([1.0, 2.0, 3.0]).encode(), out, "model")
+    assert out.tolist() == [1.0, 2.0, 3.0]
+
+
+def test_get_cached_embeddings_skips_other_dimensions():
+    redis_client = FakeRedis(
+        {
+            "a": encode_embedding(np.ones(4), "model"),
+            "b": encode_embedding(np.ones(3), "model"),
+        }
+    )
+    embeddings, found = get_cached_embeddings(
+        redis_client, ["a", "b", "c"], "model", dim=3
+    )
+    assert found.tolist() == [False, True, False]
+    assert embeddings[1].tolist() == [1.0, 1.0, 1.0]
+    assert get_cached_embeddings(redis_client, ["c"], "model", dim=3)[0] is None
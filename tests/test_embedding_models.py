@@ -0,0 +1,48 @@
+import re
+
+from sweepai.core.embedding_models import (
+    make_length_batches,
+    truncate_texts_with_tokenizer,
+)
+
+
+class WordTokenizer:
+    """Splits on whitespace like a fast tokenizer, and adds [CLS] and [SEP]."""
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def __call__(
+        self, texts, add_special_tokens, truncation, max_length, return_offsets_mapping
+    ):
+        offsets = [
+            [match.span() for match in re.finditer(r"\S+", text)][:max_length]
+            for text in texts
+        ]
+        return {"offset_mapping": offsets}
+
+
+def test_make_length_batches():
+    lengths = [10, 256, 12, 256, 40, 11, 9, 250]
+    batches = make_length_batches(lengths, token_budget=512, max_batch_size=16)
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(lengths)))
+    for batch in batches:
+        # Every batch pads to its first, longest text and stays within the budget
+        assert lengths[batch[0]] == max(lengths[idx] for idx in batch)
+        assert len(batch) == 1 or len(batch) * lengths[batch[0]] <= 512
+    assert batches[0] == [1, 3]
+    assert batches[1:] == [[7, 4], [2, 5, 0, 6]]
+    assert make_length_batches([5] * 10, token_budget=100, max_batch_size=4) == [
+        [0, 1, 2, 3],
+        [4, 5, 6, 7],
+        [8, 9],
+    ]
+
+
+def test_truncate_texts_with_tokenizer():
+    texts = ["one two three four five six", "one two", ""]
+    assert truncate_texts_with_tokenizer(texts, WordTokenizer(), max_length=6) == [
+        "one two three four",
+        "one two",
+        "",
+    ]
@@ -0,0 +1,35 @@
+import threading
+
+import numpy as np
+
+from sweepai.core.embedding_server import DynamicBatcher, embed_with_server, make_server
+
+
+def fake_encode(texts):
+    return np.array([[len(text), ord(text[0])] for text in texts], dtype=np.float32)
+
+
+def test_dynamic_batcher():
+    batch_sizes = []
+
+    def encode(texts):
+        batch_sizes.append(len(texts))
+        return fake_encode(texts)
+
+    batcher = DynamicBatcher(encode, max_batch_size=8, max_wait_ms=50)
+    requests = [[f"{chr(97 + i)}" * (j + 1) for j in range(i % 3 + 1)] for i in range(6)]
+    futures = [batcher.submit(texts) for texts in requests]
+    for texts, future in zip(requests, futures):
+        assert np.array_equal(future.result(timeout=5), fake_encode(texts))
+    # The 6 requests are coalesced into at most 3 model batches
+    assert sum(batch_sizes) == 12 and len(batch_sizes) <= 3
+
+
+def test_server():
+    server = make_server(fake_encode, port=0, max_wait_ms=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        assert np.array_equal(embed_with_server(["ab", "c"], url=url), fake_encode(["ab", "c"]))
+    finally:
+        server.shutdown()
@@ -0,0 +1,34 @@
+import numpy as np
+
+from sweepai.core.flat_vector_store import FlatVectorStore
+
+
+def test_add_search_delete(tmp_path):
+    vs = FlatVectorStore(str(tmp_path / "vs"))
+    ids = ["a.py:0:10", "b.py:0:10", "c.py:0:10"]
+    vs.add(
+        text=ids,
+        id=ids,
+        embedding=np.array([[1, 0], [0.6, 0.8], [0, 2]], dtype=np.float32),
+        metadata=[{"file_path": row_id.split(":")[0], "score": np.float64(0.5)} for row_id in ids],
+    )
+    results = vs.search(embedding=np.array([[1, 0.1]]), k=2)
+    assert results["id"] == ["a.py:0:10", "b.py:0:10"]
+    assert results["metadata"][0] == {"file_path": "a.py", "score": 0.5}
+    assert abs(results["score"][0] - 1 / np.sqrt(1.01)) < 1e-3
+
+    vs.delete(ids=["a.py:0:10"])
+    assert len(FlatVectorStore(str(tmp_path / "vs"))) == 2
+    assert vs.search(embedding=np.array([1, 0.1]), k=5)["id"] == ["b.py:0:10", "c.py:0:10"]
+
+
+def test_score_batch(tmp_path):
+    rng = np.random.default_rng(0)
+    vs = FlatVectorStore(str(tmp_path / "vs"))
+    ids = [str(i) for i in range(50)]
+    vs.add(text=ids, id=ids, embedding=rng.standard_normal((50, 8)), metadata=[{} for _ in ids])
+    queries = rng.standard_normal((3, 8))
+    scores = vs.score_batch(queries)
+    assert scores.shape == (3, 50)
+    for query, query_scores in zip(queries, scores):
+        assert np.allclose(query_scores, vs.score(query), atol=1e-5)
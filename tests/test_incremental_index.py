@@ -0,0 +1,163 @@
+import hashlib
+import os
+import shutil
+
+import git
+import numpy as np
+
+from sweepai.core import repo_parsing_utils, vector_db
+from sweepai.core.lexical_search import get_lexical_index_path, search_index
+from sweepai.utils.github_utils import ClonedRepo
+
+
+class FakeClonedRepo:
+    repo_full_name = "sweepai/test"
+    get_changed_files = ClonedRepo.get_changed_files
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.git_repo = git.Repo(cache_dir)
+
+
+def fake_embeddings(documents):
+    return np.array(
+        [
+            np.frombuffer(hashlib.sha256(document.encode()).digest()[:16], dtype=np.uint8)
+            for document in documents
+        ],
+        dtype=np.float32,
+    )
+
+
+def init_repo(repo_dir):
+    repo = git.Repo.init(repo_dir)
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "test")
+        config.set_value("user", "email", "test@example.com")
+    return repo
+
+
+def commit(repo, files, message):
+    for file_path, contents in files.items():
+        path = os.path.join(repo.working_tree_dir, file_path)
+        if contents is None:
+            repo.index.remove([file_path], working_tree=True)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
+        repo.index.add([file_path])
+    repo.index.commit(message)
+
+
+def get_index_state(cloned_repo):
+    deeplake_vs, lexical_index, num_snippets = vector_db.get_deeplake_vs_from_repo(
+        cloned_repo
+    )
+    rows = deeplake_vs.rows
+    cache_key = vector_db.get_cache_key(cloned_repo, vector_db.SweepConfig())
+    manifest = vector_db.load_index_manifest(
+        vector_db.get_manifest_path(cloned_repo, vector_db.SweepConfig())
+    )
+    return {
+        "rows": sorted(zip(rows.ids, [str(metadata) for metadata in rows.metadatas])),
+        "code_scores": vector_db.load_code_scores(cache_key),
+        "files": {
+            file_path: (indexed_file.blob_sha, sorted(indexed_file.spans))
+            for file_path, indexed_file in manifest.files.items()
+        },
+        "num_snippets": num_snippets,
+        "lexical_results": sorted(search_index("Test", lexical_index)),
+    }
+
+
+def test_incremental_update_matches_full_rebuild(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_db, "VECTOR_STORE_BACKEND", "flat")
+    monkeypatch.setattr(vector_db, "compute_embeddings", fake_embeddings)
+    monkeypatch.setattr(repo_parsing_utils, "FILE_THRESHOLD", 3)
+    repo = init_repo(tmp_path / "repo")
+    cloned_repo = FakeClonedRepo(repo.working_tree_dir)
+    commit(
+        repo,
+        {
+            "src/a.py": "def a():\n    return 1\n",
+            "src/b.py": "def b():\n    return 2\n",
+            "lib/c.py": "def c():\n    return 3\n",
+            "lib/d.py": "def d():\n    return 4\n",
+            "README.md": "# Test\n",
+        },
+        "initial",
+    )
+    commit(repo, {"src/a.py": "def a():\n    return 10\n"}, "change a")
+    incremental_dir = tmp_path / "incremental"
+    incremental_dir.mkdir()
+    monkeypatch.chdir(incremental_dir)
+    vector_db.get_deeplake_vs_from_repo(cloned_repo)
+    manifest_path = vector_db.get_manifest_path(cloned_repo, vector_db.SweepConfig())
+    shutil.copy(manifest_path, tmp_path / "manifest.pkl")
+
+    # Changes a file, deletes one and pushes lib/ over the directory size threshold
+    commit(
+        repo,
+        {
+            "src/b.py": "def b():\n    return 20\n",
+            "README.md": None,
+            "lib/e.py": "def e():\n    return 5\n",
+            "lib/f.py": "def f():\n    return 6\n",
+        },
+        "update",
+    )
+    incremental_state = get_index_state(cloned_repo)
+    # As if indexing stopped after the vectors were written, so only the lexical index
+    # and manifest are rebuilt, reusing the vectors of the commit
+    shutil.copy(tmp_path / "manifest.pkl", manifest_path)
+    shutil.rmtree(
+        get_lexical_index_path(vector_db.get_cache_key(cloned_repo, vector_db.SweepConfig()))
+    )
+    rebuilt_lexical_state = get_index_state(cloned_repo)
+
+    full_dir = tmp_path / "full"
+    full_dir.mkdir()
+    monkeypatch.chdir(full_dir)
+    full_state = get_index_state(cloned_repo)
+
+    assert not any(row_id.startswith("lib/") for row_id, _ in full_state["rows"])
+    assert not any(row_id.startswith("README") for row_id, _ in incremental_state["rows"])
+    assert "README.md" not in incremental_state["files"]
+    assert incremental_state["lexical_results"] == []
+    assert incremental_state == full_state
+    assert rebuilt_lexical_state == full_state
+
+
+def test_failed_indexing_leaves_no_vector_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_db, "VECTOR_STORE_BACKEND", "flat")
+    monkeypatch.setattr(vector_db, "PIPELINE_BATCH_SIZE", 1)
+    repo = init_repo(tmp_path / "repo")
+    commit(
+        repo,
+        {f"src/{name}.py": f"def {name}():\n    return 1\n" for name in "abcd"},
+        "initial",
+    )
+    cloned_repo = FakeClonedRepo(repo.working_tree_dir)
+    monkeypatch.chdir(tmp_path)
+    num_batches = 0
+
+    def failing_embeddings(documents):
+        nonlocal num_batches
+        num_batches += 1
+        if num_batches > 2:
+            raise RuntimeError("embedding backend unavailable")
+        return fake_embeddings(documents)
+
+    monkeypatch.setattr(vector_db, "compute_embeddings", failing_embeddings)
+    try:
+        vector_db.get_deeplake_vs_from_repo(cloned_repo)
+    except RuntimeError:
+        pass
+    cache_key = vector_db.get_cache_key(cloned_repo, vector_db.SweepConfig())
+    assert not os.path.exists(vector_db.get_vector_store_path(cache_key))
+    assert os.listdir(vector_db.FLAT_VECTOR_FOLDER) == []
+
+    monkeypatch.setattr(vector_db, "compute_embeddings", fake_embeddings)
+    deeplake_vs, _, num_snippets = vector_db.get_deeplake_vs_from_repo(cloned_repo)
+    assert len(deeplake_vs) == num_snippets == 4
@@ -0,0 +1,88 @@
+import numpy as np
+
+from sweepai.core.flat_vector_store import FlatVectorStore, normalize
+from sweepai.core.ivf_index import IVFIndex, assign_to_lists
+
+
+def random_unit_vectors(num_rows, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return normalize(rng.standard_normal((num_rows, dim))).astype(np.float32)
+
+
+def test_build_groups_every_row_by_closest_centroid():
+    embeddings = random_unit_vectors(500)
+    ann_index = IVFIndex.build(embeddings, num_lists=8)
+    assert ann_index.num_rows == ann_index.num_trained_rows == 500
+    assert ann_index.offsets[0] == 0 and ann_index.offsets[-1] == 500
+    assert sorted(ann_index.row_indices.tolist()) == list(range(500))
+    assert np.array_equal(
+        ann_index.assignments, assign_to_lists(embeddings, ann_index.centroids)
+    )
+    assert np.allclose(np.linalg.norm(ann_index.centroids, axis=1), 1, atol=1e-5)
+
+
+def test_candidates():
+    embeddings = random_unit_vectors(500)
+    ann_index = IVFIndex.build(embeddings, num_lists=8)
+    for row in (0, 123, 499):
+        candidates = ann_index.candidates(embeddings[row], nprobe=1)
+        assert row in candidates
+        assert np.all(np.diff(candidates) > 0)
+        assert np.all(ann_index.assignments[candidates] == ann_index.assignments[row])
+    assert ann_index.candidates(embeddings[0], nprobe=100).tolist() == list(range(500))
+
+
+def test_add_and_keep_reuse_centroids():
+    embeddings = random_unit_vectors(600)
+    ann_index = IVFIndex.build(embeddings[:500], num_lists=8)
+    added = ann_index.add(embeddings[500:])
+    assert np.array_equal(added.centroids, ann_index.centroids)
+    assert np.array_equal(
+        added.assignments, assign_to_lists(embeddings, ann_index.centroids)
+    )
+    assert (added.num_rows, added.num_updated_rows) == (600, 100)
+
+    keep = np.arange(0, 600, 2)
+    kept = added.keep(keep)
+    assert np.array_equal(kept.assignments, added.assignments[keep])
+    assert (kept.num_rows, kept.num_updated_rows) == (300, 400)
+
+
+def test_store_updates_ann_index_until_reclustering(tmp_path):
+    embeddings = random_unit_vectors(300)
+    ids = [str(i) for i in range(300)]
+    vs = FlatVectorStore(str(tmp_path / "vs"))
+    vs.add(text=ids[:200], id=ids[:200], embedding=embeddings[:200], metadata=[{}] * 200)
+    vs.build_ann_index(min_rows=100)
+    centroids = vs.ann_index.centroids
+
+    vs.delete(ids=ids[:10])
+    vs.add(text=ids[200:220], id=ids[200:220], embedding=embeddings[200:220], metadata=[{}] * 20)
+    vs.build_ann_index(min_rows=100, recluster_fraction=0.2)
+    assert vs.ann_index.num_rows == 210
+    assert vs.ann_index.num_updated_rows == 30
+    assert np.array_equal(vs.ann_index.centroids, centroids)
+    assert vs.rows.id_to_index["205"] in vs.get_candidates(embeddings[205], nprobe=1)
+
+    vs.add(text=ids[220:], id=ids[220:], embedding=embeddings[220:], metadata=[{}] * 80)
+    vs.build_ann_index(min_rows=100, recluster_fraction=0.2)
+    assert vs.ann_index.num_rows == 290
+    assert vs.ann_index.num_updated_rows == 0
+
+
+def test_search_falls_back_to_every_row_with_too_few_candidates(tmp_path):
+    from sweepai.core.vector_db import search_flat_vector_store
+
+    embeddings = random_unit_vectors(200)
+    ids = [f"{i}.py:0:1" for i in range(200)]
+    vs = FlatVectorStore(str(tmp_path / "vs"))
+    vs.add(
+        text=ids,
+        id=ids,
+        embedding=embeddings,
+        metadata=[{"file_path": f"{i}.py"} for i in range(200)],
+    )
+    vs.save_ann_index(IVFIndex.build(embeddings, num_lists=100))
+    assert len(vs.get_candidates(embeddings[0])) < 50
+    metadatas = search_flat_vector_store(vs, embeddings[0], {}, {}, 50)
+    assert len(metadatas) == 50
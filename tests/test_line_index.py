@@ -0,0 +1,24 @@
+from sweepai.utils.line_index import LineIndex
+
+
+def naive_line_number(index: int, source_code: bytes) -> int:
+    total_chars = 0
+    for line_number, line in enumerate(source_code.splitlines(keepends=True), start=1):
+        total_chars += len(line)
+        if total_chars > index:
+            return line_number - 1
+    return line_number
+
+
+def test_get_line_number():
+    source_code = "def f():\n    return 1\r\n\nprint('é')\n".encode("utf-8")
+    line_index = LineIndex(source_code)
+    for index in range(len(source_code) + 5):
+        assert line_index.get_line_number(index) == naive_line_number(index, source_code)
+
+
+def test_extract_lines():
+    source_code = "a\nb\nc\nd"
+    line_index = LineIndex(source_code)
+    assert line_index.extract_lines(1, 3) == "b\nc"
+    assert line_index.num_lines == 4
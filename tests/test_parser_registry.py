@@ -0,0 +1,47 @@
+from sweepai.utils.parser_registry import ParserRegistry, get_edit
+from sweepai.utils.utils import chunk_code, chunk_tree
+
+OLD_SOURCE = b"def a():\n    return 1\n\n\ndef b():\n    return 2\n"
+NEW_SOURCE = b"def a():\n    return 10\n\n\ndef b():\n    return 2\n"
+
+
+def test_get_edit():
+    assert get_edit(OLD_SOURCE, NEW_SOURCE) == {
+        "start_byte": 21,
+        "old_end_byte": 21,
+        "new_end_byte": 22,
+        "start_point": (1, 12),
+        "old_end_point": (1, 12),
+        "new_end_point": (1, 13),
+    }
+
+
+def test_update_file_reparses_from_the_old_tree():
+    registry = ParserRegistry()
+    old_trees = []
+    parse = registry.parse
+
+    def spy_parse(language, source, old_tree=None):
+        old_trees.append(old_tree)
+        return parse(language, source, old_tree=old_tree)
+
+    registry.parse = spy_parse
+    key = ("sweepai/test", "sweep/fix", "a.py")
+    registry.update_file(key, "python", OLD_SOURCE, NEW_SOURCE)
+    assert old_trees[0] is None and old_trees[1] is not None
+    # Chunking the new contents reuses the cached tree without parsing
+    tree = registry.parse_file(key, "python", NEW_SOURCE)
+    assert len(old_trees) == 2
+    fresh_tree = registry.parse("python", NEW_SOURCE)
+    assert chunk_tree(tree, NEW_SOURCE) == chunk_tree(fresh_tree, NEW_SOURCE)
+    # Other branches of the same path have their own trees
+    registry.parse_file(("sweepai/test", "main", "a.py"), "python", OLD_SOURCE)
+    assert registry.trees[key][1] == NEW_SOURCE
+
+
+def test_chunk_code_with_tree_key_matches_fresh_chunks():
+    key = ("sweepai/test", "sweep/fix", "b.py")
+    chunk_code(OLD_SOURCE.decode(), "b.py", tree_key=key)
+    assert chunk_code(NEW_SOURCE.decode(), "b.py", tree_key=key) == chunk_code(
+        NEW_SOURCE.decode(), "b.py"
+    )
@@ -0,0 +1,30 @@
+from sweepai.core.path_index import PathIndex
+
+PATHS = [
+    "docs/theme.config.tsx",
+    "docs/pages/index.mdx",
+    "sweepai/utils/github_utils.py",
+    "sweepai/utils/utils.py",
+    "tests/test_utils.py",
+    "ü/ünicode.py",
+]
+
+
+def scan(paths, mentions):
+    return [path for path in paths for mention in mentions if mention in path]
+
+
+def test_match_equals_scan(tmp_path):
+    path_index = PathIndex.from_paths(PATHS)
+    for mentions in [
+        ["docs/theme.config.tsx"],
+        ["theme.config.tsx", "utils.py"],
+        ["ünicode.py"],
+        ["missing.py"],
+        ["py"],
+    ]:
+        assert path_index.match(mentions) == scan(PATHS, mentions)
+    path_index.save(str(tmp_path / "index.npz"))
+    loaded = PathIndex.load(str(tmp_path / "index.npz"))
+    assert loaded.match(["utils.py"]) == scan(PATHS, ["utils.py"])
+    assert PathIndex.from_paths([]).match(["a.py"]) == []
@@ -0,0 +1,54 @@
+import json
+
+import httpx
+
+from sweepai.core import remote_embeddings
+from sweepai.core.remote_embeddings import RemoteEmbeddingClient
+
+
+def test_embed_retries_and_keeps_order(monkeypatch):
+    monkeypatch.setattr(remote_embeddings, "BACKOFF_BASE_SECONDS", 0.001)
+    attempts = {}
+
+    def handler(request: httpx.Request):
+        batch = json.loads(request.content)["inputs"]
+        attempts[batch[0]] = attempts.get(batch[0], 0) + 1
+        # The first request of every batch is rate limited
+        if attempts[batch[0]] == 1:
+            return httpx.Response(429)
+        return httpx.Response(200, json={"embeddings": [[float(text)] for text in batch]})
+
+    client = RemoteEmbeddingClient(
+        "http://embeddings.test/embed",
+        headers={},
+        build_payload=lambda batch: {"inputs": batch},
+        parse_response=lambda response: response["embeddings"],
+        batch_size=3,
+        max_concurrency=2,
+        requests_per_second=0,
+        transport=httpx.MockTransport(handler),
+    )
+    texts = [str(i) for i in range(10)]
+    assert client.embed(texts) == [[float(i)] for i in range(10)]
+    assert sorted(attempts.values()) == [2, 2, 2, 2]
+
+
+def test_openai_endpoint_follows_api_settings(monkeypatch):
+    monkeypatch.setattr(remote_embeddings, "OPENAI_API_KEY", "key")
+    monkeypatch.setattr(remote_embeddings, "OPENAI_API_BASE", "https://proxy.test/v1/")
+    assert remote_embeddings.get_openai_endpoint() == (
+        "https://proxy.test/v1/embeddings",
+        {"Authorization": "Bearer key"},
+    )
+
+    monkeypatch.setattr(remote_embeddings, "OPENAI_API_TYPE", "azure")
+    monkeypatch.setattr(
+        remote_embeddings, "OPENAI_API_BASE", "https://sweep.openai.azure.com/"
+    )
+    monkeypatch.setattr(remote_embeddings, "OPENAI_API_VERSION", "2023-05-15")
+    monkeypatch.setattr(remote_embeddings, "OPENAI_EMBEDDINGS_DEPLOYMENT", "ada")
+    assert remote_embeddings.get_openai_endpoint() == (
+        "https://sweep.openai.azure.com/openai/deployments/ada/embeddings"
+        "?api-version=2023-05-15",
+        {"api-key": "key"},
+    )
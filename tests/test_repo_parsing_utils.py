@@ -0,0 +1,36 @@
+from sweepai.core import repo_parsing_utils
+from sweepai.core.repo_parsing_utils import (
+    get_blob_sha,
+    get_chunk_cache_key,
+    map_in_processes,
+)
+from sweepai.utils.utils import get_language
+
+
+class FailingExecutor:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def submit(self, function, batch):
+        raise RuntimeError("daemonic processes are not allowed to have children")
+
+
+def test_map_in_processes_falls_back_to_serial(monkeypatch):
+    monkeypatch.setattr(repo_parsing_utils, "ProcessPoolExecutor", FailingExecutor)
+    results = map_in_processes(lambda batch: batch, iter([[1], [2], [3]]), num_workers=2)
+    assert list(results) == [[1], [2], [3]]
+
+
+def test_chunk_cache_key_depends_on_language():
+    blob_sha = get_blob_sha(b"def f():\n    return 1\n")
+    keys = {
+        get_chunk_cache_key(blob_sha, get_language(path), 1500, 100)
+        for path in ["a.py", "b.py", "a.rb", "a.ts", "a.tsx"]
+    }
+    assert len(keys) == 3
@@ -0,0 +1,57 @@
+import numpy as np
+
+from sweepai.core import retrieval_session
+from sweepai.core.entities import Snippet
+from sweepai.core.path_index import PathIndex
+from sweepai.core.retrieval_session import RetrievalSession
+from sweepai.utils.search_utils import search_snippets
+
+
+class FakeClonedRepo:
+    branch = "main"
+
+    def __init__(self):
+        self.calls = {"get_file_contents": 0, "get_tree_and_file_list": 0}
+
+    def get_file_contents(self, file_path, ref=None):
+        self.calls["get_file_contents"] += 1
+        return f"contents of {file_path}\n"
+
+    def get_tree_and_file_list(self, snippet_paths, excluded_directories=None):
+        self.calls["get_tree_and_file_list"] += 1
+        return f"tree excluding {excluded_directories}"
+
+
+def test_repeated_searches_reuse_work(monkeypatch):
+    searched_queries = []
+
+    def get_relevant_snippets_batch(cloned_repo, queries, n_results, **kwargs):
+        searched_queries.extend(queries)
+        return [
+            [Snippet(content="", start=0, end=1, file_path="src/a.py")] for _ in queries
+        ]
+
+    monkeypatch.setattr(
+        retrieval_session, "get_relevant_snippets_batch", get_relevant_snippets_batch
+    )
+    monkeypatch.setattr(
+        retrieval_session, "embedding_function", lambda texts: np.ones((len(texts), 2))
+    )
+    monkeypatch.setattr(RetrievalSession, "index", None)
+    monkeypatch.setattr(
+        RetrievalSession, "path_index", PathIndex.from_paths(["docs/c.md", "src/a.py"])
+    )
+    cloned_repo = FakeClonedRepo()
+    session = RetrievalSession(cloned_repo)
+
+    snippets, tree = search_snippets(cloned_repo, "fix a", session=session)
+    assert snippets[0].content == "contents of src/a.py\n"
+    snippets, _ = search_snippets(cloned_repo, "see docs/c.md", session=session)
+    assert [snippet.file_path for snippet in snippets] == ["docs/c.md", "src/a.py"]
+    search_snippets(cloned_repo, "fix a", multi_query=["b"], session=session)
+    _, pruned_tree = search_snippets(
+        cloned_repo, "fix a", excluded_directories=["docs"], session=session
+    )
+    assert searched_queries == ["fix a", "see docs/c.md", "b"]
+    assert cloned_repo.calls == {"get_file_contents": 2, "get_tree_and_file_list": 4}
+    assert pruned_tree == "tree excluding ['docs']"
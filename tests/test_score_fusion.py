@@ -0,0 +1,14 @@
+import numpy as np
+
+from sweepai.core.score_fusion import fuse_scores, lexical_scores_to_array
+
+
+def test_fuse_scores():
+    lexical_scores = lexical_scores_to_array(
+        {"b.py:0:10": 1.0, "missing": 1.0}, {"a.py:0:10": 0, "b.py:0:10": 1}, 3
+    )
+    assert np.allclose(lexical_scores, [0.3, 1.0, 0.3])
+    code_scores = np.array([0.5, 0.1, 0.5])
+    vector_scores = np.array([0.9, 0.2, 0.1])
+    assert fuse_scores(code_scores, vector_scores, lexical_scores, k=2).tolist() == [0, 1]
+    assert fuse_scores(code_scores, vector_scores, lexical_scores, k=5, weights=(1, 0, 0)).tolist() == [0, 2, 1]